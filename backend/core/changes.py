@@ -0,0 +1,137 @@
+"""
+Change-data-capture outbox.
+
+Every write to customers, points/wallet transactions and orders appends a compact
+event to the `change_events` collection:
+
+    {"user_id", "seq", "entity", "entity_id", "op", "fields", "customer_id", "created_at"}
+
+`op` is insert / update / delete; `fields` lists the fields an update touched and
+`customer_id` ties ledger rows and orders to their customer. A bulk write that
+touches many rows records one event with `entity_id` null.
+
+`seq` is a per-restaurant sequence allocated from `counters`, so consumers (the
+dashboard, MyGenie sync, segment counts, exports) can poll `GET /changes?since=<seq>`
+and apply only what changed instead of re-reading whole collections.
+
+Sequence numbers are allocated before the event is inserted, so a concurrent
+writer can make seq N+1 visible before seq N. `read_changes` therefore stops at
+a gap until it is older than SETTLE_SECONDS; a gap that old is a write that
+failed after allocating and is skipped.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Iterable, List, Optional
+import logging
+
+from pymongo import ReturnDocument
+
+from core.customer_cards import apply_changes
+from core.database import db
+
+logger = logging.getLogger(__name__)
+
+# Entities recorded in the outbox
+CUSTOMER = "customer"
+POINTS_TRANSACTION = "points_transaction"
+WALLET_TRANSACTION = "wallet_transaction"
+ORDER = "order"
+
+# Events are kept this long; consumers further behind must resync
+RETENTION_DAYS = 7
+SETTLE_SECONDS = 5
+
+
+def changed_fields(update: dict) -> List[str]:
+    """Field names touched by a Mongo update document ({"$set": {...}, "$inc": {...}})."""
+    fields = set()
+    for op, spec in update.items():
+        if op.startswith("$") and isinstance(spec, dict):
+            fields.update(spec.keys())
+        elif not op.startswith("$"):
+            fields.add(op)
+    return sorted(fields)
+
+
+def change(entity: str, entity_id: Optional[str], op: str = "update",
+           fields: Optional[Iterable[str]] = None, customer_id: Optional[str] = None) -> dict:
+    """Build one event for record_changes."""
+    event = {"entity": entity, "entity_id": entity_id, "op": op}
+    if fields is not None:
+        event["fields"] = sorted(fields)
+    if customer_id is not None:
+        event["customer_id"] = customer_id
+    return event
+
+
+async def _allocate(user_id: str, count: int) -> int:
+    """Reserve `count` sequence numbers; returns the first."""
+    counter = await db.counters.find_one_and_update(
+        {"_id": f"changes:{user_id}"},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"] - count + 1
+
+
+async def record_changes(user_id: str, events: List[dict]):
+    """Append events to the outbox. Failures are logged, never raised: the
+    business write has already happened and must not be reported as failed."""
+    if not events:
+        return
+    apply_changes(user_id, events)
+    try:
+        first = await _allocate(user_id, len(events))
+        now = datetime.now(timezone.utc)
+        docs = [
+            {
+                "user_id": user_id,
+                "seq": first + i,
+                **event,
+                "created_at": now.isoformat(),
+                "expires_at": now + timedelta(days=RETENTION_DAYS)
+            }
+            for i, event in enumerate(events)
+        ]
+        await db.change_events.insert_many(docs, ordered=False)
+    except Exception as e:
+        logger.error(f"Failed to record {len(events)} change events for {user_id}: {e}")
+
+
+async def record_change(user_id: str, entity: str, entity_id: Optional[str], op: str = "update",
+                        fields: Optional[Iterable[str]] = None, customer_id: Optional[str] = None):
+    await record_changes(user_id, [change(entity, entity_id, op, fields, customer_id)])
+
+
+async def read_changes(user_id: str, since: int, limit: int = 500, entity: Optional[str] = None) -> dict:
+    """Events after `since`, in sequence order, up to the first unsettled gap."""
+    oldest = await db.change_events.find_one(
+        {"user_id": user_id}, {"_id": 0, "seq": 1}, sort=[("seq", 1)]
+    )
+    # The consumer's cursor points at events that have already expired
+    reset = bool(since and oldest and since < oldest["seq"] - 1)
+
+    rows = await db.change_events.find(
+        {"user_id": user_id, "seq": {"$gt": since}},
+        {"_id": 0, "user_id": 0, "expires_at": 0}
+    ).sort("seq", 1).limit(limit).to_list(limit)
+
+    settled_before = (datetime.now(timezone.utc) - timedelta(seconds=SETTLE_SECONDS)).isoformat()
+    events = []
+    expected = since + 1
+    for row in rows:
+        if row["seq"] != expected and row["created_at"] > settled_before:
+            break
+        events.append(row)
+        expected = row["seq"] + 1
+
+    cursor = events[-1]["seq"] if events else since
+    has_more = len(events) < len(rows) or len(rows) == limit
+    if entity:
+        events = [e for e in events if e["entity"] == entity]
+    return {
+        "changes": events,
+        "next_since": cursor,
+        "has_more": has_more,
+        "reset": reset
+    }
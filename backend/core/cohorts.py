@@ -0,0 +1,314 @@
+"""
+Monthly cohort retention.
+
+A customer's cohort is the month of their first bill; they are retained in month
+N if they billed again N months later. Bills are orders plus POS payments that
+only left an earn ledger row (the same activity the daily rollups count).
+
+State per restaurant:
+
+  cohort_members  {user_id, gen, customer_id, first_month, months: [...]}  one per customer
+  cohort_meta     {user_id, gen, watermark, matrix: {first_month: {offset: customers}}}
+
+Months are stored as integers (year * 12 + month - 1). A full build reduces the
+activity to one row per customer with an aggregation and fills the matrix with a
+NumPy pass. Later refreshes only aggregate bills created after `watermark`, add
+months a member had not been seen in and advance the watermark. A bill dated
+before its customer's first month (a backdated import) shifts that cohort, so it
+triggers a full rebuild instead.
+
+A refresh leases its window on `cohort_meta.refreshing` together with the matrix
+increments it computed, writes the member upserts (idempotent), and only then
+adds the increments and moves the watermark in one conditional update. If it
+dies in between, the next refresh after the lease finishes that window from the
+recorded increments, so no bills are skipped or counted twice.
+
+A full build is claimed through `cohort_meta` (core.rebuild_claims) so only one
+process builds at a time; others wait for it. Members are written under a new
+generation and `cohort_meta` switches to it (matrix, watermark and gen in one
+update) before the old generation is deleted. Refreshes only write while the
+generation they read is still live, so one that overlaps a rebuild is dropped
+and its bills are picked up again after the rebuild's watermark.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+import logging
+import time
+import uuid
+
+import numpy as np
+from pymongo import UpdateOne
+
+from core.database import db
+from core.rebuild_claims import abandon_rebuild, claim_rebuild, finish_rebuild, wait_for_rebuild
+
+logger = logging.getLogger(__name__)
+
+# Bills newer than this may still be in flight from concurrent writers
+SETTLE_SECONDS = 5
+AGGREGATION_BATCH_SIZE = 10000
+WRITE_BATCH_SIZE = 5000
+REBUILD_LEASE_SECONDS = 600
+REFRESH_LEASE_SECONDS = 120
+# How long a reader waits for another process's rebuild before serving what it has
+REBUILD_WAIT_SECONDS = 30
+
+
+def month_index(year_month: str) -> int:
+    """'2025-03' -> 2025 * 12 + 2"""
+    return int(year_month[:4]) * 12 + int(year_month[5:7]) - 1
+
+
+def month_label(index: int) -> str:
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def _activity_pipeline(user_id: str, after: Optional[str], until: str) -> list:
+    """Distinct billing months per customer for bills created in (after, until]."""
+    created = {"$lte": until}
+    if after:
+        created["$gt"] = after
+    month = {"$substrBytes": ["$created_at", 0, 7]}
+    return [
+        {"$match": {"user_id": user_id, "customer_id": {"$ne": None}, "created_at": created}},
+        {"$project": {"_id": 0, "customer_id": 1, "month": month}},
+        {"$unionWith": {"coll": "points_transactions", "pipeline": [
+            {"$match": {"user_id": user_id, "transaction_type": "earn", "order_id": {"$exists": False},
+                        "bill_amount": {"$gt": 0}, "created_at": created}},
+            {"$project": {"_id": 0, "customer_id": 1, "month": month}}
+        ]}},
+        {"$group": {"_id": "$customer_id", "months": {"$addToSet": "$month"}}}
+    ]
+
+
+async def _load_activity(user_id: str, after: Optional[str], until: str) -> dict:
+    """customer_id -> sorted month indexes billed in the window."""
+    activity = {}
+    cursor = db.orders.aggregate(
+        _activity_pipeline(user_id, after, until), allowDiskUse=True, batchSize=AGGREGATION_BATCH_SIZE
+    )
+    async for row in cursor:
+        months = sorted(month_index(m) for m in row["months"] if m and len(m) == 7)
+        if months:
+            activity[row["_id"]] = months
+    return activity
+
+
+def build_matrix(months_per_customer: list) -> tuple:
+    """Cohort matrix from per-customer month lists in one vectorized pass.
+    Returns (first_months, matrix, base) where matrix[c, k] counts customers of
+    cohort base + c active k months after acquisition."""
+    if not months_per_customer:
+        return np.array([], dtype=np.int64), np.zeros((0, 0), dtype=np.int64), 0
+    lengths = np.array([len(m) for m in months_per_customer], dtype=np.int64)
+    flat = np.fromiter((m for months in months_per_customer for m in months), dtype=np.int64, count=int(lengths.sum()))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    first = np.minimum.reduceat(flat, starts)
+    offsets = flat - np.repeat(first, lengths)
+
+    base = int(first.min())
+    matrix = np.zeros((int(first.max()) - base + 1, int(offsets.max()) + 1), dtype=np.int64)
+    np.add.at(matrix, (np.repeat(first, lengths) - base, offsets), 1)
+    return first, matrix, base
+
+
+def _matrix_to_doc(matrix: np.ndarray, base: int) -> dict:
+    return {
+        str(base + c): {str(k): int(n) for k, n in enumerate(row) if n}
+        for c, row in enumerate(matrix) if row.any()
+    }
+
+
+async def rebuild_cohorts(user_id: str) -> dict:
+    """Recompute a restaurant's cohort members and matrix from all bills. If another
+    process is already rebuilding, waits for it and returns its result."""
+    building, _ = await claim_rebuild(db.cohort_meta, user_id, REBUILD_LEASE_SECONDS)
+    if not building:
+        meta = await wait_for_rebuild(db.cohort_meta, user_id, REBUILD_WAIT_SECONDS) or {}
+        meta.pop("building", None)
+        meta.pop("refreshing", None)
+        return meta if "matrix" in meta else {"user_id": user_id, "matrix": {}, "updated_at": None}
+    gen = building["gen"]
+
+    started = time.perf_counter()
+    try:
+        live = await db.cohort_meta.find_one({"user_id": user_id}, {"_id": 0, "gen": 1})
+        # Members of builds that died or were superseded; only the live generation is read
+        await db.cohort_members.delete_many({"user_id": user_id, "gen": {"$nin": [live.get("gen"), gen]}})
+
+        until = (datetime.now(timezone.utc) - timedelta(seconds=SETTLE_SECONDS)).isoformat()
+        activity = await _load_activity(user_id, None, until)
+        customer_ids = list(activity)
+        first, matrix, base = build_matrix([activity[c] for c in customer_ids])
+
+        for i in range(0, len(customer_ids), WRITE_BATCH_SIZE):
+            await db.cohort_members.insert_many([
+                {"user_id": user_id, "gen": gen, "customer_id": cid, "first_month": int(first[j]),
+                 "months": activity[cid]}
+                for j, cid in enumerate(customer_ids[i:i + WRITE_BATCH_SIZE], start=i)
+            ], ordered=False)
+
+        now = datetime.now(timezone.utc).isoformat()
+        meta = {
+            "user_id": user_id,
+            "gen": gen,
+            "watermark": until,
+            "matrix": _matrix_to_doc(matrix, base),
+            "rebuilt_at": now,
+            "updated_at": now
+        }
+        # A refresh window still open on the old generation is dropped with it
+        previous = await finish_rebuild(db.cohort_meta, user_id, gen, refreshing=None, **meta)
+    except BaseException:
+        await abandon_rebuild(db.cohort_meta, user_id, gen)
+        await db.cohort_members.delete_many({"user_id": user_id, "gen": gen})
+        raise
+    if previous is None:
+        # Claim lost (lease expired, or reset_cohorts during the build): discard this one
+        await db.cohort_members.delete_many({"user_id": user_id, "gen": gen})
+        return await refresh_cohorts(user_id)
+
+    await db.cohort_members.delete_many({"user_id": user_id, "gen": previous.get("gen")})
+    logger.info(f"Rebuilt cohorts for {user_id}: {len(customer_ids)} customers in {time.perf_counter() - started:.1f}s")
+    return meta
+
+
+async def refresh_cohorts(user_id: str) -> dict:
+    """Fold bills created since the last refresh into the matrix (full build the first time)."""
+    meta = await db.cohort_meta.find_one({"user_id": user_id}, {"_id": 0})
+    if not meta or "matrix" not in meta:
+        return await rebuild_cohorts(user_id)
+    meta.pop("building", None)
+    gen = meta.get("gen")
+    now = datetime.now(timezone.utc)
+
+    window = meta.pop("refreshing", None)
+    if window:
+        if window["lease_until"] >= now.isoformat():
+            # Another refresh holds the window; serve the matrix as it is
+            return meta
+        # A refresh died after claiming its window: finish it from what it recorded
+        taken = await _claim_window(user_id, gen, meta["watermark"], window["until"], window["increments"],
+                                    expired_token=window["token"])
+        if taken:
+            activity = await _load_activity(user_id, meta["watermark"], window["until"])
+            await _apply_window(user_id, gen, meta["watermark"], taken, [
+                _member_op(user_id, gen, cid, months[0], months) for cid, months in activity.items()
+            ])
+        return await refresh_cohorts(user_id)
+
+    until = (now - timedelta(seconds=SETTLE_SECONDS)).isoformat()
+    activity = await _load_activity(user_id, meta["watermark"], until)
+    if not activity:
+        return meta
+
+    members = {}
+    ids = list(activity)
+    for i in range(0, len(ids), WRITE_BATCH_SIZE):
+        async for m in db.cohort_members.find(
+            {"user_id": user_id, "gen": gen, "customer_id": {"$in": ids[i:i + WRITE_BATCH_SIZE]}},
+            {"_id": 0, "customer_id": 1, "first_month": 1, "months": 1}
+        ):
+            members[m["customer_id"]] = m
+
+    # Only new cells are $inc'ed so a concurrent rebuild is not overwritten wholesale
+    matrix = meta["matrix"]
+    increments = {}
+    ops = []
+    for cid, months in activity.items():
+        member = members.get(cid)
+        if member and months[0] < member["first_month"]:
+            logger.info(f"Backdated bill for customer {cid} moves its cohort; rebuilding cohorts for {user_id}")
+            return await rebuild_cohorts(user_id)
+        first = member["first_month"] if member else months[0]
+        seen = set(member["months"]) if member else set()
+        new_months = [m for m in months if m not in seen]
+        if not new_months:
+            continue
+        row = matrix.setdefault(str(first), {})
+        for m in new_months:
+            row[str(m - first)] = row.get(str(m - first), 0) + 1
+            increments[(first, m - first)] = increments.get((first, m - first), 0) + 1
+        ops.append(_member_op(user_id, gen, cid, first, new_months))
+
+    # Claim the window; a concurrent refresh that claimed it first wins, and so
+    # does a rebuild that switched the generation
+    window = await _claim_window(user_id, gen, meta["watermark"], until,
+                                 [[first, offset, n] for (first, offset), n in increments.items()])
+    if not window:
+        meta = await db.cohort_meta.find_one({"user_id": user_id}, {"_id": 0, "building": 0, "refreshing": 0})
+        return meta if meta and "matrix" in meta else await refresh_cohorts(user_id)
+    updated_at = await _apply_window(user_id, gen, meta["watermark"], window, ops)
+    if updated_at:
+        meta.update(watermark=until, updated_at=updated_at)
+    return meta
+
+
+def _member_op(user_id: str, gen: Optional[str], customer_id: str, first: int, months: list) -> UpdateOne:
+    """Idempotent member upsert: reapplying a window adds nothing twice."""
+    return UpdateOne(
+        {"user_id": user_id, "gen": gen, "customer_id": customer_id},
+        {"$setOnInsert": {"first_month": first}, "$addToSet": {"months": {"$each": months}}},
+        upsert=True
+    )
+
+
+async def _claim_window(user_id: str, gen: Optional[str], watermark: str, until: str, increments: list,
+                        expired_token: Optional[str] = None) -> Optional[dict]:
+    """Lease the window (watermark, until] on `cohort_meta.refreshing`, recording
+    the matrix increments it will add so another process can finish it if this
+    one dies. The watermark itself only moves when the window is applied."""
+    now = datetime.now(timezone.utc)
+    window = {
+        "token": uuid.uuid4().hex,
+        "until": until,
+        "increments": increments,
+        "lease_until": (now + timedelta(seconds=REFRESH_LEASE_SECONDS)).isoformat()
+    }
+    query = {"user_id": user_id, "gen": gen, "watermark": watermark}
+    if expired_token:
+        query.update({"refreshing.token": expired_token, "refreshing.lease_until": {"$lt": now.isoformat()}})
+    else:
+        query["refreshing"] = None
+    claimed = await db.cohort_meta.update_one(query, {"$set": {"refreshing": window}})
+    return window if claimed.modified_count else None
+
+
+async def _apply_window(user_id: str, gen: Optional[str], watermark: str, window: dict, ops: list) -> Optional[str]:
+    """Write a claimed window's members, then add its increments and move the
+    watermark in one update, only while the claim is still ours. Returns the new
+    updated_at, or None if a rebuild or a takeover dropped the window."""
+    for i in range(0, len(ops), WRITE_BATCH_SIZE):
+        await db.cohort_members.bulk_write(ops[i:i + WRITE_BATCH_SIZE], ordered=False)
+    updated_at = datetime.now(timezone.utc).isoformat()
+    update = {"$set": {"watermark": window["until"], "updated_at": updated_at}, "$unset": {"refreshing": ""}}
+    if window["increments"]:
+        update["$inc"] = {f"matrix.{first}.{offset}": n for first, offset, n in window["increments"]}
+    applied = await db.cohort_meta.update_one(
+        {"user_id": user_id, "gen": gen, "watermark": watermark, "refreshing.token": window["token"]}, update
+    )
+    return updated_at if applied.modified_count else None
+
+
+async def reset_cohorts(user_id: str):
+    """Force a full rebuild on next read (after merges repoint orders to other customers)."""
+    await db.cohort_meta.delete_one({"user_id": user_id})
+
+
+def format_cohorts(meta: dict, months: int) -> dict:
+    """The last `months` cohorts with per-offset counts and retention percentages."""
+    now = datetime.now(timezone.utc)
+    current = now.year * 12 + now.month - 1
+    cohorts = []
+    for first in range(current - months + 1, current + 1):
+        row = meta["matrix"].get(str(first), {})
+        size = row.get("0", 0)
+        span = current - first + 1
+        active = [row.get(str(k), 0) for k in range(span)]
+        cohorts.append({
+            "cohort": month_label(first),
+            "customers": size,
+            "active": active,
+            "retention": [round(n / size * 100, 1) if size else 0.0 for n in active]
+        })
+    return {"months": months, "cohorts": cohorts, "updated_at": meta.get("updated_at")}
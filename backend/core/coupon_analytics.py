@@ -0,0 +1,129 @@
+"""
+Coupon performance analytics.
+
+Everything is computed from `coupon_usage` in the database:
+
+  get_coupon_summary   one $facet pipeline: redemptions, unique customers, discount
+                       given, attributed order revenue and the redemption curve
+  get_coupon_usage_page  usage rows newest first, keyset-paginated on (used_at, id),
+                       with customer name/phone joined by $lookup
+
+Usage cursors are "<used_at>|<id>" of the last row returned.
+"""
+from typing import Optional
+
+from core.database import analytics_db
+
+# Length of the used_at prefix that identifies a bucket
+CURVE_BUCKETS = {"day": 10, "month": 7}
+
+
+async def get_coupon_summary(coupon_id: str, bucket: str = "day") -> dict:
+    """Totals and redemption curve for one coupon in a single aggregation."""
+    rows = await analytics_db.coupon_usage.aggregate([
+        {"$match": {"coupon_id": coupon_id}},
+        {"$facet": {
+            "totals": [
+                {"$group": {
+                    "_id": None,
+                    "redemptions": {"$sum": 1},
+                    "discount_given": {"$sum": {"$ifNull": ["$discount_applied", 0]}},
+                    "order_revenue": {"$sum": {"$ifNull": ["$order_value", 0]}},
+                    "first_used_at": {"$min": "$used_at"},
+                    "last_used_at": {"$max": "$used_at"}
+                }}
+            ],
+            "customers": [
+                {"$group": {"_id": "$customer_id"}},
+                {"$count": "unique_customers"}
+            ],
+            "channels": [
+                {"$group": {"_id": "$channel", "redemptions": {"$sum": 1}}},
+                {"$sort": {"redemptions": -1}}
+            ],
+            "curve": [
+                {"$group": {
+                    "_id": {"$substrBytes": ["$used_at", 0, CURVE_BUCKETS[bucket]]},
+                    "redemptions": {"$sum": 1},
+                    "discount_given": {"$sum": {"$ifNull": ["$discount_applied", 0]}},
+                    "order_revenue": {"$sum": {"$ifNull": ["$order_value", 0]}}
+                }},
+                {"$sort": {"_id": 1}}
+            ]
+        }}
+    ], allowDiskUse=True).to_list(1)
+    facets = rows[0] if rows else {}
+
+    totals = (facets.get("totals") or [{}])[0]
+    redemptions = totals.get("redemptions", 0)
+    discount = totals.get("discount_given", 0)
+    revenue = totals.get("order_revenue", 0)
+    cumulative = 0
+    curve = []
+    for row in facets.get("curve", []):
+        cumulative += row["redemptions"]
+        curve.append({
+            "period": row["_id"],
+            "redemptions": row["redemptions"],
+            "cumulative_redemptions": cumulative,
+            "discount_given": round(row["discount_given"], 2),
+            "order_revenue": round(row["order_revenue"], 2)
+        })
+
+    return {
+        "redemptions": redemptions,
+        "unique_customers": (facets.get("customers") or [{}])[0].get("unique_customers", 0),
+        "discount_given": round(discount, 2),
+        "order_revenue": round(revenue, 2),
+        "avg_discount": round(discount / redemptions, 2) if redemptions else 0.0,
+        "avg_order_value": round(revenue / redemptions, 2) if redemptions else 0.0,
+        "first_used_at": totals.get("first_used_at"),
+        "last_used_at": totals.get("last_used_at"),
+        "by_channel": [{"channel": c["_id"], "redemptions": c["redemptions"]} for c in facets.get("channels", [])],
+        "curve": curve
+    }
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    used_at, _, usage_id = cursor.partition("|")
+    if not used_at or not usage_id:
+        raise ValueError("Invalid cursor")
+    return used_at, usage_id
+
+
+async def get_coupon_usage_page(coupon_id: str, user_id: str, limit: int = 50,
+                                cursor: Optional[str] = None) -> dict:
+    """Usage rows newer-first after `cursor`, each joined with its customer's name and phone."""
+    match = {"coupon_id": coupon_id}
+    if cursor:
+        used_at, usage_id = _decode_cursor(cursor)
+        match["$or"] = [
+            {"used_at": {"$lt": used_at}},
+            {"used_at": used_at, "id": {"$lt": usage_id}}
+        ]
+
+    usage = await analytics_db.coupon_usage.aggregate([
+        {"$match": match},
+        {"$sort": {"used_at": -1, "id": -1}},
+        {"$limit": limit + 1},
+        {"$lookup": {
+            "from": "customers",
+            "localField": "customer_id",
+            "foreignField": "id",
+            "pipeline": [
+                {"$match": {"user_id": user_id}},
+                {"$project": {"_id": 0, "name": 1, "phone": 1}}
+            ],
+            "as": "customer"
+        }},
+        {"$set": {
+            "customer_name": {"$first": "$customer.name"},
+            "customer_phone": {"$first": "$customer.phone"}
+        }},
+        {"$project": {"_id": 0, "customer": 0}}
+    ]).to_list(limit + 1)
+
+    has_more = len(usage) > limit
+    usage = usage[:limit]
+    next_cursor = f"{usage[-1]['used_at']}|{usage[-1]['id']}" if has_more else None
+    return {"usage": usage, "next_cursor": next_cursor, "has_more": has_more}
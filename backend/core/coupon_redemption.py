@@ -0,0 +1,141 @@
+"""
+Atomic coupon redemption.
+
+`redeem_coupon` is the one way a coupon gets used (`POST /coupons/apply` and the
+POS payment webhook). Limits are enforced by conditional writes, not by
+read-then-check:
+
+  per customer   `coupon_customer_usage` {_id: "<coupon_id>:<customer_id>", count}
+                 $inc'ed only while count < per_user_limit. A missing counter is
+                 seeded from the customer's existing `coupon_usage` rows first.
+  overall        coupons.total_used $inc'ed only while total_used < usage_limit
+                 (no usage_limit means unlimited)
+
+If the overall limit is hit after the customer's counter was taken, the counter
+is given back. A duplicate-customer merge folds the duplicates' counters into the
+survivor's (`merge_customer_usage`). The usage row is written last. Callers that fail after
+redeeming (e.g. the order write raises) call `rollback_redemption` to undo all
+three.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+import logging
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+from core.database import db
+from core.helpers import coupon_discount, coupon_rejection
+
+logger = logging.getLogger(__name__)
+
+
+class CouponRejected(ValueError):
+    """The coupon cannot be used on this order; the message says why."""
+
+
+async def _take_customer_use(coupon: dict, customer_id: str) -> bool:
+    counter_id = f"{coupon['id']}:{customer_id}"
+    limit = coupon.get("per_user_limit", 1)
+    for _ in range(2):
+        taken = await db.coupon_customer_usage.update_one(
+            {"_id": counter_id, "count": {"$lt": limit}}, {"$inc": {"count": 1}}
+        )
+        if taken.modified_count:
+            return True
+        if await db.coupon_customer_usage.count_documents({"_id": counter_id}, limit=1):
+            return False
+        # First redemption since counters were introduced: start from the usage history
+        used = await db.coupon_usage.count_documents({"coupon_id": coupon["id"], "customer_id": customer_id})
+        try:
+            await db.coupon_customer_usage.insert_one({
+                "_id": counter_id, "coupon_id": coupon["id"], "customer_id": customer_id, "count": used
+            })
+        except DuplicateKeyError:
+            pass
+    return False
+
+
+async def _take_overall_use(coupon: dict) -> bool:
+    taken = await db.coupons.update_one(
+        {"id": coupon["id"], "$or": [
+            {"usage_limit": None},
+            {"usage_limit": 0},
+            {"$expr": {"$lt": [{"$ifNull": ["$total_used", 0]}, "$usage_limit"]}}
+        ]},
+        {"$inc": {"total_used": 1}}
+    )
+    return bool(taken.modified_count)
+
+
+async def redeem_coupon(user_id: str, code: str, customer_id: str, order_value: float, channel: str,
+                        coupon: Optional[dict] = None, order_id: Optional[str] = None) -> dict:
+    """Validate and use a coupon for one order. Returns the redemption (pass it to
+    rollback_redemption to undo). Raises CouponRejected."""
+    if coupon is None:
+        coupon = await db.coupons.find_one(
+            {"user_id": user_id, "code": code.upper(), "is_active": True}, {"_id": 0}
+        )
+    if not coupon:
+        raise CouponRejected("Invalid coupon code")
+
+    # Static rules; the per-customer limit is checked by the counter below
+    reason = coupon_rejection(coupon, customer_id, order_value, channel, customer_uses=0)
+    if reason:
+        raise CouponRejected(reason)
+
+    if not await _take_customer_use(coupon, customer_id):
+        raise CouponRejected("You have already used this coupon")
+    if not await _take_overall_use(coupon):
+        await db.coupon_customer_usage.update_one(
+            {"_id": f"{coupon['id']}:{customer_id}"}, {"$inc": {"count": -1}}
+        )
+        raise CouponRejected("Coupon usage limit reached")
+
+    discount = round(coupon_discount(coupon, order_value), 2)
+    usage = {
+        "id": str(uuid.uuid4()),
+        "coupon_id": coupon["id"],
+        "customer_id": customer_id,
+        "order_value": order_value,
+        "discount_applied": discount,
+        "channel": channel,
+        "used_at": datetime.now(timezone.utc).isoformat()
+    }
+    if order_id:
+        usage["order_id"] = order_id
+    await db.coupon_usage.insert_one(usage)
+    usage.pop("_id", None)
+    return {
+        **usage,
+        "code": coupon["code"],
+        "discount": discount,
+        "final_amount": round(order_value - discount, 2)
+    }
+
+
+async def merge_customer_usage(survivor_id: str, duplicate_ids: list):
+    """Fold merged duplicates' per-customer counters into the survivor's, after
+    their `coupon_usage` rows were repointed. A survivor without a counter for a
+    coupon seeds it from those rows on its next redemption, so the duplicate's
+    counter is only dropped. Each counter is added before it is deleted: an
+    interrupted merge can over-count a use, never give one back."""
+    async for counter in db.coupon_customer_usage.find({"customer_id": {"$in": duplicate_ids}}):
+        if counter.get("count"):
+            await db.coupon_customer_usage.update_one(
+                {"_id": f"{counter['coupon_id']}:{survivor_id}"}, {"$inc": {"count": counter["count"]}}
+            )
+        await db.coupon_customer_usage.delete_one({"_id": counter["_id"]})
+
+
+async def rollback_redemption(redemption: dict):
+    """Compensate a redemption whose order failed. Errors are logged, not raised,
+    so the caller still reports the original failure."""
+    try:
+        await db.coupon_usage.delete_one({"id": redemption["id"]})
+        await db.coupons.update_one({"id": redemption["coupon_id"]}, {"$inc": {"total_used": -1}})
+        await db.coupon_customer_usage.update_one(
+            {"_id": f"{redemption['coupon_id']}:{redemption['customer_id']}"}, {"$inc": {"count": -1}}
+        )
+    except Exception as e:
+        logger.error(f"Failed to roll back coupon redemption {redemption['id']}: {e}")
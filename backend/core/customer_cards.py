@@ -0,0 +1,146 @@
+"""
+Hot customer card cache for POS lookups.
+
+Regulars are looked up at the till many times a day by phone. `get_card` keeps a
+bounded, per-process LRU of compact cards (points, tier, wallet, visits,
+allergies, favorites) keyed by (user_id, canonical phone):
+
+  local writes    `record_changes` passes every outbox event to `apply_changes`,
+                  which drops the cards of the customers it touched (a bulk
+                  event without an entity id drops the whole restaurant)
+  other workers   `sync_from_outbox` runs on the scheduler every SYNC_INTERVAL_SECONDS,
+                  reads `change_events` written since its last poll and applies
+                  them the same way
+
+A card read that raced with an invalidation of its restaurant is returned but
+not stored. Cards also expire after CARD_TTL_SECONDS as a backstop for writes
+that bypass the outbox.
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional
+import logging
+import os
+import time
+
+from core.database import db
+from core.helpers import normalize_phone, phone_query
+
+logger = logging.getLogger(__name__)
+
+MAX_CARDS = int(os.environ.get('CUSTOMER_CARD_CACHE_SIZE', '20000'))
+CARD_TTL_SECONDS = float(os.environ.get('CUSTOMER_CARD_TTL_SECONDS', '300'))
+SYNC_INTERVAL_SECONDS = 2
+# Outbox events are re-read this far back, since created_at is stamped before insert
+SYNC_OVERLAP_SECONDS = 5
+
+CARD_PROJECTION = {
+    "_id": 0, "id": 1, "name": 1, "phone": 1, "tier": 1, "total_points": 1, "wallet_balance": 1,
+    "total_visits": 1, "total_spent": 1, "allergies": 1, "favorites": 1, "last_visit": 1
+}
+
+# Outbox entities whose events change a customer's card
+CARD_ENTITIES = {"customer", "points_transaction", "wallet_transaction", "order"}
+
+_cards: "OrderedDict[tuple, tuple]" = OrderedDict()    # (user_id, phone) -> (card, stored_at)
+_keys_by_customer = {}                                  # (user_id, customer_id) -> (user_id, phone)
+_generation = {}                                        # user_id -> invalidation count
+stats = {"hits": 0, "misses": 0, "not_found": 0, "invalidations": 0, "evictions": 0, "expired": 0}
+
+
+def _phone_key(phone: str) -> str:
+    return normalize_phone(phone) or phone
+
+
+def _drop(key: tuple):
+    entry = _cards.pop(key, None)
+    if entry:
+        _keys_by_customer.pop((key[0], entry[0]["id"]), None)
+
+
+async def get_card(user_id: str, phone: str) -> Optional[dict]:
+    """A customer's card by phone, from cache or one indexed read. None if not registered."""
+    key = (user_id, _phone_key(phone))
+    entry = _cards.get(key)
+    if entry:
+        if time.monotonic() - entry[1] < CARD_TTL_SECONDS:
+            _cards.move_to_end(key)
+            stats["hits"] += 1
+            return entry[0]
+        _drop(key)
+        stats["expired"] += 1
+
+    stats["misses"] += 1
+    generation = _generation.get(user_id, 0)
+    card = await db.customers.find_one(phone_query(user_id, phone), CARD_PROJECTION)
+    if not card:
+        # Not cached: the customer may be created by the next request
+        stats["not_found"] += 1
+        return None
+    if _generation.get(user_id, 0) == generation:
+        _cards[key] = (card, time.monotonic())
+        _keys_by_customer[(user_id, card["id"])] = key
+        while len(_cards) > MAX_CARDS:
+            oldest, (old_card, _) = _cards.popitem(last=False)
+            _keys_by_customer.pop((oldest[0], old_card["id"]), None)
+            stats["evictions"] += 1
+    return card
+
+
+def invalidate_customer(user_id: str, customer_id: str):
+    _generation[user_id] = _generation.get(user_id, 0) + 1
+    key = _keys_by_customer.pop((user_id, customer_id), None)
+    if key and _cards.pop(key, None):
+        stats["invalidations"] += 1
+
+
+def invalidate_restaurant(user_id: str):
+    _generation[user_id] = _generation.get(user_id, 0) + 1
+    for key in [k for k in _cards if k[0] == user_id]:
+        _drop(key)
+        stats["invalidations"] += 1
+
+
+def apply_changes(user_id: str, events: List[dict]):
+    """Drop the cards that outbox events touched."""
+    for event in events:
+        if event.get("entity") not in CARD_ENTITIES:
+            continue
+        customer_id = event["entity_id"] if event["entity"] == "customer" else event.get("customer_id")
+        if customer_id:
+            invalidate_customer(user_id, customer_id)
+        else:
+            invalidate_restaurant(user_id)
+            return
+
+
+# Events seen by the previous poll are not applied again when re-read in the overlap
+_sync_state = {"since": datetime.now(timezone.utc).isoformat(), "seen": set()}
+
+
+async def sync_from_outbox():
+    """Apply change events recorded by any worker since the last poll."""
+    now = datetime.now(timezone.utc)
+    floor = (datetime.fromisoformat(_sync_state["since"]) - timedelta(seconds=SYNC_OVERLAP_SECONDS)).isoformat()
+    rows = await db.change_events.find(
+        {"created_at": {"$gte": floor}, "entity": {"$in": list(CARD_ENTITIES)}},
+        {"user_id": 1, "seq": 1, "entity": 1, "entity_id": 1, "customer_id": 1}
+    ).to_list(None)
+
+    seen = set()
+    for row in rows:
+        event_key = (row["user_id"], row["seq"])
+        seen.add(event_key)
+        if event_key not in _sync_state["seen"]:
+            apply_changes(row["user_id"], [row])
+    _sync_state.update(since=now.isoformat(), seen=seen)
+
+
+def card_cache_stats() -> dict:
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        **stats,
+        "entries": len(_cards),
+        "max_entries": MAX_CARDS,
+        "hit_rate": round(stats["hits"] / lookups, 3) if lookups else 0.0
+    }
@@ -0,0 +1,335 @@
+"""
+Duplicate-customer detection and merge.
+
+Customers used to be keyed on the raw phone string, so "+919876543210", "09876543210"
+and "9876543210" could each own a customer with separate points, wallet and order
+history. This job groups a restaurant's customers by canonical phone key, folds each
+group into its oldest member (ledgers rewritten with bulk writes, balances summed)
+and back-fills `phone_e164` so the unique index can be built.
+
+The job runs while POS writes continue, so balances are never copied from a
+snapshot. Each duplicate is tombstoned (`merged_into`), then folded in rounds:
+one guarded write zeroes its balances (held points and open holds included)
+into `merge_pending`, and the survivor `$inc`s them (`$push`es the holds) once,
+recording the round in `merge_rounds.<duplicate id>`. The duplicate is deleted
+only while its balances are still zero, so a write landing on it mid-merge is
+moved by the next round instead of being lost.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+import logging
+
+from pymongo import ReturnDocument, UpdateOne, UpdateMany
+
+from core.database import db
+from core.changes import CUSTOMER, ORDER, POINTS_TRANSACTION, WALLET_TRANSACTION, change, record_changes
+from core.helpers import normalize_phone, is_customer_default, tier_expression
+from core.result_cache import invalidate_tenant
+from core.cohorts import reset_cohorts
+from core.coupon_redemption import merge_customer_usage
+
+logger = logging.getLogger(__name__)
+
+# Collections whose rows point at a customer via `customer_id`
+LEDGER_COLLECTIONS = ["points_transactions", "wallet_transactions", "orders", "coupon_usage", "feedback"]
+
+# Outbox entities whose rows are repointed by a merge
+MERGED_ENTITIES = [POINTS_TRANSACTION, WALLET_TRANSACTION, ORDER]
+
+# Balances summed across a duplicate group
+SUMMED_FIELDS = ["total_points", "wallet_balance", "total_visits", "total_spent"]
+
+# Moved from each duplicate with $inc; its open holds (core.points_holds) move with held_points
+MOVED_FIELDS = SUMMED_FIELDS + ["held_points"]
+
+# Fields never copied from a duplicate onto the survivor
+SYSTEM_FIELDS = {
+    "_id", "id", "user_id", "created_at", "phone", "phone_e164", "merged_into",
+    "merged_customer_ids", "merge_round", "merge_rounds", "merge_pending",
+}
+
+GROUP_BATCH_SIZE = 100
+# Moves per duplicate before giving up on one that keeps receiving writes
+MAX_FOLD_ROUNDS = 5
+
+
+async def find_duplicate_groups(user_id: str) -> tuple:
+    """Stream a restaurant's customers and group them by canonical phone key.
+    Returns (groups, backfill): groups are lists of 2+ customer stubs sorted oldest
+    first; backfill is [(customer_id, phone_key)] for unique customers whose stored
+    key is missing or stale."""
+    by_key = {}
+    cursor = db.customers.find(
+        {"user_id": user_id, "merged_into": {"$exists": False}},
+        {"_id": 0, "id": 1, "phone": 1, "country_code": 1, "phone_e164": 1, "created_at": 1}
+    )
+    async for stub in cursor:
+        key = normalize_phone(stub.get("phone"), stub.get("country_code") or "+91")
+        if key:
+            by_key.setdefault(key, []).append(stub)
+
+    groups = []
+    backfill = []
+    for key, stubs in by_key.items():
+        if len(stubs) > 1:
+            stubs.sort(key=lambda c: c.get("created_at") or "")
+            groups.append((key, stubs))
+        elif stubs[0].get("phone_e164") != key:
+            backfill.append((stubs[0]["id"], key))
+    return groups, backfill
+
+
+def _merge_profile(survivor: dict, duplicates: list) -> dict:
+    """Profile fields the survivor is missing, filled from its duplicates (oldest first)."""
+    update = {}
+    for dup in duplicates:
+        for field, value in dup.items():
+            if field in SYSTEM_FIELDS or field in MOVED_FIELDS or field == "holds" \
+                    or is_customer_default(field, value):
+                continue
+            if is_customer_default(field, survivor.get(field)) and field not in update:
+                update[field] = value
+    return update
+
+
+# A duplicate with nothing left to move
+EMPTY_BALANCES = {**{f: {"$in": [0, None]} for f in MOVED_FIELDS}, "holds.0": {"$exists": False}}
+
+
+async def _take_balances(survivor_id: str, dup_id: str) -> Optional[dict]:
+    """Move whatever balances and open holds the tombstoned duplicate has into
+    `merge_pending`, zeroing them, in one guarded write. Returns the pending move,
+    or None if there is nothing (left) to move."""
+    taken = await db.customers.find_one_and_update(
+        {"id": dup_id, "merge_pending": {"$exists": False},
+         "$or": [*({f: {"$nin": [0, None]}} for f in MOVED_FIELDS), {"holds.0": {"$exists": True}}]},
+        [{"$set": {
+            "merged_into": survivor_id,
+            "merge_round": {"$add": [{"$ifNull": ["$merge_round", 0]}, 1]},
+            "merge_pending": {
+                "round": {"$add": [{"$ifNull": ["$merge_round", 0]}, 1]},
+                "holds": {"$ifNull": ["$holds", []]},
+                **{f: {"$ifNull": [f"${f}", 0]} for f in MOVED_FIELDS}
+            },
+            "holds": {"$literal": []},
+            **{f: 0 for f in MOVED_FIELDS}
+        }}],
+        projection={"_id": 0, "merge_pending": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    return taken and taken["merge_pending"]
+
+
+async def _apply_balances(survivor_id: str, dup_id: str, pending: dict):
+    """Add a taken move to the survivor once: `merge_rounds.<dup>` records the
+    last round applied, so a rerun after a crash does not add it again."""
+    round_field = f"merge_rounds.{dup_id}"
+    await db.customers.update_one(
+        {"id": survivor_id, round_field: {"$not": {"$gte": pending["round"]}}},
+        {
+            "$inc": {f: pending[f] for f in MOVED_FIELDS if pending.get(f)},
+            "$push": {"holds": {"$each": pending.get("holds") or []}},
+            "$set": {round_field: pending["round"]},
+            "$addToSet": {"merged_customer_ids": dup_id}
+        }
+    )
+    await db.customers.update_one(
+        {"id": dup_id, "merge_pending.round": pending["round"]}, {"$unset": {"merge_pending": ""}}
+    )
+
+
+async def _fold_duplicate(survivor_id: str, dup_id: str) -> bool:
+    """Move a duplicate's balances onto the survivor and delete it. Writes that
+    land on the duplicate meanwhile are moved in a further round. Returns False
+    if the duplicate kept changing and was left tombstoned for the next run."""
+    for _ in range(MAX_FOLD_ROUNDS):
+        dup = await db.customers.find_one({"id": dup_id}, {"_id": 0, "merge_pending": 1})
+        if not dup:
+            return True
+        pending = dup.get("merge_pending") or await _take_balances(survivor_id, dup_id)
+        if pending:
+            await _apply_balances(survivor_id, dup_id, pending)
+            continue
+        deleted = await db.customers.delete_one({
+            "id": dup_id, "merged_into": survivor_id, "merge_pending": {"$exists": False}, **EMPTY_BALANCES
+        })
+        if deleted.deleted_count:
+            return True
+    logger.warning(f"Duplicate customer {dup_id} kept changing during merge; left for the next run")
+    return False
+
+
+async def _refresh_derived(survivor_id: str, settings: dict, last_visit: Optional[str], first_visit: Optional[str]):
+    """Recompute the survivor's tier and average order value from its folded
+    balances, and widen its visit dates to cover the duplicates'."""
+    update = [{"$set": {
+        "tier": tier_expression({"$ifNull": ["$total_points", 0]}, settings),
+        "avg_order_value": {"$cond": [
+            {"$gt": [{"$ifNull": ["$total_visits", 0]}, 0]},
+            {"$round": [{"$divide": [{"$ifNull": ["$total_spent", 0]}, "$total_visits"]}, 2]},
+            0.0
+        ]},
+        "updated_at": {"$literal": datetime.now(timezone.utc).isoformat()}
+    }}]
+    if last_visit:
+        update[0]["$set"]["last_visit"] = {"$max": ["$last_visit", {"$literal": last_visit}]}
+    if first_visit:
+        update[0]["$set"]["first_visit_date"] = {"$min": ["$first_visit_date", {"$literal": first_visit}]}
+    await db.customers.update_one({"id": survivor_id}, update)
+
+
+async def _merge_batch(user_id: str, batch: list, settings: dict) -> dict:
+    """Merge a batch of duplicate groups. Ledger rows are repointed with one bulk
+    write per collection; balances move one duplicate at a time."""
+    ids = [stub["id"] for _, stubs in batch for stub in stubs]
+    docs = {
+        c["id"]: c for c in await db.customers.find({"id": {"$in": ids}}, {"_id": 0}).to_list(len(ids))
+    }
+
+    groups = []
+    ledger_ops = []
+    merge_logs = []
+    dupe_ids = []
+    now = datetime.now(timezone.utc).isoformat()
+
+    for key, stubs in batch:
+        group = [docs[s["id"]] for s in stubs if s["id"] in docs]
+        if len(group) < 2:
+            continue
+        survivor, duplicates = group[0], group[1:]
+        ids_to_fold = [d["id"] for d in duplicates]
+        dupe_ids.extend(ids_to_fold)
+        groups.append((key, survivor, duplicates))
+
+        ledger_ops.append(UpdateMany(
+            {"customer_id": {"$in": ids_to_fold}},
+            {"$set": {"customer_id": survivor["id"]}}
+        ))
+        merge_logs.append({
+            "user_id": user_id,
+            "phone_e164": key,
+            "survivor_id": survivor["id"],
+            "merged_ids": ids_to_fold,
+            "merged_phones": [d.get("phone") for d in duplicates],
+            "created_at": now
+        })
+
+    if not groups:
+        return {"groups_merged": 0, "customers_merged": 0, "ledger_rows_rewritten": 0}
+
+    # 1. Tombstone duplicates so detection and reruns stop treating them as customers
+    for _, survivor, duplicates in groups:
+        await db.customers.update_many(
+            {"id": {"$in": [d["id"] for d in duplicates]}, "merged_into": {"$exists": False}},
+            {"$set": {"merged_into": survivor["id"]}}
+        )
+
+    # 2. Repoint ledger rows (idempotent)
+    rewritten = 0
+    for collection in LEDGER_COLLECTIONS:
+        result = await db[collection].bulk_write(ledger_ops, ordered=False)
+        rewritten += result.modified_count
+    # Per-customer coupon limits follow the repointed coupon_usage rows
+    for _, survivor, duplicates in groups:
+        await merge_customer_usage(survivor["id"], [d["id"] for d in duplicates])
+
+    # 3. Fold balances into survivors with relative updates, deleting each
+    #    duplicate once nothing is left on it; then fill profile gaps
+    keyed = []
+    for key, survivor, duplicates in groups:
+        folded = [await _fold_duplicate(survivor["id"], dup["id"]) for dup in duplicates]
+        if all(folded):
+            keyed.append((key, survivor))
+        profile = _merge_profile(survivor, duplicates)
+        if profile:
+            await db.customers.update_one({"id": survivor["id"]}, {"$set": profile})
+        group = [survivor, *duplicates]
+        await _refresh_derived(
+            survivor["id"], settings,
+            max((c["last_visit"] for c in group if c.get("last_visit")), default=None),
+            min((c["first_visit_date"] for c in group if c.get("first_visit_date")), default=None)
+        )
+
+    # 4. Give survivors the canonical key (unique index) once their duplicates are gone
+    if keyed:
+        await db.customers.bulk_write(
+            [UpdateOne({"id": survivor["id"]}, {"$set": {"phone_e164": key}}) for key, survivor in keyed],
+            ordered=False
+        )
+    await db.customer_merges.insert_many(merge_logs)
+
+    # Ledger rows moved in bulk: one event per collection, keyed by the survivor
+    changes = [change(CUSTOMER, dupe_id, "delete") for dupe_id in dupe_ids]
+    changes += [
+        change(CUSTOMER, log["survivor_id"], "update",
+               MOVED_FIELDS + ["holds", "tier", "avg_order_value", "merged_customer_ids", "phone_e164"])
+        for log in merge_logs
+    ]
+    changes += [
+        change(entity, None, "update", ["customer_id"], log["survivor_id"])
+        for log in merge_logs for entity in MERGED_ENTITIES
+    ]
+    await record_changes(user_id, changes)
+
+    return {
+        "groups_merged": len(merge_logs),
+        "customers_merged": len(dupe_ids),
+        "ledger_rows_rewritten": rewritten
+    }
+
+
+async def run_duplicate_merge(user_id: str, settings: dict, dry_run: bool = False) -> dict:
+    """Detect duplicate customers for a restaurant and merge them."""
+    # Finish any merge interrupted between tombstoning and deletion
+    if not dry_run:
+        async for tomb in db.customers.find(
+            {"user_id": user_id, "merged_into": {"$exists": True}}, {"_id": 0, "id": 1, "merged_into": 1}
+        ):
+            for collection in LEDGER_COLLECTIONS:
+                await db[collection].update_many(
+                    {"customer_id": tomb["id"]}, {"$set": {"customer_id": tomb["merged_into"]}}
+                )
+            await merge_customer_usage(tomb["merged_into"], [tomb["id"]])
+            await _fold_duplicate(tomb["merged_into"], tomb["id"])
+
+    groups, backfill = await find_duplicate_groups(user_id)
+    summary = {
+        "duplicate_groups": len(groups),
+        "duplicate_customers": sum(len(stubs) - 1 for _, stubs in groups),
+        "phone_keys_backfilled": 0,
+        "groups_merged": 0,
+        "customers_merged": 0,
+        "ledger_rows_rewritten": 0,
+        "dry_run": dry_run,
+        "groups": [
+            {"phone_e164": key, "customer_ids": [s["id"] for s in stubs], "phones": [s.get("phone") for s in stubs]}
+            for key, stubs in groups[:100]
+        ]
+    }
+    if dry_run:
+        summary["phone_keys_backfilled"] = len(backfill)
+        return summary
+
+    for i in range(0, len(backfill), 1000):
+        chunk = backfill[i:i + 1000]
+        await db.customers.bulk_write(
+            [UpdateOne({"id": cid}, {"$set": {"phone_e164": key}}) for cid, key in chunk],
+            ordered=False
+        )
+        await record_changes(user_id, [change(CUSTOMER, cid, "update", ["phone_e164"]) for cid, _ in chunk])
+        summary["phone_keys_backfilled"] += len(chunk)
+
+    for i in range(0, len(groups), GROUP_BATCH_SIZE):
+        result = await _merge_batch(user_id, groups[i:i + GROUP_BATCH_SIZE], settings)
+        for field, value in result.items():
+            summary[field] += value
+    if summary["customers_merged"]:
+        # Orders now belong to the surviving customers
+        await reset_cohorts(user_id)
+    invalidate_tenant(user_id)
+
+    logger.info(
+        f"Duplicate merge for {user_id}: {summary['groups_merged']} groups, "
+        f"{summary['customers_merged']} customers folded, {summary['phone_keys_backfilled']} keys backfilled"
+    )
+    return summary
@@ -0,0 +1,204 @@
+"""
+Nightly RFM / churn scoring for the customer AI fields.
+
+Each restaurant's `orders` are reduced by one aggregation to a row per customer
+(first/last order, order count, spend, discounted orders). The features are loaded
+into NumPy arrays and scored column-wise, then written back to `customers` with
+unordered bulk writes:
+
+  churn_risk_score        0-100, how overdue the customer is relative to their own
+                          visit rhythm (restaurant median gap for one-visit customers)
+  predicted_next_visit    last order + expected gap
+  price_sensitivity_score Low / Medium / High from discount usage and ticket size
+  recommended_offer_type  Discount / Freebie / Points
+"""
+from datetime import datetime, timezone
+import logging
+import time
+
+import numpy as np
+from pymongo import UpdateOne
+
+from core.database import db, analytics_db
+from core.changes import CUSTOMER, change, record_changes
+from core.result_cache import invalidate_tenant
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400.0
+
+# Used when a restaurant has too few repeat customers to estimate a visit gap
+DEFAULT_GAP_DAYS = 30.0
+
+# Churn curve: 50% risk at 1.5x the expected gap, ~95% at 3x
+CHURN_MIDPOINT = 1.5
+CHURN_STEEPNESS = 2.0
+HIGH_CHURN_RISK = 60
+
+SCORE_FIELDS = ["churn_risk_score", "predicted_next_visit", "price_sensitivity_score", "recommended_offer_type"]
+
+WRITE_BATCH_SIZE = 5000
+AGGREGATION_BATCH_SIZE = 10000
+
+
+def _feature_pipeline(user_id: str) -> list:
+    return [
+        {"$match": {"user_id": user_id, "customer_id": {"$ne": None}}},
+        {"$group": {
+            "_id": "$customer_id",
+            "first": {"$min": "$created_at"},
+            "last": {"$max": "$created_at"},
+            "orders": {"$sum": 1},
+            "spent": {"$sum": {"$ifNull": ["$order_amount", 0]}},
+            "discounted": {"$sum": {"$cond": [
+                {"$or": [
+                    {"$gt": [{"$ifNull": ["$coupon_discount", 0]}, 0]},
+                    {"$gt": [{"$ifNull": ["$wallet_used", 0]}, 0]}
+                ]}, 1, 0
+            ]}}
+        }},
+        # created_at is a UTC ISO string; the first 19 chars parse as datetime64[s]
+        {"$project": {
+            "_id": 1, "orders": 1, "spent": 1, "discounted": 1,
+            "first": {"$substrBytes": ["$first", 0, 19]},
+            "last": {"$substrBytes": ["$last", 0, 19]}
+        }}
+    ]
+
+
+async def load_customer_features(user_id: str) -> dict:
+    """Aggregate a restaurant's orders into per-customer feature columns."""
+    ids, first, last, orders, spent, discounted = [], [], [], [], [], []
+    cursor = analytics_db.orders.aggregate(
+        _feature_pipeline(user_id), allowDiskUse=True, batchSize=AGGREGATION_BATCH_SIZE
+    )
+    async for row in cursor:
+        if not row.get("last"):
+            continue
+        ids.append(row["_id"])
+        first.append(row["first"])
+        last.append(row["last"])
+        orders.append(row["orders"])
+        spent.append(row["spent"])
+        discounted.append(row["discounted"])
+
+    return {
+        "customer_ids": ids,
+        "first_order": np.array(first, dtype="datetime64[s]"),
+        "last_order": np.array(last, dtype="datetime64[s]"),
+        "orders": np.array(orders, dtype=np.int64),
+        "spent": np.array(spent, dtype=np.float64),
+        "discounted": np.array(discounted, dtype=np.int64),
+    }
+
+
+def compute_scores(features: dict, now: datetime) -> dict:
+    """Score feature columns. Pure NumPy; no per-customer Python."""
+    orders = features["orders"]
+    if len(orders) == 0:
+        empty = np.array([], dtype=object)
+        return {"churn_risk_score": np.array([], dtype=np.int64), "predicted_next_visit": empty,
+                "price_sensitivity_score": empty, "recommended_offer_type": empty}
+
+    now64 = np.datetime64(now.replace(tzinfo=None), "s")
+    first = features["first_order"]
+    last = features["last_order"]
+
+    recency_days = np.maximum((now64 - last).astype(np.float64) / SECONDS_PER_DAY, 0.0)
+    span_days = (last - first).astype(np.float64) / SECONDS_PER_DAY
+
+    # Frequency: personal mean gap between orders, restaurant median for one-timers
+    repeat = orders > 1
+    gap_days = np.zeros_like(span_days)
+    np.divide(span_days, orders - 1, out=gap_days, where=repeat)
+    repeat_gaps = gap_days[repeat & (gap_days > 0)]
+    median_gap = float(np.median(repeat_gaps)) if len(repeat_gaps) else DEFAULT_GAP_DAYS
+    gap_days = np.where(repeat & (gap_days > 0), gap_days, median_gap)
+    gap_days = np.maximum(gap_days, 1.0)
+
+    # Churn: logistic in "how many expected gaps overdue"
+    overdue = recency_days / gap_days
+    churn = 100.0 / (1.0 + np.exp(-CHURN_STEEPNESS * (overdue - CHURN_MIDPOINT)))
+    churn_risk = np.clip(np.rint(churn), 0, 100).astype(np.int64)
+
+    next_visit = last + np.rint(gap_days * SECONDS_PER_DAY).astype("timedelta64[s]")
+    predicted = np.char.add(np.datetime_as_string(next_visit, unit="s"), "+00:00").astype(object)
+
+    # Monetary: ticket size relative to the restaurant median, plus discount usage
+    avg_ticket = features["spent"] / np.maximum(orders, 1)
+    median_ticket = float(np.median(avg_ticket)) or 1.0
+    ticket_ratio = avg_ticket / median_ticket
+    discount_share = features["discounted"] / np.maximum(orders, 1)
+
+    sensitivity = np.select(
+        [
+            (discount_share >= 0.5) | ((discount_share >= 0.2) & (ticket_ratio < 0.6)),
+            (discount_share < 0.15) & (ticket_ratio >= 1.0),
+        ],
+        ["High", "Low"],
+        default="Medium"
+    ).astype(object)
+
+    offer = np.select(
+        [sensitivity == "High", churn_risk >= HIGH_CHURN_RISK],
+        ["Discount", "Freebie"],
+        default="Points"
+    ).astype(object)
+
+    return {
+        "churn_risk_score": churn_risk,
+        "predicted_next_visit": predicted,
+        "price_sensitivity_score": sensitivity,
+        "recommended_offer_type": offer,
+    }
+
+
+async def run_customer_scoring(user_id: str) -> dict:
+    """Score every customer of a restaurant that has at least one order."""
+    started = time.perf_counter()
+    features = await load_customer_features(user_id)
+    loaded = time.perf_counter()
+
+    scores = compute_scores(features, datetime.now(timezone.utc))
+    scored = time.perf_counter()
+
+    ids = features["customer_ids"]
+    churn = scores["churn_risk_score"].tolist()
+    predicted = scores["predicted_next_visit"].tolist()
+    sensitivity = scores["price_sensitivity_score"].tolist()
+    offer = scores["recommended_offer_type"].tolist()
+
+    updated = 0
+    for i in range(0, len(ids), WRITE_BATCH_SIZE):
+        ops = [
+            UpdateOne(
+                {"id": ids[j], "user_id": user_id},
+                {"$set": {
+                    "churn_risk_score": churn[j],
+                    "predicted_next_visit": predicted[j],
+                    "price_sensitivity_score": sensitivity[j],
+                    "recommended_offer_type": offer[j],
+                }}
+            )
+            for j in range(i, min(i + WRITE_BATCH_SIZE, len(ids)))
+        ]
+        result = await db.customers.bulk_write(ops, ordered=False)
+        updated += result.modified_count
+    written = time.perf_counter()
+
+    # One bulk event rather than one per customer; consumers re-read these fields
+    if ids:
+        await record_changes(user_id, [change(CUSTOMER, None, "update", SCORE_FIELDS)])
+        invalidate_tenant(user_id)
+
+    high_risk = int((scores["churn_risk_score"] >= HIGH_CHURN_RISK).sum())
+    logger.info(
+        f"Scored {len(ids)} customers for {user_id} "
+        f"(load {loaded - started:.1f}s, score {scored - loaded:.2f}s, write {written - scored:.1f}s)"
+    )
+    return {
+        "customers_scored": len(ids),
+        "customers_updated": updated,
+        "high_churn_risk": high_risk,
+        "duration_seconds": round(written - started, 2),
+    }
@@ -1,15 +1,167 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+from pymongo.read_preferences import SecondaryPreferred
 from dotenv import load_dotenv
+from datetime import datetime, timezone, timedelta
 from pathlib import Path
+from typing import Optional
 import os
+import logging
 
 ROOT_DIR = Path(__file__).parent.parent
 load_dotenv(ROOT_DIR / '.env')
 
+from core.db_profiler import command_listener, pool_listener  # noqa: E402  (reads thresholds from .env)
+from core.helpers import PHONE_KEY_STATE  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[command_listener, pool_listener])
 db = client[os.environ['DB_NAME']]
 
+# Handle for heavy reads that tolerate replication lag (dashboards, segment counts,
+# scoring scans, exports). On a replica set they go to a secondary at most
+# ANALYTICS_MAX_STALENESS_SECONDS behind (90 is the minimum Mongo accepts); on a
+# standalone server they behave exactly like `db`. Writes and read-your-write
+# paths (POS, ledgers, rollup rebuilds, cohort watermarks) must use `db`; reads of a
+# generation a rebuild just switched to go through `analytics_db_since`.
+ANALYTICS_MAX_STALENESS_SECONDS = int(os.environ.get('ANALYTICS_MAX_STALENESS_SECONDS', '90'))
+analytics_db = client.get_database(
+    os.environ['DB_NAME'],
+    read_preference=SecondaryPreferred(max_staleness=ANALYTICS_MAX_STALENESS_SECONDS)
+)
+
+
+def analytics_db_since(switched_at: Optional[str]):
+    """Handle for reading rows a rebuild switched to at `switched_at` (ISO time):
+    `db` while a secondary may not have them yet, `analytics_db` once it must."""
+    if not switched_at:
+        return db
+    age = datetime.now(timezone.utc) - datetime.fromisoformat(switched_at)
+    return db if age < timedelta(seconds=ANALYTICS_MAX_STALENESS_SECONDS) else analytics_db
+
+
+# (collection, keys, options, required). A required index backs a correctness
+# guarantee - a single-winner claim or a one-row-per-key insert - and startup
+# fails if it cannot be built; the others only cost performance when missing.
+INDEXES = [
+    # Point lookups / bulk updates by customer id
+    ("customers", "id", {"name": "customer_id"}, False),
+    # Tenant-scoped listing and segment predicates (core.segments.INDEXED_FIELDS)
+    *(("customers", [("user_id", 1), (field, 1)], {"name": f"user_{field}"}, False)
+      for field in ["created_at", "last_visit", "tier", "total_points"]),
+    # Segment size estimation sample (core.segment_sampling)
+    ("customer_samples", [("user_id", 1), ("sample_gen", 1)], {"name": "user_sample_gen"}, False),
+    ("customer_sample_meta", "user_id", {"name": "user_id", "unique": True}, True),
+    # Change outbox (core.changes): cursor reads and retention
+    ("change_events", [("user_id", 1), ("seq", 1)], {"name": "user_seq", "unique": True}, True),
+    ("change_events", "expires_at", {"name": "expires_at_ttl", "expireAfterSeconds": 0}, False),
+    ("change_events", "created_at", {"name": "created_at"}, False),
+    # Async POS order queue (core.order_queue): claim order, per-customer ordering, retries
+    ("pos_order_queue", "id", {"name": "id", "unique": True}, True),
+    ("pos_order_queue", [("user_id", 1), ("dedupe_key", 1)], {"name": "user_dedupe", "unique": True}, True),
+    ("pos_order_queue", [("status", 1), ("created_at", 1)], {"name": "status_created_at"}, False),
+    ("pos_order_queue", [("user_id", 1), ("customer_key", 1), ("status", 1), ("created_at", 1)],
+     {"name": "user_customer_status"}, False),
+    ("pos_order_queue", "expires_at", {"name": "expires_at_ttl", "expireAfterSeconds": 0}, False),
+    # Points redemption holds (core.points_holds): lookup by hold id, expiry sweep
+    ("customers", "holds.id", {"name": "holds_id", "sparse": True}, False),
+    ("customers", "holds.expires_at", {"name": "holds_expires_at", "sparse": True}, False),
+    # Cross-worker rate limit windows (core.rate_limit)
+    ("rate_limit_windows", "expires_at", {"name": "expires_at_ttl", "expireAfterSeconds": 0}, False),
+    # Daily analytics rollups (core.rollups)
+    ("daily_rollups", [("user_id", 1), ("gen", 1), ("date", 1)], {"name": "user_gen_date", "unique": True}, True),
+    ("rollup_meta", "user_id", {"name": "user_id", "unique": True}, True),
+    # Cohort retention state (core.cohorts)
+    ("cohort_members", [("user_id", 1), ("gen", 1), ("customer_id", 1)],
+     {"name": "user_gen_customer", "unique": True}, True),
+    ("cohort_meta", "user_id", {"name": "user_id", "unique": True}, True),
+    # Coupon usage: keyset-paginated detail and per-customer limit checks
+    ("coupon_usage", [("coupon_id", 1), ("used_at", -1), ("id", -1)], {"name": "coupon_used_at"}, False),
+    ("coupon_usage", [("coupon_id", 1), ("customer_id", 1)], {"name": "coupon_customer"}, False),
+    ("coupon_usage", "id", {"name": "id"}, False),
+    # Per-customer redemption counters (core.coupon_redemption), keyed "<coupon_id>:<customer_id>"
+    ("coupon_customer_usage", "coupon_id", {"name": "coupon_id"}, False),
+    ("coupon_customer_usage", "customer_id", {"name": "customer_id"}, False),
+    # Time-ordered scans per restaurant (Parquet export, rollup rebuilds)
+    *((collection, [("user_id", 1), ("created_at", 1)], {"name": "user_created_at"}, False)
+      for collection in ["orders", "points_transactions", "wallet_transactions"]),
+    # Per-customer order aggregation (scoring, 360 view)
+    ("orders", [("user_id", 1), ("customer_id", 1)], {"name": "user_customer"}, False),
+    # One order per POS order id: the insert is how a webhook claims it (routers.pos._claim_order);
+    # also serves duplicate checks and reconciliation lookups
+    ("orders", [("user_id", 1), ("pos_id", 1), ("pos_restaurant_id", 1), ("pos_order_id", 1)],
+     {"name": "user_pos_order", "unique": True}, True),
+    # Raw-phone lookups for legacy customers until the phone_e164 back-fill is recorded
+    ("customers", [("user_id", 1), ("phone", 1)], {"name": "user_phone"}, False),
+]
+
+# Indexes replaced by one above: (collection, name)
+SUPERSEDED_INDEXES = [
+    ("customer_samples", "user_id"),     # user_sample_gen: estimates count one sample generation
+    ("daily_rollups", "user_date"),      # user_gen_date: a rebuild writes the same days under a new generation
+    ("cohort_members", "user_customer"),  # user_gen_customer: a rebuild writes members under a new generation
+    ("orders", "pos_order"),             # user_pos_order
+]
+
+
+async def ensure_indexes():
+    """Create indexes the application relies on. Each index is created on its own,
+    so one failure does not skip the rest. Failures are logged, except for required
+    indexes, which raise once every index has been attempted."""
+    missing_required = []
+    for collection, keys, options, required in INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except PyMongoError as e:
+            if required:
+                logger.error(f"Could not create required index {collection}.{options['name']}: {e}")
+                missing_required.append(f"{collection}.{options['name']}")
+            else:
+                logger.warning(f"Could not create index {collection}.{options['name']}: {e}")
+
+    for collection, name in SUPERSEDED_INDEXES:
+        try:
+            if name in await db[collection].index_information():
+                await db[collection].drop_index(name)
+        except PyMongoError as e:
+            logger.warning(f"Could not drop superseded index {collection}.{name}: {e}")
+
+    try:
+        # Canonical phone key: one customer per phone per restaurant
+        await db.customers.create_index(
+            [("user_id", 1), ("phone_e164", 1)],
+            name="user_phone_e164_unique",
+            unique=True,
+            partialFilterExpression={"phone_e164": {"$type": "string"}},
+        )
+    except PyMongoError as e:
+        logger.warning(f"Could not create unique phone index (run scripts/merge_duplicate_customers.py): {e}")
+
+    try:
+        await load_phone_key_state()
+    except PyMongoError as e:
+        logger.warning(f"Could not read phone key back-fill state: {e}")
+
+    if missing_required:
+        raise RuntimeError(f"Required indexes missing: {', '.join(missing_required)}")
+
+PHONE_KEY_MIGRATION = "phone_e164_backfill"
+
+async def load_phone_key_state():
+    """Switch phone_query to the canonical key alone once the back-fill is recorded."""
+    PHONE_KEY_STATE["backfilled"] = bool(await db.migrations.find_one({"_id": PHONE_KEY_MIGRATION}))
+
+async def record_phone_key_backfill():
+    """Called by scripts/merge_duplicate_customers.py after a full, non-dry run."""
+    await db.migrations.update_one(
+        {"_id": PHONE_KEY_MIGRATION},
+        {"$set": {"completed_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    await load_phone_key_state()
+
 async def close_db_connection():
     client.close()
@@ -0,0 +1,245 @@
+"""
+Per-request Mongo command profiling.
+
+`command_listener` is registered on the Motor client. Motor runs each operation
+in a worker thread under a copy of the caller's context, so the listener can
+attribute commands to the HTTP request that issued them through a ContextVar.
+
+For every request `profile_requests` (HTTP middleware) records:
+
+  commands   number of round trips (getMore included)
+  db_ms      total server-reported time of those commands
+  shapes     how often each command shape ran; a shape is the command name,
+             collection and filter structure with values blanked, so a loop of
+             find_one({"id": ...}) shows up as one shape repeated N times
+
+The totals are returned in a `Server-Timing` header. Requests over the thresholds
+below, or with a shape repeated N_PLUS_ONE_REPEATS times, are logged with their
+shapes. Per-route aggregates are kept in memory for `GET /cron/db-profile`.
+
+`pool_listener` tracks how many operations are waiting for a pooled connection,
+which the rate limiter (core.rate_limit) uses to shed load.
+"""
+from contextvars import ContextVar
+from typing import Optional
+import json
+import logging
+import os
+import threading
+import time
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+SLOW_COMMANDS = int(os.environ.get('DB_PROFILE_SLOW_COMMANDS', '25'))
+SLOW_DB_MS = float(os.environ.get('DB_PROFILE_SLOW_MS', '250'))
+N_PLUS_ONE_REPEATS = int(os.environ.get('DB_PROFILE_REPEATS', '5'))
+
+# Driver housekeeping that is not issued by application code
+IGNORED_COMMANDS = {
+    "hello", "ismaster", "isMaster", "ping", "endSessions", "buildInfo",
+    "saslStart", "saslContinue", "killCursors",
+}
+
+# Where each command keeps its collection name and filter
+_FILTER_PATHS = {
+    "find": ("filter",),
+    "count": ("query",),
+    "distinct": ("query",),
+    "findAndModify": ("query",),
+    "update": ("updates", 0, "q"),
+    "delete": ("deletes", 0, "q"),
+    "aggregate": ("pipeline", 0),
+}
+
+
+def _blank(value):
+    if isinstance(value, dict):
+        return {k: _blank(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_blank(value[0])] if value and isinstance(value[0], dict) else "[?]"
+    return "?"
+
+
+def command_shape(name: str, command: dict) -> str:
+    """'find customers {"id": "?", "user_id": "?"}' for a find by id and tenant."""
+    collection = command.get(name)
+    if not isinstance(collection, str):
+        collection = ""
+    spec = command
+    for key in _FILTER_PATHS.get(name, ()):
+        try:
+            spec = spec[key]
+        except (KeyError, IndexError, TypeError):
+            spec = None
+            break
+    if spec is command or spec is None:
+        return f"{name} {collection}".strip()
+    return f"{name} {collection} {json.dumps(_blank(spec), sort_keys=True, default=str)}"
+
+
+class RequestProfile:
+    __slots__ = ("commands", "db_ms", "shapes", "_pending", "_lock")
+
+    def __init__(self):
+        self.commands = 0
+        self.db_ms = 0.0
+        self.shapes = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, key, shape: str):
+        with self._lock:
+            self._pending[key] = shape
+
+    def finished(self, key, duration_micros: int):
+        with self._lock:
+            shape = self._pending.pop(key, None)
+            if shape is None:
+                return
+            self.commands += 1
+            self.db_ms += duration_micros / 1000
+            self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def repeated(self) -> dict:
+        return {s: n for s, n in self.shapes.items() if n >= N_PLUS_ONE_REPEATS}
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("db_request_profile", default=None)
+
+
+class _CommandListener(monitoring.CommandListener):
+    def started(self, event):
+        profile = _current.get()
+        if profile is not None and event.command_name not in IGNORED_COMMANDS:
+            profile.started((event.connection_id, event.request_id),
+                            command_shape(event.command_name, event.command))
+
+    def succeeded(self, event):
+        profile = _current.get()
+        if profile is not None:
+            profile.finished((event.connection_id, event.request_id), event.duration_micros)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+command_listener = _CommandListener()
+
+
+class _PoolListener(monitoring.ConnectionPoolListener):
+    """Counts operations waiting for a pooled connection (load shedding signal)."""
+
+    def __init__(self):
+        self.waiting = 0
+        self.checked_out = 0
+        self._lock = threading.Lock()
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+
+
+pool_listener = _PoolListener()
+
+
+class RouteStats:
+    __slots__ = ("requests", "commands", "max_commands", "db_ms", "n_plus_one", "worst_shapes")
+
+    def __init__(self):
+        self.requests = 0
+        self.commands = 0
+        self.max_commands = 0
+        self.db_ms = 0.0
+        self.n_plus_one = 0
+        self.worst_shapes = {}
+
+
+_routes = {}
+
+
+def _record_route(route: str, profile: RequestProfile):
+    stats = _routes.setdefault(route, RouteStats())
+    stats.requests += 1
+    stats.commands += profile.commands
+    stats.db_ms += profile.db_ms
+    repeated = profile.repeated()
+    if repeated:
+        stats.n_plus_one += 1
+    if profile.commands >= stats.max_commands:
+        stats.max_commands = profile.commands
+        stats.worst_shapes = dict(sorted(profile.shapes.items(), key=lambda kv: -kv[1])[:10])
+
+
+def route_report(limit: int = 20) -> list:
+    """Routes ordered by average DB round trips per request."""
+    rows = [
+        {
+            "route": route,
+            "requests": s.requests,
+            "avg_commands": round(s.commands / s.requests, 1),
+            "max_commands": s.max_commands,
+            "avg_db_ms": round(s.db_ms / s.requests, 2),
+            "n_plus_one_requests": s.n_plus_one,
+            "worst_request_shapes": s.worst_shapes,
+        }
+        for route, s in _routes.items() if s.requests
+    ]
+    rows.sort(key=lambda r: (-r["avg_commands"], -r["avg_db_ms"]))
+    return rows[:limit]
+
+
+def reset_route_stats():
+    _routes.clear()
+
+
+async def profile_requests(request, call_next):
+    """HTTP middleware: profile the request's Mongo commands and add Server-Timing."""
+    profile = RequestProfile()
+    token = _current.set(profile)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+    total_ms = (time.perf_counter() - started) * 1000
+
+    route = request.scope.get("route")
+    route_name = f"{request.method} {route.path if route else request.url.path}"
+    _record_route(route_name, profile)
+
+    response.headers.append(
+        "Server-Timing",
+        f'db;dur={profile.db_ms:.1f};desc="{profile.commands} mongo commands", app;dur={total_ms:.1f}'
+    )
+
+    repeated = profile.repeated()
+    if repeated or profile.commands > SLOW_COMMANDS or profile.db_ms > SLOW_DB_MS:
+        logger.warning(
+            f"{route_name}: {profile.commands} mongo commands, {profile.db_ms:.1f}ms in db"
+            + (f"; repeated shapes (possible N+1): {repeated}" if repeated else "")
+            + f"; shapes: {profile.shapes}"
+        )
+    return response
@@ -1,7 +1,85 @@
 from datetime import datetime, timezone, timedelta
 import qrcode
 import io
+import re
 import base64
+from typing import Optional
+
+from models.schemas import Customer
+
+# Customer fields that queries filter, count or sort on. They stay materialized
+# even when they hold the model default so equality and range predicates
+# (tier counts, points/visits/spent ranges) keep matching every customer.
+CUSTOMER_MATERIALIZED_FIELDS = {
+    "id", "user_id", "created_at", "name", "phone",
+    "customer_type", "tier", "total_points", "wallet_balance",
+    "total_visits", "total_spent",
+}
+
+CUSTOMER_FIELD_DEFAULTS = {
+    name: field.get_default(call_default_factory=True)
+    for name, field in Customer.model_fields.items()
+    if not field.is_required()
+}
+
+
+def is_customer_default(field: str, value) -> bool:
+    """True if value is null, empty, or equal to the Customer model default for field"""
+    if value is None or value == []:
+        return True
+    if field not in CUSTOMER_FIELD_DEFAULTS:
+        return False
+    default = CUSTOMER_FIELD_DEFAULTS[field]
+    return type(value) is type(default) and value == default
+
+
+def compact_customer_doc(doc: dict) -> dict:
+    """Drop null/default fields from a customer document before it is stored.
+    Customer(**doc) restores them on read."""
+    return {
+        k: v for k, v in doc.items()
+        if k in CUSTOMER_MATERIALIZED_FIELDS or not is_customer_default(k, v)
+    }
+
+def normalize_phone(phone: str, country_code: str = "+91") -> Optional[str]:
+    """Canonical E.164 form of a phone number, e.g. "+919876543210".
+    Accepts "+91..." / "0091..." international forms, trunk-prefixed "0..." local
+    numbers and bare national numbers. Returns None for values that are not phone
+    numbers (empty or containing letters)."""
+    if not phone:
+        return None
+    raw = phone.strip()
+    if re.search(r"[A-Za-z]", raw):
+        return None
+    digits = re.sub(r"\D", "", raw)
+    if not digits:
+        return None
+    cc = re.sub(r"\D", "", country_code or "") or "91"
+    
+    if raw.startswith("+"):
+        return "+" + digits
+    if digits.startswith("00"):
+        return "+" + digits[2:]
+    if digits.startswith("0"):
+        return "+" + cc + digits.lstrip("0")
+    if len(digits) > 10 and digits.startswith(cc):
+        return "+" + digits
+    return "+" + cc + digits
+
+# Set from the `migrations` collection at startup (core.database.ensure_indexes)
+# once scripts/merge_duplicate_customers.py has back-filled phone_e164 everywhere
+PHONE_KEY_STATE = {"backfilled": False}
+
+def phone_query(user_id: str, phone: str, country_code: str = "+91") -> dict:
+    """Customer lookup filter on the canonical phone key (falls back to the raw
+    phone for values that cannot be normalized). Until the phone_e164 back-fill
+    is recorded, legacy customers without the key still match on the raw phone."""
+    key = normalize_phone(phone, country_code)
+    if not key:
+        return {"user_id": user_id, "phone": phone}
+    if PHONE_KEY_STATE["backfilled"]:
+        return {"user_id": user_id, "phone_e164": key}
+    return {"user_id": user_id, "$or": [{"phone_e164": key}, {"phone": phone}]}
 
 def calculate_tier(total_points: int, settings: dict) -> str:
     if total_points >= settings.get('tier_platinum_min', 5000):
@@ -12,6 +90,18 @@ def calculate_tier(total_points: int, settings: dict) -> str:
         return "Silver"
     return "Bronze"
 
+def tier_expression(points_expr, settings: dict) -> dict:
+    """calculate_tier as an aggregation expression, for pipeline updates that
+    change total_points and tier in one atomic write."""
+    return {"$switch": {
+        "branches": [
+            {"case": {"$gte": [points_expr, settings.get('tier_platinum_min', 5000)]}, "then": "Platinum"},
+            {"case": {"$gte": [points_expr, settings.get('tier_gold_min', 1500)]}, "then": "Gold"},
+            {"case": {"$gte": [points_expr, settings.get('tier_silver_min', 500)]}, "then": "Silver"},
+        ],
+        "default": "Bronze"
+    }}
+
 def get_earn_percent_for_tier(tier: str, settings: dict) -> float:
     """Get earning percentage based on customer tier"""
     tier_percents = {
@@ -22,6 +112,35 @@ def get_earn_percent_for_tier(tier: str, settings: dict) -> float:
     }
     return tier_percents.get(tier, 5.0)
 
+def coupon_discount(coupon: dict, order_value: float) -> float:
+    """Discount a coupon gives on an order value"""
+    if coupon["discount_type"] == "percentage":
+        discount = (order_value * coupon["discount_value"]) / 100
+        if coupon.get("max_discount"):
+            discount = min(discount, coupon["max_discount"])
+        return discount
+    return min(coupon["discount_value"], order_value)
+
+def coupon_rejection(coupon: dict, customer_id: Optional[str], order_value: float, channel: str,
+                     customer_uses: int, now: Optional[str] = None) -> Optional[str]:
+    """Why a coupon cannot be used on this order, or None if it can"""
+    now = now or datetime.now(timezone.utc).isoformat()
+    if coupon["start_date"] > now:
+        return "Coupon not yet active"
+    if coupon["end_date"] < now:
+        return "Coupon has expired"
+    if coupon.get("usage_limit") and coupon.get("total_used", 0) >= coupon["usage_limit"]:
+        return "Coupon usage limit reached"
+    if customer_uses >= coupon.get("per_user_limit", 1):
+        return "You have already used this coupon"
+    if order_value < coupon.get("min_order_value", 0):
+        return f"Minimum order value is Rs.{coupon['min_order_value']}"
+    if channel not in coupon.get("applicable_channels", []):
+        return "Coupon not valid for this order type"
+    if coupon.get("specific_users") and customer_id not in coupon["specific_users"]:
+        return "Coupon not valid for this customer"
+    return None
+
 def generate_qr_code(data: str) -> str:
     """Generate QR code as base64 string"""
     qr = qrcode.QRCode(version=1, box_size=10, border=5)
@@ -133,65 +252,36 @@ def check_off_peak_bonus(settings: dict) -> tuple:
     
     return False, 1.0, "multiplier", ""
 
-def build_customer_query(user_id: str, filters: dict) -> dict:
-    """Build MongoDB query from filter dictionary"""
-    query = {"user_id": user_id}
-    
-    # Tier filter
-    if filters.get("tier"):
-        query["tier"] = {"$in": filters["tier"]} if isinstance(filters["tier"], list) else filters["tier"]
-    
-    # City filter
-    if filters.get("city"):
-        query["city"] = {"$in": filters["city"]} if isinstance(filters["city"], list) else filters["city"]
-    
-    # Points range
-    if filters.get("points_min") is not None:
-        query["total_points"] = query.get("total_points", {})
-        query["total_points"]["$gte"] = filters["points_min"]
-    if filters.get("points_max") is not None:
-        query["total_points"] = query.get("total_points", {})
-        query["total_points"]["$lte"] = filters["points_max"]
+def summarize_expiring_points(transactions: list, expiry_months: int, reminder_days: int) -> dict:
+    """Summarize earn/bonus transactions into expiring-soon and already-expired totals"""
+    if expiry_months == 0:
+        return {"expiring_soon": 0, "expiring_date": None, "already_expired": 0}
     
-    # Visits range
-    if filters.get("visits_min") is not None:
-        query["total_visits"] = query.get("total_visits", {})
-        query["total_visits"]["$gte"] = filters["visits_min"]
-    if filters.get("visits_max") is not None:
-        query["total_visits"] = query.get("total_visits", {})
-        query["total_visits"]["$lte"] = filters["visits_max"]
+    now = datetime.now(timezone.utc)
+    expiry_cutoff = now - timedelta(days=expiry_months * 30)
+    reminder_cutoff = now - timedelta(days=(expiry_months * 30) - reminder_days)
     
-    # Spent range
-    if filters.get("spent_min") is not None:
-        query["total_spent"] = query.get("total_spent", {})
-        query["total_spent"]["$gte"] = filters["spent_min"]
-    if filters.get("spent_max") is not None:
-        query["total_spent"] = query.get("total_spent", {})
-        query["total_spent"]["$lte"] = filters["spent_max"]
+    expiring_soon = 0
+    already_expired = 0
+    earliest_expiry = None
     
-    # Dietary preference
-    if filters.get("dietary"):
-        query["dietary"] = {"$in": filters["dietary"]} if isinstance(filters["dietary"], list) else filters["dietary"]
-    
-    # Allergies
-    if filters.get("allergies"):
-        query["allergies"] = {"$in": filters["allergies"]} if isinstance(filters["allergies"], list) else filters["allergies"]
-    
-    # Favorite food
-    if filters.get("favorite_food"):
-        query["favorite_food"] = {"$regex": filters["favorite_food"], "$options": "i"}
-    
-    # Search by name or phone
-    if filters.get("search"):
-        search_regex = {"$regex": filters["search"], "$options": "i"}
-        query["$or"] = [
-            {"name": search_regex},
-            {"phone": search_regex},
-            {"email": search_regex}
-        ]
+    for tx in transactions:
+        tx_date = datetime.fromisoformat(tx["created_at"].replace("Z", "+00:00")) if isinstance(tx["created_at"], str) else tx["created_at"]
+        
+        if tx_date < expiry_cutoff:
+            already_expired += tx["points"]
+        elif tx_date < reminder_cutoff:
+            expiring_soon += tx["points"]
+            expiry_date = tx_date + timedelta(days=expiry_months * 30)
+            if earliest_expiry is None or expiry_date < earliest_expiry:
+                earliest_expiry = expiry_date
     
-    return query
-
+    return {
+        "expiring_soon": max(0, expiring_soon),
+        "expiring_date": earliest_expiry.isoformat() if earliest_expiry else None,
+        "already_expired": max(0, already_expired),
+        "expiry_months": expiry_months
+    }
 
 def get_default_templates_and_automation(user_id: str) -> tuple:
     """
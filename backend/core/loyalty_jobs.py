@@ -6,8 +6,13 @@ from datetime import datetime, timezone, timedelta
 import uuid
 import logging
 
+from pymongo import ReturnDocument
+
 from core.database import db
-from core.helpers import calculate_tier
+from core.changes import CUSTOMER, POINTS_TRANSACTION, change, record_changes
+from core.rollups import bump_daily
+from core.result_cache import invalidate_tenant
+from core.helpers import calculate_tier, tier_expression
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +36,7 @@ async def run_birthday_bonus(user_id: str, settings: dict) -> dict:
     customers_awarded = 0
     total_points_awarded = 0
     awarded_list = []
+    changes = []
 
     for customer in customers:
         try:
@@ -49,13 +55,17 @@ async def run_birthday_bonus(user_id: str, settings: dict) -> dict:
             if window_start <= today <= window_end:
                 if customer.get("last_birthday_bonus_year") == current_year:
                     continue
-                current_points = customer.get("total_points", 0)
-                new_points = current_points + bonus_points
-
-                await db.customers.update_one(
-                    {"id": customer["id"]},
-                    {"$set": {"total_points": new_points, "last_birthday_bonus_year": current_year}}
+                # $inc, not a $set of the snapshot: points held since the read stay held
+                updated = await db.customers.find_one_and_update(
+                    {"id": customer["id"], "last_birthday_bonus_year": {"$ne": current_year}},
+                    {"$inc": {"total_points": bonus_points}, "$set": {"last_birthday_bonus_year": current_year}},
+                    projection={"_id": 0, "total_points": 1},
+                    return_document=ReturnDocument.AFTER
                 )
+                if not updated:
+                    continue
+                new_points = updated["total_points"]
+                changes.append(change(CUSTOMER, customer["id"], "update", ["total_points", "last_birthday_bonus_year"]))
                 tx_doc = {
                     "id": str(uuid.uuid4()),
                     "user_id": user_id,
@@ -68,6 +78,7 @@ async def run_birthday_bonus(user_id: str, settings: dict) -> dict:
                     "created_at": datetime.now(timezone.utc).isoformat()
                 }
                 await db.points_transactions.insert_one(tx_doc)
+                changes.append(change(POINTS_TRANSACTION, tx_doc["id"], "insert", customer_id=customer["id"]))
                 customers_awarded += 1
                 total_points_awarded += bonus_points
                 awarded_list.append({
@@ -80,6 +91,10 @@ async def run_birthday_bonus(user_id: str, settings: dict) -> dict:
             logger.warning(f"Birthday bonus error for customer {customer.get('id')}: {e}")
             continue
 
+    await record_changes(user_id, changes)
+    await bump_daily(user_id, points_issued=total_points_awarded)
+    if customers_awarded:
+        invalidate_tenant(user_id)
     return {
         "customers_awarded": customers_awarded,
         "total_points_awarded": total_points_awarded,
@@ -106,6 +121,7 @@ async def run_anniversary_bonus(user_id: str, settings: dict) -> dict:
     customers_awarded = 0
     total_points_awarded = 0
     awarded_list = []
+    changes = []
 
     for customer in customers:
         try:
@@ -124,13 +140,17 @@ async def run_anniversary_bonus(user_id: str, settings: dict) -> dict:
             if window_start <= today <= window_end:
                 if customer.get("last_anniversary_bonus_year") == current_year:
                     continue
-                current_points = customer.get("total_points", 0)
-                new_points = current_points + bonus_points
-
-                await db.customers.update_one(
-                    {"id": customer["id"]},
-                    {"$set": {"total_points": new_points, "last_anniversary_bonus_year": current_year}}
+                # $inc, not a $set of the snapshot: points held since the read stay held
+                updated = await db.customers.find_one_and_update(
+                    {"id": customer["id"], "last_anniversary_bonus_year": {"$ne": current_year}},
+                    {"$inc": {"total_points": bonus_points}, "$set": {"last_anniversary_bonus_year": current_year}},
+                    projection={"_id": 0, "total_points": 1},
+                    return_document=ReturnDocument.AFTER
                 )
+                if not updated:
+                    continue
+                new_points = updated["total_points"]
+                changes.append(change(CUSTOMER, customer["id"], "update", ["total_points", "last_anniversary_bonus_year"]))
                 tx_doc = {
                     "id": str(uuid.uuid4()),
                     "user_id": user_id,
@@ -143,6 +163,7 @@ async def run_anniversary_bonus(user_id: str, settings: dict) -> dict:
                     "created_at": datetime.now(timezone.utc).isoformat()
                 }
                 await db.points_transactions.insert_one(tx_doc)
+                changes.append(change(POINTS_TRANSACTION, tx_doc["id"], "insert", customer_id=customer["id"]))
                 customers_awarded += 1
                 total_points_awarded += bonus_points
                 awarded_list.append({
@@ -155,6 +176,10 @@ async def run_anniversary_bonus(user_id: str, settings: dict) -> dict:
             logger.warning(f"Anniversary bonus error for customer {customer.get('id')}: {e}")
             continue
 
+    await record_changes(user_id, changes)
+    await bump_daily(user_id, points_issued=total_points_awarded)
+    if customers_awarded:
+        invalidate_tenant(user_id)
     return {
         "customers_awarded": customers_awarded,
         "total_points_awarded": total_points_awarded,
@@ -181,6 +206,7 @@ async def run_expiry_reminders(user_id: str, settings: dict) -> dict:
 
     customers_to_remind = 0
     reminders = []
+    changes = []
 
     for customer in customers:
         last_reminder = customer.get("last_expiry_reminder")
@@ -217,6 +243,7 @@ async def run_expiry_reminders(user_id: str, settings: dict) -> dict:
                 {"id": customer["id"]},
                 {"$set": {"last_expiry_reminder": now.isoformat()}}
             )
+            changes.append(change(CUSTOMER, customer["id"], "update", ["last_expiry_reminder"]))
             customers_to_remind += 1
             reminders.append({
                 "customer_id": customer["id"],
@@ -226,6 +253,7 @@ async def run_expiry_reminders(user_id: str, settings: dict) -> dict:
                 "expiry_date": earliest_expiry.isoformat() if earliest_expiry else None
             })
 
+    await record_changes(user_id, changes)
     return {"customers_to_remind": customers_to_remind, "reminders": reminders}
 
 
@@ -247,6 +275,7 @@ async def run_points_expiry(user_id: str, settings: dict) -> dict:
     total_expired = 0
     customers_affected = 0
     expired_details = []
+    changes = []
 
     for customer in customers:
         old_transactions = await db.points_transactions.find({
@@ -261,8 +290,24 @@ async def run_points_expiry(user_id: str, settings: dict) -> dict:
             continue
 
         points_to_expire = sum(tx["points"] for tx in old_transactions)
-        current_points = customer.get("total_points", 0)
-        points_to_expire = min(points_to_expire, current_points)
+
+        # Debit relative to the stored balance, never below zero: points moved
+        # into a hold since the customer was read are not expired or restored
+        before = await db.customers.find_one_and_update(
+            {"id": customer["id"], "total_points": {"$gt": 0}},
+            [
+                {"$set": {
+                    "total_points": {"$max": [{"$subtract": ["$total_points", points_to_expire]}, 0]},
+                    "last_points_expiry": {"$literal": now.isoformat()}
+                }},
+                {"$set": {"tier": tier_expression("$total_points", settings)}}
+            ],
+            projection={"_id": 0, "total_points": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        if not before:
+            continue
+        points_to_expire = min(points_to_expire, before["total_points"])
 
         if points_to_expire > 0:
             tx_ids = [tx["id"] for tx in old_transactions]
@@ -270,7 +315,7 @@ async def run_points_expiry(user_id: str, settings: dict) -> dict:
                 {"id": {"$in": tx_ids}},
                 {"$set": {"points_expired": True, "expired_at": now.isoformat()}}
             )
-            new_points = current_points - points_to_expire
+            new_points = before["total_points"] - points_to_expire
             new_tier = calculate_tier(new_points, settings)
             tx_doc = {
                 "id": str(uuid.uuid4()),
@@ -285,10 +330,12 @@ async def run_points_expiry(user_id: str, settings: dict) -> dict:
                 "created_at": now.isoformat()
             }
             await db.points_transactions.insert_one(tx_doc)
-            await db.customers.update_one(
-                {"id": customer["id"]},
-                {"$set": {"total_points": new_points, "tier": new_tier, "last_points_expiry": now.isoformat()}}
+            changes.extend(
+                change(POINTS_TRANSACTION, tx_id, "update", ["points_expired", "expired_at"], customer["id"])
+                for tx_id in tx_ids
             )
+            changes.append(change(POINTS_TRANSACTION, tx_doc["id"], "insert", customer_id=customer["id"]))
+            changes.append(change(CUSTOMER, customer["id"], "update", ["total_points", "tier", "last_points_expiry"]))
             total_expired += points_to_expire
             customers_affected += 1
             expired_details.append({
@@ -299,6 +346,10 @@ async def run_points_expiry(user_id: str, settings: dict) -> dict:
                 "new_tier": new_tier
             })
 
+    await record_changes(user_id, changes)
+    await bump_daily(user_id, points_expired=total_expired)
+    if customers_affected:
+        invalidate_tenant(user_id)
     return {
         "total_expired": total_expired,
         "customers_affected": customers_affected,
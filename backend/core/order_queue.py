@@ -0,0 +1,228 @@
+"""
+Durable queue for POS order webhooks processed asynchronously.
+
+In async mode `POST /pos/orders` only validates the payload, inserts a job into
+`pos_order_queue` and answers 202 with the job id. A pool of worker tasks in
+every API process drains the queue:
+
+  queued      waiting (or backing off until `available_at` after a failure)
+  processing  claimed by a worker until `lease_until`; an expired lease (the
+              worker died or is too slow) makes the job claimable again
+  done        processed; `result` holds the POSResponse the sync path returns
+  failed      gave up after MAX_ATTEMPTS; `error` holds the last exception
+
+Jobs for one customer (restaurant + phone) are applied in arrival order: a
+claimed job that still has an earlier queued or processing job for the same
+customer is put back and retried shortly. Jobs for different customers run in
+parallel.
+
+A POS retry of an order that is already queued gets the existing job id back
+(unique on restaurant + POS order id). Finished jobs expire after RETENTION_DAYS.
+
+A job can still run twice (a retry after a partial failure, or a lease that ran
+out under a slow worker), so handlers must be idempotent; the order handler
+claims the order through the unique `orders` index before touching the customer.
+Each claim carries a `lease_token`, and a worker only finishes or releases the
+job while it still holds that token.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, List, Optional
+import asyncio
+import logging
+import os
+import uuid
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.database import db
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get('POS_ORDER_WORKERS', '4'))
+POLL_SECONDS = 0.5
+LEASE_SECONDS = 60
+MAX_ATTEMPTS = 5
+# A job waiting behind an earlier one for the same customer is retried after this
+ORDERING_DELAY_SECONDS = 0.2
+RETENTION_DAYS = 7
+
+_workers: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def enqueue_order(user_id: str, customer_key: str, dedupe_key: str, payload: dict) -> tuple:
+    """Queue an order. Returns (job, created); a job already queued under
+    `dedupe_key` is returned with created False."""
+    now = _now().isoformat()
+    job = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "customer_key": customer_key,
+        "dedupe_key": dedupe_key,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "available_at": now,
+        "created_at": now,
+        "updated_at": now
+    }
+    try:
+        await db.pos_order_queue.insert_one(job)
+    except DuplicateKeyError:
+        existing = await db.pos_order_queue.find_one(
+            {"user_id": user_id, "dedupe_key": dedupe_key}, {"_id": 0, "payload": 0}
+        )
+        return existing, False
+    job.pop("_id", None)
+    if _wakeup:
+        _wakeup.set()
+    return job, True
+
+
+async def pending_dedupe_keys(user_id: str, dedupe_keys: List[str]) -> set:
+    """Which of these dedupe keys have a job that is still queued or processing."""
+    if not dedupe_keys:
+        return set()
+    jobs = await db.pos_order_queue.find(
+        {"user_id": user_id, "dedupe_key": {"$in": dedupe_keys}, "status": {"$in": ["queued", "processing"]}},
+        {"_id": 0, "dedupe_key": 1}
+    ).to_list(None)
+    return {job["dedupe_key"] for job in jobs}
+
+
+async def get_job(user_id: str, job_id: str) -> Optional[dict]:
+    return await db.pos_order_queue.find_one(
+        {"id": job_id, "user_id": user_id}, {"_id": 0, "payload": 0, "dedupe_key": 0}
+    )
+
+
+async def _claim() -> Optional[dict]:
+    now = _now()
+    return await db.pos_order_queue.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "available_at": {"$lte": now.isoformat()}},
+            {"status": "processing", "lease_until": {"$lt": now.isoformat()}}
+        ]},
+        {
+            "$set": {
+                "status": "processing",
+                "lease_token": uuid.uuid4().hex,
+                "lease_until": (now + timedelta(seconds=LEASE_SECONDS)).isoformat(),
+                "updated_at": now.isoformat()
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("created_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _has_earlier(job: dict) -> bool:
+    """True if an earlier order for the same customer is not finished yet."""
+    earlier = await db.pos_order_queue.find_one({
+        "user_id": job["user_id"],
+        "customer_key": job["customer_key"],
+        "status": {"$in": ["queued", "processing"]},
+        "$or": [
+            {"created_at": {"$lt": job["created_at"]}},
+            {"created_at": job["created_at"], "id": {"$lt": job["id"]}}
+        ]
+    }, {"_id": 1})
+    return earlier is not None
+
+
+def _leased(job: dict) -> dict:
+    """Filter matching the job only while this worker's claim is still the current one."""
+    return {"id": job["id"], "status": "processing", "lease_token": job["lease_token"]}
+
+
+async def _release(job: dict, delay: float, **fields) -> bool:
+    released = await db.pos_order_queue.update_one(_leased(job), {"$set": {
+        "status": "queued",
+        "available_at": (_now() + timedelta(seconds=delay)).isoformat(),
+        "updated_at": _now().isoformat(),
+        **fields
+    }, "$unset": {"lease_until": "", "lease_token": ""}})
+    return bool(released.modified_count)
+
+
+async def _finish(job: dict, status: str, **fields) -> bool:
+    now = _now()
+    finished = await db.pos_order_queue.update_one(_leased(job), {"$set": {
+        "status": status,
+        "completed_at": now.isoformat(),
+        "updated_at": now.isoformat(),
+        "expires_at": now + timedelta(days=RETENTION_DAYS),
+        **fields
+    }, "$unset": {"lease_until": "", "lease_token": ""}})
+    if not finished.modified_count:
+        logger.warning(f"POS order job {job['id']} lease was lost; its {status} result was not recorded")
+    return bool(finished.modified_count)
+
+
+async def process_one(handler: Callable[[dict], Awaitable[dict]]) -> bool:
+    """Claim and process one job. Returns False if there was nothing to claim."""
+    job = await _claim()
+    if not job:
+        return False
+    if await _has_earlier(job):
+        # Not an attempt: put it back without counting it
+        await _release(job, ORDERING_DELAY_SECONDS, attempts=job["attempts"] - 1)
+        return True
+    try:
+        result = await handler(job)
+    except Exception as e:
+        if job["attempts"] >= MAX_ATTEMPTS:
+            logger.error(f"POS order job {job['id']} failed after {job['attempts']} attempts: {e}")
+            await _finish(job, "failed", error=str(e))
+        else:
+            logger.warning(f"POS order job {job['id']} attempt {job['attempts']} failed: {e}")
+            await _release(job, 2 ** job["attempts"], error=str(e))
+        return True
+    await _finish(job, "done", result=result)
+    return True
+
+
+async def _worker(handler: Callable[[dict], Awaitable[dict]]):
+    while True:
+        try:
+            if await process_one(handler):
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"POS order worker error: {e}")
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_order_workers(handler: Callable[[dict], Awaitable[dict]], workers: int = WORKERS):
+    """Start the worker pool on the running event loop."""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    for _ in range(workers):
+        _workers.append(asyncio.create_task(_worker(handler)))
+    logger.info(f"Started {workers} POS order queue workers")
+
+
+async def stop_order_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+async def queue_stats() -> dict:
+    rows = await db.pos_order_queue.aggregate([
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    return {"workers": len(_workers), **{row["_id"]: row["count"] for row in rows}}
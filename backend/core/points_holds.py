@@ -0,0 +1,144 @@
+"""
+Two-phase points redemption.
+
+A terminal reserves points when it shows the redemption at checkout and spends
+them when the bill is paid. A hold lives on the customer document itself, so
+every transition is one atomic single-document update:
+
+  create    total_points -= N, held_points += N, holds += {id, points, value, ...}
+            guarded by total_points >= N, so two terminals cannot hold the same points
+  confirm   held_points -= N, hold removed; guarded by the hold still being there
+            and unexpired. Writes the redeem ledger row.
+  release   total_points += N, held_points -= N, hold removed
+  expire    `sweep_expired_holds` (scheduler) releases holds past expires_at
+
+Held points are out of total_points, so nothing else (another redemption, the
+expiry job) can spend them while the hold is open. Tier is not recomputed for
+holds.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+import logging
+import os
+import uuid
+
+from pymongo import ReturnDocument
+
+from core.changes import CUSTOMER, POINTS_TRANSACTION, change, record_changes
+from core.database import db
+from core.rollups import bump_daily
+
+logger = logging.getLogger(__name__)
+
+HOLD_TTL_SECONDS = int(os.environ.get('POINTS_HOLD_TTL_SECONDS', '600'))
+SWEEP_INTERVAL_SECONDS = 60
+HOLD_FIELDS = ["total_points", "held_points"]
+
+
+def find_hold(customer: dict, hold_id: str) -> Optional[dict]:
+    return next((h for h in customer.get("holds") or [] if h["id"] == hold_id), None)
+
+
+def open_hold_filter(hold: dict, now: str) -> dict:
+    """Matches a customer that still has this exact hold, unexpired."""
+    return {"$elemMatch": {"id": hold["id"], "points": hold["points"], "expires_at": {"$gt": now}}}
+
+
+async def create_hold(user_id: str, customer_id: str, points: int, value: float,
+                      bill_amount: Optional[float] = None, ttl_seconds: int = HOLD_TTL_SECONDS) -> Optional[dict]:
+    """Move points into a hold. Returns the hold, or None if the balance is short."""
+    now = datetime.now(timezone.utc)
+    hold = {
+        "id": str(uuid.uuid4()),
+        "points": points,
+        "value": round(value, 2),
+        "bill_amount": bill_amount,
+        "created_at": now.isoformat(),
+        "expires_at": (now + timedelta(seconds=ttl_seconds)).isoformat()
+    }
+    customer = await db.customers.find_one_and_update(
+        {"id": customer_id, "user_id": user_id, "total_points": {"$gte": points}},
+        {"$inc": {"total_points": -points, "held_points": points}, "$push": {"holds": hold}},
+        projection={"_id": 0, "total_points": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not customer:
+        return None
+    await record_changes(user_id, [change(CUSTOMER, customer_id, "update", HOLD_FIELDS + ["holds"])])
+    return {**hold, "customer_id": customer_id, "available_points": customer["total_points"]}
+
+
+async def get_hold(user_id: str, hold_id: str) -> tuple:
+    """(customer, hold) for a hold id; (None, None) if it no longer exists."""
+    customer = await db.customers.find_one(
+        {"user_id": user_id, "holds.id": hold_id},
+        {"_id": 0, "id": 1, "name": 1, "total_points": 1, "holds": 1}
+    )
+    if not customer:
+        return None, None
+    return customer, find_hold(customer, hold_id)
+
+
+async def confirm_hold(user_id: str, hold_id: str, description: Optional[str] = None) -> Optional[dict]:
+    """Spend a hold's points. Returns the redeem ledger row, or None if the hold
+    is gone or expired."""
+    customer, hold = await get_hold(user_id, hold_id)
+    if not hold:
+        return None
+    now = datetime.now(timezone.utc).isoformat()
+    updated = await db.customers.find_one_and_update(
+        {"id": customer["id"], "holds": open_hold_filter(hold, now)},
+        {"$inc": {"held_points": -hold["points"]}, "$pull": {"holds": {"id": hold_id}}},
+        projection={"_id": 0, "total_points": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        return None
+
+    tx = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "customer_id": customer["id"],
+        "points": hold["points"],
+        "transaction_type": "redeem",
+        "description": description or f"Redeemed at POS (hold {hold_id[:8]})",
+        "bill_amount": hold.get("bill_amount"),
+        "balance_after": updated["total_points"],
+        "created_at": now
+    }
+    await db.points_transactions.insert_one(tx)
+    tx.pop("_id", None)
+    await record_changes(user_id, [
+        change(CUSTOMER, customer["id"], "update", ["held_points", "holds"]),
+        change(POINTS_TRANSACTION, tx["id"], "insert", customer_id=customer["id"])
+    ])
+    await bump_daily(user_id, points_redeemed=hold["points"])
+    return {**tx, "value": hold["value"]}
+
+
+async def release_hold(user_id: str, customer_id: str, hold: dict) -> bool:
+    """Return a hold's points to the balance. False if it was already confirmed or released."""
+    result = await db.customers.update_one(
+        {"id": customer_id, "holds": {"$elemMatch": {"id": hold["id"], "points": hold["points"]}}},
+        {"$inc": {"total_points": hold["points"], "held_points": -hold["points"]},
+         "$pull": {"holds": {"id": hold["id"]}}}
+    )
+    if not result.modified_count:
+        return False
+    await record_changes(user_id, [change(CUSTOMER, customer_id, "update", HOLD_FIELDS + ["holds"])])
+    return True
+
+
+async def sweep_expired_holds() -> int:
+    """Release every hold past its expiry. Returns how many were released."""
+    now = datetime.now(timezone.utc).isoformat()
+    released = 0
+    async for customer in db.customers.find(
+        {"holds.expires_at": {"$lte": now}}, {"_id": 0, "id": 1, "user_id": 1, "holds": 1}
+    ):
+        for hold in customer["holds"]:
+            if hold["expires_at"] <= now and await release_hold(customer["user_id"], customer["id"], hold):
+                released += 1
+    if released:
+        logger.info(f"Released {released} expired points holds")
+    return released
@@ -0,0 +1,70 @@
+"""
+Per-process cache of POS API key -> restaurant.
+
+Terminals call several POS endpoints per checkout, each authenticated by the
+X-API-Key header. `lookup_api_key` keeps a bounded LRU of the restaurants behind
+valid keys:
+
+  keys      stored as a SHA-256 digest, never the raw key
+  misses    not cached, so random keys sent to POS endpoints cost one indexed
+            read each but no memory
+  expiry    entries live KEY_TTL_SECONDS; the LRU holds at most MAX_KEYS
+
+`forget_api_keys` drops every entry in this process (key regeneration). Other
+workers keep accepting a regenerated key until their entry expires, i.e. for up
+to KEY_TTL_SECONDS.
+"""
+from collections import OrderedDict
+from typing import Optional
+import hashlib
+import os
+import time
+
+from core.database import db
+
+MAX_KEYS = int(os.environ.get('POS_API_KEY_CACHE_SIZE', '10000'))
+KEY_TTL_SECONDS = 60
+
+_keys: "OrderedDict[str, tuple]" = OrderedDict()    # sha256(key) -> (user, stored_at)
+_generation = 0
+stats = {"hits": 0, "misses": 0, "not_found": 0, "evictions": 0}
+
+
+def _digest(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+async def lookup_api_key(api_key: str) -> Optional[dict]:
+    """The restaurant (users document) owning an API key, or None if the key is unknown."""
+    digest = _digest(api_key)
+    entry = _keys.get(digest)
+    if entry and time.monotonic() - entry[1] < KEY_TTL_SECONDS:
+        _keys.move_to_end(digest)
+        stats["hits"] += 1
+        return entry[0]
+    _keys.pop(digest, None)
+
+    stats["misses"] += 1
+    generation = _generation
+    user = await db.users.find_one({"api_key": api_key}, {"_id": 0})
+    if not user:
+        stats["not_found"] += 1
+        return None
+    # A lookup that raced with forget_api_keys may have read the old key
+    if generation == _generation:
+        _keys[digest] = (user, time.monotonic())
+        if len(_keys) > MAX_KEYS:
+            _keys.popitem(last=False)
+            stats["evictions"] += 1
+    return user
+
+
+def forget_api_keys():
+    """Drop every cached key in this process."""
+    global _generation
+    _generation += 1
+    _keys.clear()
+
+
+def api_key_cache_stats() -> dict:
+    return {**stats, "entries": len(_keys), "max_entries": MAX_KEYS}
@@ -0,0 +1,229 @@
+"""
+Per-tenant rate limiting and load shedding.
+
+`RateLimitMiddleware` (ASGI) decides before routing whether a request runs at all.
+
+Limits
+  Requests with an X-API-Key (POS integrations) draw from one token bucket per
+  key, requests with a bearer token from one bucket per user. Buckets refill at
+  *_RATE_LIMIT_RPS up to *_RATE_LIMIT_BURST and live in process memory, so the
+  check does no I/O. Requests with neither are left to authentication.
+
+  With RATE_LIMIT_SYNC=1 workers also share counts through Mongo: every
+  SYNC_INTERVAL_SECONDS each worker $incs the requests it admitted per identity
+  into `rate_limit_windows` (one document per identity and minute) and reads the
+  totals back. An identity over RPS * 60 + BURST for the minute is refused on
+  every worker until the minute ends.
+
+Load shedding
+  A monitor task measures event loop lag, and core.db_profiler.pool_listener
+  counts operations waiting for a Mongo connection. Past either threshold a
+  share of requests proportional to the overload (at most SHED_MAX_FRACTION)
+  is refused with 503 so the ones admitted still finish. Health checks are
+  never shed.
+
+Refusals carry Retry-After. Counters are reported by `rate_limit_stats()` in
+GET /cron/status.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import random
+import time
+
+import jwt
+from pymongo import UpdateOne
+from starlette.responses import JSONResponse
+
+from core.auth import JWT_ALGORITHM, JWT_SECRET
+from core.database import db
+from core.db_profiler import pool_listener
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+LIMITS = {
+    "api_key": (float(os.environ.get('POS_RATE_LIMIT_RPS', '50')), float(os.environ.get('POS_RATE_LIMIT_BURST', '100'))),
+    "user": (float(os.environ.get('USER_RATE_LIMIT_RPS', '50')), float(os.environ.get('USER_RATE_LIMIT_BURST', '100'))),
+}
+SYNC = os.environ.get('RATE_LIMIT_SYNC', '0') == '1'
+SYNC_INTERVAL_SECONDS = 1.0
+SHED_LOOP_LAG_MS = float(os.environ.get('SHED_LOOP_LAG_MS', '250'))
+SHED_POOL_WAITERS = int(os.environ.get('SHED_POOL_WAITERS', '50'))
+SHED_MAX_FRACTION = 0.9
+EXEMPT_PATHS = {"/api/health", "/api/"}
+
+LAG_SAMPLE_SECONDS = 0.25
+IDLE_BUCKET_SECONDS = 600
+
+stats = {"allowed": 0, "limited": {"api_key": 0, "user": 0}, "limited_global": 0, "shed": 0}
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        """Take a token. Returns 0 if granted, else seconds until one is available."""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class RateLimiter:
+    def __init__(self):
+        self.buckets = {}            # identity -> TokenBucket
+        self.window_counts = {}      # identity -> requests admitted since the last sync
+        self.blocked_until = {}      # identity -> monotonic time (cross-worker limit hit)
+        self.loop_lag_ms = 0.0
+        self._monitor: Optional[asyncio.Task] = None
+
+    def identify(self, headers: dict) -> Optional[tuple]:
+        """(kind, identity) for a request, from its API key or bearer token."""
+        api_key = headers.get(b"x-api-key")
+        if api_key:
+            return "api_key", "key:" + hashlib.sha256(api_key).hexdigest()[:24]
+        auth = headers.get(b"authorization", b"")
+        if auth[:7].lower() == b"bearer ":
+            try:
+                payload = jwt.decode(auth[7:].decode(), JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            except jwt.InvalidTokenError:
+                return None
+            if payload.get("user_id"):
+                return "user", "user:" + payload["user_id"]
+        return None
+
+    def check(self, kind: str, identity: str) -> float:
+        """0 if the request may run, else the Retry-After in seconds."""
+        now = time.monotonic()
+        blocked = self.blocked_until.get(identity)
+        if blocked:
+            if blocked > now:
+                stats["limited_global"] += 1
+                return blocked - now
+            del self.blocked_until[identity]
+
+        rate, burst = LIMITS[kind]
+        bucket = self.buckets.get(identity)
+        if bucket is None:
+            bucket = self.buckets[identity] = TokenBucket(burst, now)
+        wait = bucket.take(rate, burst, now)
+        if wait:
+            stats["limited"][kind] += 1
+            return wait
+        if SYNC:
+            self.window_counts[identity] = self.window_counts.get(identity, 0) + 1
+        return 0.0
+
+    def shed_fraction(self) -> float:
+        overload = max(self.loop_lag_ms / SHED_LOOP_LAG_MS, pool_listener.waiting / SHED_POOL_WAITERS)
+        return min(SHED_MAX_FRACTION, overload - 1) if overload > 1 else 0.0
+
+    def ensure_monitor(self):
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.get_running_loop().create_task(self._run_monitor())
+
+    async def _run_monitor(self):
+        loop = asyncio.get_running_loop()
+        last_sync = last_prune = loop.time()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_SECONDS)
+            now = loop.time()
+            lag_ms = max(0.0, (now - started - LAG_SAMPLE_SECONDS) * 1000)
+            # Rise immediately, decay gradually, so shedding does not flap
+            self.loop_lag_ms = max(lag_ms, self.loop_lag_ms * 0.8)
+
+            if SYNC and now - last_sync >= SYNC_INTERVAL_SECONDS:
+                last_sync = now
+                try:
+                    await self.sync_windows()
+                except Exception as e:
+                    logger.warning(f"Rate limit sync failed: {e}")
+            if now - last_prune >= IDLE_BUCKET_SECONDS:
+                last_prune = now
+                self.prune()
+
+    def prune(self):
+        """Forget buckets that have been idle long enough to be full again."""
+        cutoff = time.monotonic() - IDLE_BUCKET_SECONDS
+        for identity in [i for i, b in self.buckets.items() if b.updated < cutoff]:
+            del self.buckets[identity]
+
+    async def sync_windows(self):
+        """Share this worker's admitted counts and pick up identities over the limit."""
+        if not self.window_counts:
+            return
+        counts, self.window_counts = self.window_counts, {}
+        window = int(time.time() // 60)
+        expires = datetime.now(timezone.utc) + timedelta(minutes=5)
+        ids = {identity: f"{identity}:{window}" for identity in counts}
+        await db.rate_limit_windows.bulk_write([
+            UpdateOne({"_id": ids[identity]}, {"$inc": {"count": n}, "$setOnInsert": {"expires_at": expires}},
+                      upsert=True)
+            for identity, n in counts.items()
+        ], ordered=False)
+
+        totals = await db.rate_limit_windows.find({"_id": {"$in": list(ids.values())}}).to_list(None)
+        window_end = time.monotonic() + (60 - time.time() % 60)
+        for row in totals:
+            identity = row["_id"].rsplit(":", 1)[0]
+            rate, burst = LIMITS["api_key" if identity.startswith("key:") else "user"]
+            if row["count"] > rate * 60 + burst:
+                self.blocked_until[identity] = window_end
+
+
+limiter = RateLimiter()
+
+
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+        limiter.ensure_monitor()
+
+        shed = limiter.shed_fraction()
+        if shed and random.random() < shed:
+            stats["shed"] += 1
+            return await _refuse(503, "Server overloaded, retry shortly", 1)(scope, receive, send)
+
+        who = limiter.identify(dict(scope["headers"]))
+        if who:
+            wait = limiter.check(*who)
+            if wait:
+                return await _refuse(429, "Rate limit exceeded", wait)(scope, receive, send)
+        stats["allowed"] += 1
+        return await self.app(scope, receive, send)
+
+
+def _refuse(status: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def rate_limit_stats() -> dict:
+    return {
+        **stats,
+        "limited": dict(stats["limited"]),
+        "loop_lag_ms": round(limiter.loop_lag_ms, 1),
+        "pool_waiting": pool_listener.waiting,
+        "pool_checked_out": pool_listener.checked_out,
+        "shed_fraction": round(limiter.shed_fraction(), 2),
+        "tracked_identities": len(limiter.buckets),
+        "globally_blocked": len(limiter.blocked_until),
+        "limits": {kind: {"rps": rate, "burst": burst} for kind, (rate, burst) in LIMITS.items()},
+        "sync": SYNC,
+    }
@@ -0,0 +1,83 @@
+"""
+Cross-process claims for per-restaurant rebuilds.
+
+Rebuilds that replace a whole set of rows (daily rollups, cohort membership, the
+segment estimation sample) do not delete the live rows first. They write a new
+generation next to them and then point the restaurant's meta document at it:
+
+  claim_rebuild    sets `building: {gen, lease_until, ...}` on the meta document in
+                   one conditional upsert; fails if another process holds an
+                   unexpired lease (two workers, or two requests on first load)
+  finish_rebuild   sets `gen` to the built generation and clears `building`, only if
+                   this process still holds the claim
+  abandon_rebuild  clears a failed claim so the next caller can retry
+  wait_for_rebuild polls until the running build finishes or its lease runs out
+
+Readers use the meta document's `gen`; a missing `gen` is the rows written before
+generations existed. Callers delete the previous generation once nothing reads it.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+import asyncio
+import uuid
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+WAIT_POLL_SECONDS = 0.2
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+async def claim_rebuild(meta, user_id: str, lease_seconds: float, **fields) -> tuple:
+    """Claim the restaurant's rebuild. Returns (building, expired_gen): the claim
+    (None if another process holds it) and the generation of an expired claim
+    that was taken over, whose partial rows the caller should delete."""
+    now = datetime.now(timezone.utc)
+    building = {
+        "gen": uuid.uuid4().hex,
+        "claimed_at": now.isoformat(),
+        "lease_until": (now + timedelta(seconds=lease_seconds)).isoformat(),
+        **fields
+    }
+    try:
+        before = await meta.find_one_and_update(
+            {"user_id": user_id, "$or": [{"building": None}, {"building.lease_until": {"$lt": now.isoformat()}}]},
+            {"$set": {"building": building}},
+            projection={"_id": 0, "building": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # The meta document exists and its claim is live
+        return None, None
+    expired = (before or {}).get("building")
+    return building, expired["gen"] if expired else None
+
+
+async def finish_rebuild(meta, user_id: str, gen: str, **fields) -> Optional[dict]:
+    """Switch readers to `gen`. Returns the meta document as it was before, or None
+    if the claim was lost (lease expired and another process took over)."""
+    return await meta.find_one_and_update(
+        {"user_id": user_id, "building.gen": gen},
+        {"$set": {"gen": gen, **fields}, "$unset": {"building": ""}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    )
+
+
+async def abandon_rebuild(meta, user_id: str, gen: str):
+    await meta.update_one({"user_id": user_id, "building.gen": gen}, {"$unset": {"building": ""}})
+
+
+async def wait_for_rebuild(meta, user_id: str, timeout: float) -> Optional[dict]:
+    """The meta document once no unexpired build is running (or after `timeout`)."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        doc = await meta.find_one({"user_id": user_id}, {"_id": 0})
+        building = (doc or {}).get("building")
+        if not building or building["lease_until"] < _now() or asyncio.get_running_loop().time() >= deadline:
+            return doc
+        await asyncio.sleep(WAIT_POLL_SECONDS)
@@ -0,0 +1,177 @@
+"""
+End-of-day reconciliation of POS orders.
+
+A POS sends its day file (CSV with order id, amount and phone per order) to
+`POST /pos/reconcile`. The body is parsed as it streams in, sorted by order id
+and merged against that day's `orders` (one indexed range scan on user_id +
+created_at, sorted the same way):
+
+  matched            in both with the same amount and phone
+  amount_mismatch    in both, amounts differ by more than AMOUNT_TOLERANCE
+  phone_mismatch     in both, the order's customer has a different phone
+  missing_in_crm     only in the POS file (a lost webhook); backfilled by the caller
+  missing_in_pos     only in `orders`
+  outside_day        only in the POS file for this day, but the order exists with
+                     another date (processed late, e.g. by an earlier backfill)
+  queued             only in the POS file, but accepted in async mode and still
+                     waiting in `pos_order_queue`; the queue processes it
+
+A backfilled order is dated inside the reconciled day, carries `backfilled_at`
+and earns no off-peak bonus (the day file has no order times).
+
+The day is [date 00:00, date + 1 day) shifted by `utc_offset_minutes`, so a
+restaurant can reconcile its local business day.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import AsyncIterator, List
+import codecs
+import csv
+import logging
+
+from core.database import db
+from core.helpers import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+AMOUNT_TOLERANCE = 0.01
+MAX_ROWS = 50000
+# Accepted header names for each day file column
+COLUMNS = {
+    "order_id": ("order_id", "pos_order_id", "bill_id"),
+    "amount": ("amount", "order_amount", "bill_amount"),
+    "phone": ("phone", "cust_mobile", "customer_phone"),
+}
+
+
+def day_range(date: str, utc_offset_minutes: int = 0) -> tuple:
+    """UTC ISO bounds [start, end) of a local calendar day."""
+    start = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc) - timedelta(minutes=utc_offset_minutes)
+    return start.isoformat(), (start + timedelta(days=1)).isoformat()
+
+
+async def parse_day_file(chunks: AsyncIterator[bytes]) -> tuple:
+    """Rows {order_id, amount, phone} from a streamed CSV body, plus the rejected
+    lines. Raises ValueError for a missing header column or an oversized file."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    header = None
+    rows, rejected = [], []
+
+    def parse(line: str, line_no: int):
+        nonlocal header
+        if not line.strip():
+            return
+        values = next(csv.reader([line]))
+        if header is None:
+            names = [v.strip().lower() for v in values]
+            header = {}
+            for column, aliases in COLUMNS.items():
+                match = next((names.index(a) for a in aliases if a in names), None)
+                if match is None:
+                    raise ValueError(f"Day file has no {column} column (accepted: {', '.join(aliases)})")
+                header[column] = match
+            return
+        try:
+            order_id = values[header["order_id"]].strip()
+            amount = float(values[header["amount"]])
+            phone = values[header["phone"]].strip()
+            if not order_id:
+                raise ValueError("empty order id")
+        except (IndexError, ValueError) as e:
+            rejected.append({"line": line_no, "error": str(e)})
+            return
+        rows.append({"order_id": order_id, "amount": amount, "phone": phone})
+        if len(rows) > MAX_ROWS:
+            raise ValueError(f"Day file has more than {MAX_ROWS} orders")
+
+    line_no = 0
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            line_no += 1
+            parse(line.rstrip("\r"), line_no)
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        line_no += 1
+        parse(pending.rstrip("\r"), line_no)
+    if header is None:
+        raise ValueError("Day file is empty")
+    return rows, rejected
+
+
+async def load_day_orders(user_id: str, pos_id: str, restaurant_id: str, start: str, end: str) -> List[dict]:
+    """The day's orders from this POS with their customer's phone, sorted by POS order id."""
+    orders = await db.orders.find(
+        {"user_id": user_id, "created_at": {"$gte": start, "$lt": end},
+         "pos_id": pos_id, "pos_restaurant_id": restaurant_id},
+        {"_id": 0, "id": 1, "pos_order_id": 1, "order_amount": 1, "customer_id": 1}
+    ).to_list(None)
+
+    customer_ids = list({o["customer_id"] for o in orders if o.get("customer_id")})
+    phones = {}
+    if customer_ids:
+        async for c in db.customers.find(
+            {"user_id": user_id, "id": {"$in": customer_ids}}, {"_id": 0, "id": 1, "phone": 1, "phone_e164": 1}
+        ):
+            phones[c["id"]] = c.get("phone_e164") or normalize_phone(c.get("phone", "")) or c.get("phone")
+    for o in orders:
+        o["phone"] = phones.get(o.get("customer_id"))
+    orders.sort(key=lambda o: o["pos_order_id"])
+    return orders
+
+
+def merge_diff(pos_rows: List[dict], crm_orders: List[dict]) -> dict:
+    """Sorted-merge the POS rows and CRM orders, both sorted by order id."""
+    report = {
+        "matched": 0, "amount_mismatch": [], "phone_mismatch": [],
+        "missing_in_crm": [], "missing_in_pos": [], "duplicates_in_file": []
+    }
+    i = j = 0
+    previous = None
+    while i < len(pos_rows) or j < len(crm_orders):
+        row = pos_rows[i] if i < len(pos_rows) else None
+        if row and previous == row["order_id"]:
+            report["duplicates_in_file"].append(row["order_id"])
+            i += 1
+            continue
+        order = crm_orders[j] if j < len(crm_orders) else None
+        if order is None or (row and row["order_id"] < order["pos_order_id"]):
+            report["missing_in_crm"].append(row)
+            previous = row["order_id"]
+            i += 1
+        elif row is None or order["pos_order_id"] < row["order_id"]:
+            report["missing_in_pos"].append({
+                "order_id": order["pos_order_id"], "amount": order["order_amount"], "crm_order_id": order["id"]
+            })
+            j += 1
+        else:
+            clean = True
+            if abs(row["amount"] - order["order_amount"]) > AMOUNT_TOLERANCE:
+                report["amount_mismatch"].append({
+                    "order_id": row["order_id"], "pos_amount": row["amount"], "crm_amount": order["order_amount"]
+                })
+                clean = False
+            pos_phone = normalize_phone(row["phone"]) or row["phone"]
+            if order.get("phone") and pos_phone != order["phone"]:
+                report["phone_mismatch"].append({
+                    "order_id": row["order_id"], "pos_phone": row["phone"], "crm_phone": order["phone"]
+                })
+                clean = False
+            report["matched"] += clean
+            previous = row["order_id"]
+            i += 1
+            j += 1
+    return report
+
+
+async def find_outside_day(user_id: str, pos_id: str, restaurant_id: str, order_ids: List[str]) -> set:
+    """Which of these POS order ids exist in `orders` with any date."""
+    if not order_ids:
+        return set()
+    found = await db.orders.find(
+        {"pos_id": pos_id, "pos_restaurant_id": restaurant_id, "pos_order_id": {"$in": order_ids},
+         "user_id": user_id},
+        {"_id": 0, "pos_order_id": 1}
+    ).to_list(None)
+    return {o["pos_order_id"] for o in found}
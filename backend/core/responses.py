@@ -0,0 +1,38 @@
+"""
+Fast-path response serialization for documents the server wrote itself.
+
+List endpoints used to build `[Model(**doc) for doc in docs]`, after which FastAPI
+dumped every instance back to a dict, validated it again against `response_model`
+and encoded it with the stdlib `json`. Here the whole list goes through a cached
+`TypeAdapter` in a single validation pass and is encoded straight to JSON bytes by
+pydantic-core. Returning a `Response` makes FastAPI skip its own re-validation;
+`response_model` is still declared on the route for the OpenAPI schema.
+"""
+from typing import Dict, List, Type
+
+from fastapi.responses import Response
+from pydantic import BaseModel, TypeAdapter
+
+_list_adapters: Dict[type, TypeAdapter] = {}
+
+
+def _list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    adapter = _list_adapters.get(model)
+    if adapter is None:
+        adapter = _list_adapters[model] = TypeAdapter(List[model])
+    return adapter
+
+
+def trusted(model: Type[BaseModel], doc: dict) -> BaseModel:
+    """Build a model from a document the server just wrote, skipping validation.
+    Missing fields get model defaults; unknown keys are dropped."""
+    return model.model_construct(**doc)
+
+
+def model_list_response(model: Type[BaseModel], docs: List[dict]) -> Response:
+    """Validate a list of DB documents once and return them as a JSON response."""
+    adapter = _list_adapter(model)
+    return Response(
+        content=adapter.dump_json(adapter.validate_python(docs)),
+        media_type="application/json"
+    )
@@ -0,0 +1,112 @@
+"""
+Per-restaurant result cache for expensive read endpoints.
+
+Staff at one restaurant tend to open the dashboard together at shift start, and
+each load recomputed the same aggregations. A `TenantCache` keeps the last result
+per restaurant:
+
+  fresh  (age < ttl)            returned as is
+  stale  (age < ttl + stale_ttl) returned as is while one background task recomputes
+  expired / missing             computed; concurrent callers await the same task
+
+Big writes (cron jobs, bulk syncs, merges, rollup rebuilds) call `invalidate_tenant`
+so the next read recomputes. An invalidation also discards any computation that
+was already in flight, since it may have read pre-write data. Endpoints pass
+`refresh=True` for requests sent with `Cache-Control: no-cache` (the dashboard's
+refresh button) to skip the cached entry.
+
+The cache is per process; with several workers each holds its own copy and the
+TTL bounds how long a write made through another worker goes unseen.
+"""
+from typing import Awaitable, Callable, Dict, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_caches: Dict[str, "TenantCache"] = {}
+
+
+class TenantCache:
+    def __init__(self, name: str, ttl: float = 30, stale_ttl: float = 300):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: Dict[str, tuple] = {}          # user_id -> (value, computed_at)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._generation: Dict[str, int] = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0}
+        _caches[name] = self
+
+    async def get(self, user_id: str, compute: Callable[[], Awaitable], refresh: bool = False):
+        """Cached result for a restaurant, computing it with `compute()` if needed."""
+        if refresh:
+            self.invalidate(user_id)
+        entry = self._entries.get(user_id)
+        if entry:
+            age = time.monotonic() - entry[1]
+            if age < self.ttl:
+                self.stats["hits"] += 1
+                return entry[0]
+            if age < self.ttl + self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                if user_id not in self._inflight:
+                    self._start(user_id, compute).add_done_callback(self._log_failure)
+                return entry[0]
+
+        task = self._inflight.get(user_id)
+        if task:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            task = self._start(user_id, compute)
+        # A cancelled caller must not cancel the computation other callers await
+        return await asyncio.shield(task)
+
+    def _start(self, user_id: str, compute: Callable[[], Awaitable]) -> asyncio.Task:
+        generation = self._generation.get(user_id, 0)
+
+        async def run():
+            try:
+                value = await compute()
+                if self._generation.get(user_id, 0) == generation:
+                    self._entries[user_id] = (value, time.monotonic())
+                return value
+            finally:
+                if self._inflight.get(user_id) is task:
+                    del self._inflight[user_id]
+
+        task = asyncio.create_task(run())
+        self._inflight[user_id] = task
+        return task
+
+    def _log_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.error(f"Background refresh of {self.name} cache failed: {task.exception()}")
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Drop one restaurant's entry (or all entries) and orphan in-flight computations."""
+        user_ids = [user_id] if user_id else list(set(self._entries) | set(self._inflight))
+        for uid in user_ids:
+            self._entries.pop(uid, None)
+            self._inflight.pop(uid, None)
+            self._generation[uid] = self._generation.get(uid, 0) + 1
+
+
+def wants_refresh(request) -> bool:
+    """True if the client asked to bypass caches (Cache-Control: no-cache)."""
+    return "no-cache" in request.headers.get("cache-control", "")
+
+
+def invalidate_tenant(user_id: Optional[str] = None):
+    """Invalidate every registered cache for a restaurant (all restaurants if None)."""
+    for cache in _caches.values():
+        cache.invalidate(user_id)
+
+
+def cache_stats() -> dict:
+    return {
+        name: {**cache.stats, "entries": len(cache._entries), "inflight": len(cache._inflight)}
+        for name, cache in _caches.items()
+    }
@@ -0,0 +1,352 @@
+"""
+Per-restaurant, per-day analytics rollups.
+
+`daily_rollups` holds one document per (user_id, date) with running counters:
+
+    orders, revenue, active_customers, new_customers,
+    points_issued, points_redeemed, points_expired,
+    wallet_credited, wallet_debited, feedback_count, rating_sum
+
+Write paths (POS, points, wallet, feedback, customer creation, cron jobs) call
+`bump_daily` with `$inc` deltas, so dashboards and time series read a handful of
+rollup rows instead of aggregating the full transaction history.
+
+`rebuild_rollups` recomputes a restaurant's rows from raw collections. Bills that
+left no order or ledger row (a POS payment below the earn threshold) cannot be
+recovered by a rebuild and are only counted by the live path.
+
+Rows carry a generation (`gen`, from `rollup_meta`); readers only see the live
+one. A rebuild claims `rollup_meta` (core.rebuild_claims), picks a cutoff a little
+in the future and writes the new generation from raw rows created before it.
+From the cutoff on, `bump_daily` increments both generations, so writes landing
+during the rebuild are not lost (a request whose ledger row is written just
+before the cutoff and its bump just after is counted twice). The switch is one update
+of `rollup_meta`; the old generation is deleted afterwards. `bump_daily` learns
+about a rebuild through a per-process copy of `rollup_meta` that is at most
+META_TTL_SECONDS old, which is why the cutoff is that far ahead of the claim.
+"""
+from datetime import date, datetime, timezone, timedelta
+from typing import List, Optional
+import asyncio
+import logging
+
+from pymongo import UpdateOne
+
+from core.database import db, analytics_db_since
+from core.rebuild_claims import abandon_rebuild, claim_rebuild, finish_rebuild, wait_for_rebuild
+from core.result_cache import TenantCache, invalidate_tenant
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = [
+    "orders", "revenue", "active_customers", "new_customers",
+    "points_issued", "points_redeemed", "points_expired",
+    "wallet_credited", "wallet_debited", "feedback_count", "rating_sum",
+]
+
+# Points transaction type -> rollup counter
+POINTS_FIELD = {"earn": "points_issued", "bonus": "points_issued", "redeem": "points_redeemed", "expired": "points_expired"}
+WALLET_FIELD = {"credit": "wallet_credited", "debit": "wallet_debited"}
+
+META_TTL_SECONDS = 1
+# Margin past the meta TTL for writes already in flight when the rebuild is claimed
+CUTOFF_SLACK_SECONDS = 1
+REBUILD_LEASE_SECONDS = 300
+# How long a reader waits for another process's rebuild before serving what it has
+REBUILD_WAIT_SECONDS = 30
+
+rollup_meta_cache = TenantCache("rollup_meta", ttl=META_TTL_SECONDS, stale_ttl=0)
+_cleanup_tasks = set()
+
+
+def day_of(timestamp: Optional[str] = None) -> str:
+    """UTC date (YYYY-MM-DD) of an ISO timestamp, or today."""
+    if timestamp:
+        return timestamp[:10]
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def is_first_visit_of_day(customer: dict, day: str) -> bool:
+    """True if the customer's previous visit was not on `day` (counts them as active once)."""
+    return (customer.get("last_visit") or "")[:10] != day
+
+
+async def bump_daily(user_id: str, day: Optional[str] = None, **deltas):
+    """Increment rollup counters for a restaurant-day. Failures are logged, not raised."""
+    inc = {k: v for k, v in deltas.items() if v}
+    if not inc:
+        return
+    try:
+        meta = await rollup_meta_cache.get(
+            user_id, lambda: db.rollup_meta.find_one({"user_id": user_id}, {"_id": 0, "gen": 1, "building": 1})
+        ) or {}
+        gens = [meta.get("gen")]
+        building = meta.get("building")
+        if building and datetime.now(timezone.utc).isoformat() >= building["cutoff"]:
+            gens.append(building["gen"])
+        for gen in gens:
+            await db.daily_rollups.update_one(
+                {"user_id": user_id, "gen": gen, "date": day or day_of()},
+                {"$inc": inc},
+                upsert=True
+            )
+    except Exception as e:
+        logger.error(f"Failed to update daily rollup for {user_id}: {e}")
+
+
+async def ensure_rollups(user_id: str) -> dict:
+    """The live rollup generation ({gen, rebuilt_at}), building the rollups from raw
+    data the first time they are needed. If another request is already building
+    them, waits for it (or, once its lease runs out, serves whatever was bumped so far)."""
+    meta = await db.rollup_meta.find_one({"user_id": user_id}, {"_id": 0, "gen": 1, "rebuilt_at": 1})
+    if meta and meta.get("rebuilt_at"):
+        return meta
+    result = await rebuild_rollups(user_id)
+    return {"gen": result.get("gen"), "rebuilt_at": result.get("rebuilt_at")}
+
+
+async def get_rollup_totals(user_id: str, start: Optional[str] = None, end: Optional[str] = None) -> dict:
+    """Sum rollup counters over [start, end] (YYYY-MM-DD, inclusive); all days if omitted."""
+    live = await ensure_rollups(user_id)
+    match = {"user_id": user_id, "gen": live.get("gen")}
+    if start or end:
+        match["date"] = {}
+        if start:
+            match["date"]["$gte"] = start
+        if end:
+            match["date"]["$lte"] = end
+    # A just-built generation may not have reached the secondaries yet
+    rows = await analytics_db_since(live.get("rebuilt_at")).daily_rollups.aggregate([
+        {"$match": match},
+        {"$group": {"_id": None, **{f: {"$sum": f"${f}"} for f in ROLLUP_FIELDS}}}
+    ]).to_list(1)
+    totals = rows[0] if rows else {}
+    return {f: totals.get(f, 0) for f in ROLLUP_FIELDS}
+
+
+async def retract_customer(user_id: str, customer: dict):
+    """Undo a deleted customer's contribution before their ledger rows are removed,
+    so live totals keep matching a rebuild. Daily active counts are not retracted."""
+    deltas = {}
+
+    def sub(day, field, value):
+        if day and value:
+            deltas.setdefault(day, {})[field] = deltas.get(day, {}).get(field, 0) - value
+
+    sub(day_of(customer.get("created_at")), "new_customers", 1)
+    async for row in db.points_transactions.find(
+        {"customer_id": customer["id"]},
+        {"_id": 0, "transaction_type": 1, "points": 1, "bill_amount": 1, "order_id": 1, "created_at": 1}
+    ):
+        day, tx_type = day_of(row.get("created_at")), row.get("transaction_type")
+        if tx_type in POINTS_FIELD:
+            sub(day, POINTS_FIELD[tx_type], row.get("points", 0))
+        if tx_type == "earn" and not row.get("order_id"):
+            sub(day, "revenue", row.get("bill_amount") or 0)
+            sub(day, "orders", 1 if (row.get("bill_amount") or 0) > 0 else 0)
+
+    for day, counters in deltas.items():
+        await bump_daily(user_id, day, **counters)
+
+
+# Metrics available to time series; avg_rating is derived from rating_sum / feedback_count.
+# active_customers is a per-day distinct count and does not add up across days.
+SERIES_METRICS = [
+    "revenue", "orders", "points_issued", "points_redeemed", "points_expired",
+    "new_customers", "wallet_credited", "wallet_debited", "feedback_count", "avg_rating",
+]
+BUCKETS = ["day", "week", "month"]
+
+
+def bucket_start(day: date, bucket: str) -> date:
+    """First day of the bucket containing `day` (weeks start on Monday)."""
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _next_bucket(start: date, bucket: str) -> date:
+    if bucket == "week":
+        return start + timedelta(days=7)
+    if bucket == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+async def get_rollup_series(user_id: str, start: date, end: date, bucket: str, metrics: List[str]) -> List[dict]:
+    """Metric values per day/week/month between start and end (inclusive). Buckets with
+    no activity are returned with zeros so charts get a continuous axis."""
+    live = await ensure_rollups(user_id)
+    counters = {m for m in metrics if m != "avg_rating"}
+    if "avg_rating" in metrics:
+        counters |= {"rating_sum", "feedback_count"}
+
+    rows = await analytics_db_since(live.get("rebuilt_at")).daily_rollups.find(
+        {"user_id": user_id, "gen": live.get("gen"), "date": {"$gte": start.isoformat(), "$lte": end.isoformat()}},
+        {"_id": 0, "date": 1, **{f: 1 for f in counters}}
+    ).to_list(None)
+
+    buckets = {}
+    cursor = bucket_start(start, bucket)
+    while cursor <= end:
+        buckets[cursor.isoformat()] = dict.fromkeys(counters, 0)
+        cursor = _next_bucket(cursor, bucket)
+    for row in rows:
+        totals = buckets[bucket_start(date.fromisoformat(row["date"]), bucket).isoformat()]
+        for f in counters:
+            totals[f] += row.get(f, 0)
+
+    series = []
+    for key, totals in buckets.items():
+        point = {"period": key}
+        for m in metrics:
+            if m == "avg_rating":
+                count = totals["feedback_count"]
+                point[m] = round(totals["rating_sum"] / count, 2) if count else None
+            elif m == "revenue" or m.startswith("wallet_"):
+                point[m] = round(totals[m], 2)
+            else:
+                point[m] = totals[m]
+        series.append(point)
+    return series
+
+
+def _day_group(extra: dict, date_field: str = "$created_at") -> dict:
+    return {"$group": {"_id": {"$substrBytes": [date_field, 0, 10]}, **extra}}
+
+
+async def rebuild_rollups(user_id: str) -> dict:
+    """Recompute every daily rollup row for a restaurant from raw collections into
+    a new generation and switch to it. If another process is already rebuilding,
+    waits for it and returns `in_progress` instead of building again."""
+    claimed_at = datetime.now(timezone.utc)
+    cutoff = (claimed_at + timedelta(seconds=META_TTL_SECONDS + CUTOFF_SLACK_SECONDS)).isoformat()
+    building, expired_gen = await claim_rebuild(
+        db.rollup_meta, user_id, REBUILD_LEASE_SECONDS, cutoff=cutoff
+    )
+    if not building:
+        meta = await wait_for_rebuild(db.rollup_meta, user_id, REBUILD_WAIT_SECONDS) or {}
+        return {"days": 0, "rebuilt_at": meta.get("rebuilt_at"), "gen": meta.get("gen"), "in_progress": True}
+    gen = building["gen"]
+    rollup_meta_cache.invalidate(user_id)
+    try:
+        live = await db.rollup_meta.find_one({"user_id": user_id}, {"_id": 0, "gen": 1})
+        # Rows of builds that died or were superseded; only the live generation is read
+        await db.daily_rollups.delete_many({"user_id": user_id, "gen": {"$nin": [live.get("gen"), gen]}})
+        # Every process sees the claim before the cutoff; until then writes are
+        # counted from the raw rows, after it by bump_daily in the new generation
+        await asyncio.sleep(max(0.0, (datetime.fromisoformat(cutoff) - datetime.now(timezone.utc)).total_seconds()))
+        days = await _count_days(user_id, cutoff)
+        docs = [{"user_id": user_id, "gen": gen, "date": day, **counters} for day, counters in sorted(days.items())]
+        # Bumps since the cutoff may already have created some of these rows
+        for i in range(0, len(docs), 1000):
+            await db.daily_rollups.bulk_write([
+                UpdateOne({"user_id": user_id, "gen": gen, "date": d["date"]},
+                          {"$inc": {f: d[f] for f in ROLLUP_FIELDS if f in d}}, upsert=True)
+                for d in docs[i:i + 1000]
+            ], ordered=False)
+        now = datetime.now(timezone.utc).isoformat()
+        previous = await finish_rebuild(db.rollup_meta, user_id, gen, rebuilt_at=now)
+    except BaseException:
+        await abandon_rebuild(db.rollup_meta, user_id, gen)
+        await db.daily_rollups.delete_many({"user_id": user_id, "gen": gen})
+        raise
+    if previous is None:
+        # Lease expired and another rebuild took over; it owns the result
+        await db.daily_rollups.delete_many({"user_id": user_id, "gen": gen})
+        return {"days": 0, "rebuilt_at": None, "gen": None, "in_progress": True}
+
+    invalidate_tenant(user_id)
+    task = asyncio.create_task(_drop_generation(user_id, previous.get("gen")))
+    _cleanup_tasks.add(task)
+    task.add_done_callback(_cleanup_tasks.discard)
+    logger.info(f"Rebuilt {len(docs)} daily rollups for {user_id}")
+    return {"days": len(docs), "rebuilt_at": now, "gen": gen}
+
+
+async def _drop_generation(user_id: str, gen: Optional[str]):
+    """Delete a replaced generation once no process can still be bumping it."""
+    await asyncio.sleep(META_TTL_SECONDS + CUTOFF_SLACK_SECONDS)
+    try:
+        await db.daily_rollups.delete_many({"user_id": user_id, "gen": gen})
+    except Exception as e:
+        logger.warning(f"Could not drop old rollups for {user_id}: {e}")
+
+
+async def _count_days(user_id: str, cutoff: str) -> dict:
+    """Rollup counters per day from raw rows created before `cutoff`."""
+    days = {}
+
+    def add(day, field, value):
+        if day and value:
+            days.setdefault(day, {})[field] = days.get(day, {}).get(field, 0) + value
+
+    async for row in db.orders.aggregate([
+        {"$match": {"user_id": user_id, "created_at": {"$lt": cutoff}}},
+        _day_group({"orders": {"$sum": 1}, "revenue": {"$sum": {"$ifNull": ["$order_amount", 0]}}})
+    ]):
+        add(row["_id"], "orders", row["orders"])
+        add(row["_id"], "revenue", row["revenue"])
+
+    # Earn rows carrying a bill amount are bills that created no order
+    async for row in db.points_transactions.aggregate([
+        {"$match": {"user_id": user_id, "created_at": {"$lt": cutoff}}},
+        {"$group": {
+            "_id": {"day": {"$substrBytes": ["$created_at", 0, 10]}, "type": "$transaction_type"},
+            "points": {"$sum": "$points"},
+            "bills": {"$sum": {"$cond": [
+                {"$and": [{"$eq": ["$transaction_type", "earn"]}, {"$gt": ["$bill_amount", 0]},
+                          {"$not": ["$order_id"]}]}, 1, 0
+            ]}},
+            "revenue": {"$sum": {"$cond": [
+                {"$and": [{"$eq": ["$transaction_type", "earn"]}, {"$not": ["$order_id"]}]},
+                {"$ifNull": ["$bill_amount", 0]}, 0
+            ]}}
+        }}
+    ]):
+        day, tx_type = row["_id"]["day"], row["_id"]["type"]
+        if tx_type in POINTS_FIELD:
+            add(day, POINTS_FIELD[tx_type], row["points"])
+        add(day, "orders", row["bills"])
+        add(day, "revenue", row["revenue"])
+
+    async for row in db.wallet_transactions.aggregate([
+        {"$match": {"user_id": user_id, "created_at": {"$lt": cutoff}}},
+        {"$group": {
+            "_id": {"day": {"$substrBytes": ["$created_at", 0, 10]}, "type": "$transaction_type"},
+            "amount": {"$sum": "$amount"}
+        }}
+    ]):
+        if row["_id"]["type"] in WALLET_FIELD:
+            add(row["_id"]["day"], WALLET_FIELD[row["_id"]["type"]], row["amount"])
+
+    async for row in db.customers.aggregate([
+        {"$match": {"user_id": user_id, "created_at": {"$lt": cutoff}}},
+        _day_group({"count": {"$sum": 1}})
+    ]):
+        add(row["_id"], "new_customers", row["count"])
+
+    # Distinct customers per day across orders and earn rows
+    async for row in db.orders.aggregate([
+        {"$match": {"user_id": user_id, "created_at": {"$lt": cutoff}}},
+        {"$project": {"_id": 0, "day": {"$substrBytes": ["$created_at", 0, 10]}, "customer_id": 1}},
+        {"$unionWith": {"coll": "points_transactions", "pipeline": [
+            {"$match": {"user_id": user_id, "transaction_type": "earn", "order_id": {"$exists": False},
+                        "created_at": {"$lt": cutoff}}},
+            {"$project": {"_id": 0, "day": {"$substrBytes": ["$created_at", 0, 10]}, "customer_id": 1}}
+        ]}},
+        {"$group": {"_id": {"day": "$day", "customer_id": "$customer_id"}}},
+        {"$group": {"_id": "$_id.day", "count": {"$sum": 1}}}
+    ], allowDiskUse=True):
+        add(row["_id"], "active_customers", row["count"])
+
+    async for row in db.feedback.aggregate([
+        {"$match": {"user_id": user_id, "created_at": {"$lt": cutoff}}},
+        _day_group({"count": {"$sum": 1}, "rating_sum": {"$sum": {"$ifNull": ["$rating", 0]}}})
+    ]):
+        add(row["_id"], "feedback_count", row["count"])
+        add(row["_id"], "rating_sum", row["rating_sum"])
+
+    return days
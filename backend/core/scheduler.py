@@ -1,6 +1,7 @@
 """
 APScheduler-based cron scheduler for automated loyalty jobs.
-Runs daily for all users: birthday bonus, anniversary bonus, expiry reminders, points expiry.
+Runs daily for all users: birthday bonus, anniversary bonus, expiry reminders, points expiry,
+and nightly RFM/churn scoring.
 """
 import asyncio
 import logging
@@ -8,8 +9,12 @@ from datetime import datetime, timezone
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
 from core.database import db
+from core.customer_cards import SYNC_INTERVAL_SECONDS, sync_from_outbox
+from core.customer_scoring import run_customer_scoring
+from core.points_holds import SWEEP_INTERVAL_SECONDS, sweep_expired_holds
 from core.loyalty_jobs import (
     run_birthday_bonus,
     run_anniversary_bonus,
@@ -100,6 +105,47 @@ async def daily_loyalty_jobs():
     return summary
 
 
+async def nightly_customer_scoring():
+    """Recompute churn / next-visit / price-sensitivity scores for every user."""
+    start = datetime.now(timezone.utc)
+    logger.info("=== Starting nightly customer scoring ===")
+
+    users = await db.users.find({}, {"_id": 0, "id": 1}).to_list(10000)
+    summary = {
+        "started_at": start.isoformat(),
+        "users_processed": len(users),
+        "customers_scored": 0,
+        "high_churn_risk": 0,
+        "errors": [],
+    }
+
+    for user in users:
+        try:
+            result = await run_customer_scoring(user["id"])
+            summary["customers_scored"] += result["customers_scored"]
+            summary["high_churn_risk"] += result["high_churn_risk"]
+        except Exception as e:
+            logger.error(f"Error scoring customers for user {user['id']}: {e}")
+            summary["errors"].append({"user_id": user["id"], "error": str(e)})
+
+    end = datetime.now(timezone.utc)
+    summary["finished_at"] = end.isoformat()
+    summary["duration_seconds"] = (end - start).total_seconds()
+
+    await db.cron_job_logs.insert_one({
+        "job_name": "nightly_customer_scoring",
+        "status": "completed",
+        **summary
+    })
+
+    last_run_results["nightly_customer_scoring"] = summary
+    logger.info(
+        f"=== Nightly customer scoring finished in {summary['duration_seconds']:.1f}s — "
+        f"{summary['customers_scored']} scored, {summary['high_churn_risk']} high churn risk ==="
+    )
+    return summary
+
+
 def start_scheduler():
     """Start the APScheduler with daily cron triggers."""
     # Run daily at 00:30 UTC (after midnight to avoid date boundary issues)
@@ -110,8 +156,35 @@ def start_scheduler():
         name="Daily Loyalty Jobs (Birthday, Anniversary, Expiry)",
         replace_existing=True,
     )
+    # Scoring reads the whole order history; run after the loyalty jobs
+    scheduler.add_job(
+        nightly_customer_scoring,
+        CronTrigger(hour=1, minute=30),
+        id="nightly_customer_scoring",
+        name="Nightly Customer Scoring (RFM, Churn Risk)",
+        replace_existing=True,
+    )
+    # Keeps this worker's POS card cache coherent with writes made by other workers
+    scheduler.add_job(
+        sync_from_outbox,
+        IntervalTrigger(seconds=SYNC_INTERVAL_SECONDS),
+        id="customer_card_sync",
+        name="Customer Card Cache Sync",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        sweep_expired_holds,
+        IntervalTrigger(seconds=SWEEP_INTERVAL_SECONDS),
+        id="points_hold_sweep",
+        name="Expired Points Hold Sweep",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
     scheduler.start()
-    logger.info("Loyalty cron scheduler started — daily jobs at 00:30 UTC")
+    logger.info("Loyalty cron scheduler started — daily jobs at 00:30 UTC, scoring at 01:30 UTC")
 
 
 def stop_scheduler():
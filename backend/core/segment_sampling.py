@@ -0,0 +1,164 @@
+"""
+Approximate segment sizing.
+
+Counting a segment on a large restaurant means running its full filter over
+`customers`, which takes seconds for regex or range-heavy rules. For the segment
+builder's live preview we instead count against a uniform random sample of the
+restaurant's customers kept in the `customer_samples` side collection, and scale
+by the population size. Estimates come with a 95% Wilson score interval (with a
+finite-population correction).
+
+Samples are refreshed lazily: a stale sample is still used while a background
+task replaces it. Restaurants no bigger than the sample are counted exactly.
+The exact count for a saved segment is still computed on save.
+
+A refresh is claimed through `customer_sample_meta` (core.rebuild_claims), so one
+process samples at a time. The new sample is written under its own `sample_gen`
+and the meta document switches gen, population and sample_size in one update;
+estimates count only the generation their meta names, so they never see a
+partial sample. The old generation is deleted shortly after the switch.
+"""
+from datetime import datetime, timezone, timedelta
+import asyncio
+import logging
+import math
+
+from core.database import db, analytics_db, analytics_db_since
+from core.rebuild_claims import abandon_rebuild, claim_rebuild, finish_rebuild, wait_for_rebuild
+from core.segments import get_segment_plan
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SIZE = 5000
+SAMPLE_TTL = timedelta(minutes=30)
+Z_95 = 1.96
+REFRESH_LEASE_SECONDS = 120
+# Estimates that read the old meta just before the switch still count the old sample
+DROP_DELAY_SECONDS = 5
+
+# Skips spawning refresh tasks this process already has running; the claim decides
+_refreshing = set()
+
+
+async def refresh_customer_sample(user_id: str) -> dict:
+    """Replace a restaurant's sample with a fresh $sample of its customers. If
+    another process is already refreshing, returns the current sample (waiting
+    for the refresh only when there is no sample yet)."""
+    building, _ = await claim_rebuild(db.customer_sample_meta, user_id, REFRESH_LEASE_SECONDS)
+    if not building:
+        meta = await db.customer_sample_meta.find_one({"user_id": user_id}, {"_id": 0, "building": 0})
+        if not meta or "sampled_at" not in meta:
+            meta = await wait_for_rebuild(db.customer_sample_meta, user_id, REFRESH_LEASE_SECONDS) or {}
+            meta.pop("building", None)
+        if "sampled_at" not in meta:
+            # Still no sample: count exactly until one exists
+            meta = {"user_id": user_id, "population": 0, "sample_size": 0,
+                    "sampled_at": datetime.now(timezone.utc).isoformat()}
+        return meta
+    gen = building["gen"]
+
+    try:
+        live = await db.customer_sample_meta.find_one({"user_id": user_id}, {"_id": 0, "gen": 1})
+        # Samples of refreshes that died or were superseded; only the live generation is read
+        await db.customer_samples.delete_many({"user_id": user_id, "sample_gen": {"$nin": [live.get("gen"), gen]}})
+
+        population = await analytics_db.customers.count_documents({"user_id": user_id})
+        docs = []
+        if population > SAMPLE_SIZE:
+            docs = await analytics_db.customers.aggregate([
+                {"$match": {"user_id": user_id}},
+                {"$sample": {"size": SAMPLE_SIZE}},
+                {"$project": {"_id": 0}},
+                {"$set": {"sample_gen": gen}}
+            ]).to_list(SAMPLE_SIZE)
+        if docs:
+            await db.customer_samples.insert_many(docs, ordered=False)
+
+        meta = {
+            "user_id": user_id,
+            "gen": gen,
+            "population": population,
+            "sample_size": len(docs),
+            "sampled_at": datetime.now(timezone.utc).isoformat()
+        }
+        previous = await finish_rebuild(db.customer_sample_meta, user_id, gen, **meta)
+    except BaseException:
+        await abandon_rebuild(db.customer_sample_meta, user_id, gen)
+        await db.customer_samples.delete_many({"user_id": user_id, "sample_gen": gen})
+        raise
+    if previous is None:
+        # Lease expired and another refresh took over; it owns the result
+        await db.customer_samples.delete_many({"user_id": user_id, "sample_gen": gen})
+        return await db.customer_sample_meta.find_one({"user_id": user_id}, {"_id": 0, "building": 0}) or meta
+
+    logger.info(f"Refreshed customer sample for {user_id}: {len(docs)} of {population}")
+    if previous.get("sample_size"):
+        await asyncio.sleep(DROP_DELAY_SECONDS)
+    await db.customer_samples.delete_many({"user_id": user_id, "sample_gen": previous.get("gen")})
+    return meta
+
+
+async def _refresh_in_background(user_id: str):
+    try:
+        await refresh_customer_sample(user_id)
+    except Exception as e:
+        logger.error(f"Customer sample refresh failed for {user_id}: {e}")
+    finally:
+        _refreshing.discard(user_id)
+
+
+async def get_sample_meta(user_id: str) -> dict:
+    """Current sample metadata; refreshes inline if none exists, in the background if stale."""
+    meta = await db.customer_sample_meta.find_one({"user_id": user_id}, {"_id": 0, "building": 0})
+    if not meta or "sampled_at" not in meta:
+        return await refresh_customer_sample(user_id)
+
+    sampled_at = datetime.fromisoformat(meta["sampled_at"])
+    if datetime.now(timezone.utc) - sampled_at > SAMPLE_TTL and user_id not in _refreshing:
+        _refreshing.add(user_id)
+        asyncio.create_task(_refresh_in_background(user_id))
+    return meta
+
+
+def wilson_interval(matches: int, sample_size: int, population: int, z: float = Z_95) -> tuple:
+    """Bounds on the matching proportion for `matches` hits in a sample without replacement."""
+    if sample_size == 0:
+        return 0.0, 1.0
+    p = matches / sample_size
+    fpc = math.sqrt((population - sample_size) / (population - 1)) if population > 1 else 0.0
+    zf = z * fpc
+    denom = 1 + zf * zf / sample_size
+    centre = (p + zf * zf / (2 * sample_size)) / denom
+    margin = zf * math.sqrt(p * (1 - p) / sample_size + zf * zf / (4 * sample_size * sample_size)) / denom
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+async def estimate_segment_size(user_id: str, filters: dict) -> dict:
+    """Estimated customer count for a segment filter, with 95% confidence bounds."""
+    query = get_segment_plan(filters).query(user_id)
+    meta = await get_sample_meta(user_id)
+
+    if not meta["sample_size"]:
+        count = await analytics_db.customers.count_documents(query)
+        return {
+            "estimate": count, "lower": count, "upper": count,
+            "exact": True, "sample_size": meta["population"], "population": meta["population"],
+            "confidence": 1.0, "sampled_at": meta["sampled_at"]
+        }
+
+    sample_size, population = meta["sample_size"], meta["population"]
+    # A just-written sample may not have reached the secondaries yet
+    matches = await analytics_db_since(meta["sampled_at"]).customer_samples.count_documents(
+        {**query, "sample_gen": meta.get("gen")}
+    )
+    low, high = wilson_interval(matches, sample_size, population)
+    return {
+        "estimate": round(matches / sample_size * population),
+        "lower": math.floor(low * population),
+        "upper": math.ceil(high * population),
+        "exact": False,
+        "sample_size": sample_size,
+        "population": population,
+        "confidence": 0.95,
+        "sampled_at": meta["sampled_at"]
+    }
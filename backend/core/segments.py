@@ -0,0 +1,515 @@
+"""
+Segment filter compiler.
+
+A segment's `filters` is a rule tree over customer fields:
+
+    {"and": [
+        {"field": "tier", "op": "in", "value": ["Gold", "Platinum"]},
+        {"or": [
+            {"field": "last_visit", "op": "older_than_days", "value": 45},
+            {"not": {"field": "total_visits", "op": "gte", "value": 3}}
+        ]}
+    ]}
+
+The older flat form ({"tier": ..., "points_min": ..., "search": ...}) is translated
+into the same tree, so existing segments keep working. Compiling a tree:
+
+  1. validates fields and operators against the Customer model,
+  2. pushes NOT down to the leaves and flattens nested AND/OR,
+  3. merges range bounds on one field and OR-ed equalities into `$in`,
+  4. emits a Mongo filter scoped by `user_id`, treating a missing field as its
+     model default (customers are stored sparsely),
+  5. flags predicates that cannot use an index.
+
+Plans are cached per segment; relative dates ("no visit in 45 days") are resolved
+each time the query is built. `verify_segment_plan` runs `explain` once per plan and
+rejects plans whose winning plan is a COLLSCAN.
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional, get_args
+import hashlib
+import json
+import logging
+import re
+
+from core.database import db
+from core.helpers import CUSTOMER_FIELD_DEFAULTS, CUSTOMER_MATERIALIZED_FIELDS
+from models.schemas import Customer
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentFilterError(ValueError):
+    """The rule tree is malformed or references an unknown field/operator."""
+
+
+class SegmentPlanError(ValueError):
+    """The compiled query would scan the whole collection."""
+
+
+# Fields stored as ISO date(time) strings; they accept the relative-date operators
+DATE_FIELDS = {
+    "created_at", "updated_at", "last_visit", "first_visit_date", "predicted_next_visit",
+    "last_interaction_date", "last_whatsapp_sent", "membership_expiry", "whatsapp_opt_in_date",
+}
+
+# Fields that lead (after user_id) a customers index; see core.database.ensure_indexes
+INDEXED_FIELDS = {"created_at", "last_visit", "tier", "total_points", "phone_e164"}
+
+# Operators each field type accepts
+TYPE_OPERATORS = {
+    "string": {"eq", "ne", "in", "nin", "exists", "prefix", "contains", "is_empty", "not_empty"},
+    "number": {"eq", "ne", "in", "nin", "gt", "gte", "lt", "lte", "between", "exists"},
+    "bool": {"eq", "ne"},
+    "array": {"contains", "contains_text", "contains_any", "contains_all", "is_empty", "not_empty"},
+    "date": {"gt", "gte", "lt", "lte", "between", "before", "after", "exists",
+             "within_days", "older_than_days"},
+}
+
+# Operators whose Mongo form can be answered from an index range
+INDEX_OPERATORS = {
+    "eq", "in", "gt", "gte", "lt", "lte", "between", "prefix", "contains", "contains_any",
+    "contains_all", "before", "after", "within_days", "older_than_days", "exists_false",
+}
+
+# NOT(op) as a positive operator; operators missing here compile to $not / $nor
+NEGATED_OPERATORS = {
+    "eq": "ne", "ne": "eq", "in": "nin", "nin": "in",
+    "gt": "lte", "lte": "gt", "gte": "lt", "lt": "gte",
+    "before": "after", "after": "before",
+    "within_days": "older_than_days", "older_than_days": "within_days",
+    "is_empty": "not_empty", "not_empty": "is_empty",
+}
+
+PLAN_CACHE_SIZE = 1024
+
+
+def _field_type(name: str, field) -> str:
+    if name in DATE_FIELDS:
+        return "date"
+    annotation = field.annotation
+    args = [a for a in get_args(annotation) if a is not type(None)]
+    base = args[0] if args else annotation
+    if base is bool:
+        return "bool"
+    if base in (int, float):
+        return "number"
+    if getattr(base, "__origin__", None) is list or base is list:
+        return "array"
+    return "string"
+
+
+FIELD_TYPES = {
+    name: _field_type(name, field)
+    for name, field in Customer.model_fields.items()
+    if name not in ("id", "user_id")
+}
+FIELD_TYPES["phone_e164"] = "string"
+
+
+class RelativeDate:
+    """Placeholder for "now - days", resolved when the query is built."""
+    __slots__ = ("days",)
+
+    def __init__(self, days: float):
+        self.days = days
+
+    def resolve(self, now: datetime) -> str:
+        return (now - timedelta(days=self.days)).isoformat()
+
+    def __repr__(self):
+        return f"RelativeDate({self.days})"
+
+
+def _resolve(node, now: datetime):
+    if isinstance(node, RelativeDate):
+        return node.resolve(now)
+    if isinstance(node, dict):
+        return {k: _resolve(v, now) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_resolve(v, now) for v in node]
+    return node
+
+
+# ---------------------------------------------------------------------------
+# Legacy flat filters
+# ---------------------------------------------------------------------------
+
+def _listify(value) -> list:
+    return value if isinstance(value, list) else [value]
+
+
+def legacy_filters_to_tree(filters: dict) -> dict:
+    """Translate the flat filter dict the segment builder saves into a rule tree."""
+    rules = []
+    for key, field in [("tier", "tier"), ("city", "city"), ("customer_type", "customer_type"),
+                       ("dietary", "diet_preference")]:
+        if filters.get(key):
+            rules.append({"field": field, "op": "in", "value": _listify(filters[key])})
+    for prefix, field in [("points", "total_points"), ("visits", "total_visits"), ("spent", "total_spent")]:
+        if filters.get(f"{prefix}_min") is not None:
+            rules.append({"field": field, "op": "gte", "value": filters[f"{prefix}_min"]})
+        if filters.get(f"{prefix}_max") is not None:
+            rules.append({"field": field, "op": "lte", "value": filters[f"{prefix}_max"]})
+    if filters.get("allergies"):
+        rules.append({"field": "allergies", "op": "contains_any", "value": _listify(filters["allergies"])})
+    if filters.get("favorite_food"):
+        # The flat filter matched a case-insensitive substring, not a whole element
+        rules.append({"field": "favorites", "op": "contains_text", "value": filters["favorite_food"]})
+    if filters.get("last_visit_days"):
+        try:
+            days = int(filters["last_visit_days"])
+        except (TypeError, ValueError):
+            raise SegmentFilterError("last_visit_days must be a number of days")
+        rules.append({"field": "last_visit", "op": "older_than_days", "value": days})
+    if filters.get("search"):
+        rules.append({"or": [
+            {"field": "name", "op": "contains", "value": filters["search"]},
+            {"field": "phone", "op": "contains", "value": filters["search"]},
+            {"field": "email", "op": "contains", "value": filters["search"]},
+        ]})
+    return {"and": rules}
+
+
+def is_rule_tree(filters: dict) -> bool:
+    return bool(filters) and (len(filters.keys() & {"and", "or", "not"}) == 1 or "field" in filters)
+
+
+# ---------------------------------------------------------------------------
+# Normalization
+# ---------------------------------------------------------------------------
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _validate_leaf(rule: dict) -> dict:
+    field, op = rule.get("field"), rule.get("op", "eq")
+    if field not in FIELD_TYPES:
+        raise SegmentFilterError(f"Unknown field '{field}'")
+    field_type = FIELD_TYPES[field]
+    if op not in TYPE_OPERATORS[field_type]:
+        raise SegmentFilterError(f"Operator '{op}' is not valid for {field_type} field '{field}'")
+    value = rule.get("value")
+    if op in ("in", "nin", "contains_any", "contains_all") and not isinstance(value, list):
+        value = [value]
+    if op == "between" and not (isinstance(value, list) and len(value) == 2):
+        raise SegmentFilterError(f"'between' on '{field}' needs [low, high]")
+    if field_type in ("number", "date") and op not in ("exists", "within_days", "older_than_days"):
+        # null stays allowed for equality: it matches customers without the field
+        values = [v for v in (value if isinstance(value, list) else [value])
+                  if not (v is None and op in ("eq", "ne", "in", "nin"))]
+        if field_type == "number" and not all(_is_number(v) for v in values):
+            raise SegmentFilterError(f"'{op}' on number field '{field}' needs numeric values")
+        if field_type == "date" and not all(isinstance(v, str) for v in values):
+            raise SegmentFilterError(f"'{op}' on date field '{field}' needs ISO date strings")
+    if op in ("within_days", "older_than_days"):
+        if not isinstance(value, (int, float)) or value < 0:
+            raise SegmentFilterError(f"'{op}' on '{field}' needs a non-negative number of days")
+    if op == "exists":
+        value = bool(value) if value is not None else True
+    return {"field": field, "op": op, "value": value, "negated": False}
+
+
+def _normalize(node, negate: bool = False):
+    """Return ("and"|"or", [children]) or a leaf dict with NOT pushed down."""
+    if not isinstance(node, dict):
+        raise SegmentFilterError("Rules must be objects")
+    if "not" in node:
+        return _normalize(node["not"], not negate)
+    for kind in ("and", "or"):
+        if kind in node:
+            children = node[kind]
+            if not isinstance(children, list):
+                raise SegmentFilterError(f"'{kind}' must be a list of rules")
+            # De Morgan: NOT(a AND b) == NOT a OR NOT b
+            out_kind = kind if not negate else ("or" if kind == "and" else "and")
+            flat = []
+            for child in children:
+                norm = _normalize(child, negate)
+                if isinstance(norm, tuple) and norm[0] == out_kind:
+                    flat.extend(norm[1])
+                else:
+                    flat.append(norm)
+            return (out_kind, flat)
+    if "field" not in node:
+        raise SegmentFilterError(f"Unrecognized rule: {json.dumps(node, default=str)[:100]}")
+
+    leaf = _validate_leaf(node)
+    if not negate:
+        return leaf
+    op = leaf["op"]
+    if op in NEGATED_OPERATORS:
+        return {**leaf, "op": NEGATED_OPERATORS[op]}
+    if op == "exists":
+        return {**leaf, "value": not leaf["value"]}
+    if op == "between":
+        low, high = leaf["value"]
+        return ("or", [{**leaf, "op": "lt", "value": low}, {**leaf, "op": "gt", "value": high}])
+    return {**leaf, "negated": True}
+
+
+# ---------------------------------------------------------------------------
+# Leaf compilation
+# ---------------------------------------------------------------------------
+
+_COMPARISONS = {
+    "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b,
+}
+
+
+def _sparse_default(field: str):
+    """Value a missing field stands for, or None if the field is always stored."""
+    if field in CUSTOMER_MATERIALIZED_FIELDS:
+        return None
+    return CUSTOMER_FIELD_DEFAULTS.get(field)
+
+
+def _text_regex(value: str, anchored: bool) -> dict:
+    pattern = re.escape(str(value))
+    if anchored:
+        return {"$regex": "^" + pattern}
+    return {"$regex": pattern, "$options": "i"}
+
+
+def _compile_leaf(leaf: dict) -> tuple:
+    """Return (mongo_filter, indexable, warning)."""
+    field, op, value = leaf["field"], leaf["op"], leaf["value"]
+    default = _sparse_default(field)
+    index_op = op if not (op == "exists" and value is False) else "exists_false"
+    indexable = index_op in INDEX_OPERATORS and not leaf["negated"]
+    warning = None
+
+    if op == "eq":
+        cond = {"$in": [value, None]} if default is not None and value == default else value
+    elif op == "ne":
+        cond = {"$nin": [value, None]} if default is not None and value == default else {"$ne": value}
+    elif op == "in":
+        cond = {"$in": value + [None] if default is not None and default in value else value}
+    elif op == "nin":
+        cond = {"$nin": value + [None] if default is not None and default in value else value}
+    elif op in _COMPARISONS:
+        if default is not None and not isinstance(default, str) and _COMPARISONS[op](default, value):
+            # Missing fields hold the default, which satisfies the comparison
+            return {"$or": [{field: {f"${op}": value}}, {field: None}]}, indexable, None
+        cond = {f"${op}": value}
+    elif op == "between":
+        cond = {"$gte": value[0], "$lte": value[1]}
+    elif op == "before":
+        cond = {"$lt": value}
+    elif op == "after":
+        cond = {"$gte": value}
+    elif op == "within_days":
+        cond = {"$gte": RelativeDate(value)}
+    elif op == "older_than_days":
+        # Never visited counts as "no visit in N days"
+        return {"$or": [{field: {"$lt": RelativeDate(value)}}, {field: None}]}, indexable, None
+    elif op == "exists":
+        cond = {"$ne": None} if value else None
+    elif op == "prefix":
+        cond = _text_regex(value, anchored=True)
+    elif op == "contains":
+        if FIELD_TYPES[field] == "array":
+            cond = value
+        else:
+            cond = _text_regex(value, anchored=False)
+            indexable = False
+            warning = f"{field}: substring match cannot use an index; use 'prefix' or 'eq' where possible"
+    elif op == "contains_text":
+        # $regex on an array matches when any element contains the text
+        cond = _text_regex(value, anchored=False)
+        warning = f"{field}: substring match cannot use an index; use 'contains' where possible"
+    elif op == "contains_any":
+        cond = {"$in": value}
+    elif op == "contains_all":
+        cond = {"$all": value}
+    elif op == "is_empty":
+        cond = {"$in": [None, [], ""]}
+    elif op == "not_empty":
+        cond = {"$nin": [None, [], ""]}
+    else:  # pragma: no cover - guarded by TYPE_OPERATORS
+        raise SegmentFilterError(f"Unsupported operator '{op}'")
+
+    if leaf["negated"]:
+        if isinstance(cond, dict) and all(k.startswith("$") for k in cond):
+            cond = {"$not": cond}
+        else:
+            cond = {"$ne": cond}
+        warning = warning or f"{field}: NOT {op} cannot use an index"
+    elif not indexable and warning is None:
+        warning = f"{field}: '{op}' cannot use an index"
+    return {field: cond}, indexable, warning
+
+
+# ---------------------------------------------------------------------------
+# Tree compilation
+# ---------------------------------------------------------------------------
+
+def _is_range(pred: dict) -> bool:
+    if len(pred) != 1:
+        return False
+    (field, cond), = pred.items()
+    return not field.startswith("$") and isinstance(cond, dict) and bool(cond) and \
+        set(cond) <= {"$gt", "$gte", "$lt", "$lte"}
+
+
+def _merge_and(preds: list) -> list:
+    """Combine range bounds on the same field into one predicate."""
+    merged, ranges = [], {}
+    for pred in preds:
+        if list(pred) == ["$and"]:
+            merged.extend(pred["$and"])
+            continue
+        if _is_range(pred):
+            (field, cond), = pred.items()
+            existing = ranges.get(field)
+            if existing is not None and not (set(existing) & set(cond)):
+                existing.update(cond)
+                continue
+            if existing is None:
+                ranges[field] = cond = dict(cond)
+                merged.append({field: cond})
+                continue
+        merged.append(pred)
+    return merged
+
+
+def _merge_or(preds: list) -> list:
+    """Fold OR-ed equality / $in on the same field into a single $in."""
+    merged, values = [], {}
+    for pred in preds:
+        if list(pred) == ["$or"]:
+            merged.extend(pred["$or"])
+            continue
+        if len(pred) == 1:
+            (field, cond), = pred.items()
+            if not field.startswith("$"):
+                if isinstance(cond, dict) and set(cond) == {"$in"}:
+                    items = cond["$in"]
+                elif not isinstance(cond, (dict, list)):
+                    items = [cond]
+                else:
+                    items = None
+                if items is not None:
+                    if field in values:
+                        values[field].extend(v for v in items if v not in values[field])
+                        continue
+                    values[field] = list(items)
+                    merged.append({field: {"$in": values[field]}})
+                    continue
+        merged.append(pred)
+    return merged
+
+
+def _compile_node(node, warnings: list) -> tuple:
+    """Return (mongo_filter or None, indexed fields that bound the match)."""
+    if isinstance(node, dict):
+        pred, indexable, warning = _compile_leaf(node)
+        if warning:
+            warnings.append(warning)
+        return pred, ({node["field"]} & INDEXED_FIELDS) if indexable else set()
+
+    kind, children = node
+    compiled = [_compile_node(child, warnings) for child in children]
+    preds = [p for p, _ in compiled if p is not None]
+    if not preds:
+        return None, set()
+
+    if kind == "and":
+        preds = _merge_and(preds)
+        # An AND is bounded by an index if any conjunct is
+        bounded = set().union(*(fields for _, fields in compiled))
+        return (preds[0] if len(preds) == 1 else {"$and": preds}), bounded
+
+    preds = _merge_or(preds)
+    # An OR needs every branch bounded, otherwise the planner scans
+    branch_fields = [fields for _, fields in compiled]
+    bounded = set().union(*branch_fields) if all(branch_fields) else set()
+    return (preds[0] if len(preds) == 1 else {"$or": preds}), bounded
+
+
+class SegmentPlan:
+    """A compiled segment filter. `query()` resolves relative dates at call time."""
+
+    def __init__(self, fingerprint: str, template: Optional[dict], index_bounded: bool, warnings: List[str]):
+        self.fingerprint = fingerprint
+        self.template = template
+        self.index_bounded = index_bounded
+        self.warnings = warnings
+        self.verified = False
+        self.collscan = False
+
+    def query(self, user_id: str, now: Optional[datetime] = None) -> dict:
+        query = {"user_id": user_id}
+        if self.template is not None:
+            query.update(_resolve(self.template, now or datetime.now(timezone.utc)))
+        return query
+
+
+def filters_fingerprint(filters: dict) -> str:
+    return hashlib.sha1(json.dumps(filters or {}, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def compile_segment(filters: dict) -> SegmentPlan:
+    """Compile a rule tree (or legacy flat filter dict) into a SegmentPlan."""
+    filters = filters or {}
+    tree = filters if is_rule_tree(filters) else legacy_filters_to_tree(filters)
+    warnings: List[str] = []
+    template, bounded = _compile_node(_normalize(tree), warnings)
+
+    index_bounded = bool(bounded)
+    if template is not None and not index_bounded:
+        warnings.append("No condition narrows an index; the segment is evaluated against every customer of the restaurant")
+    return SegmentPlan(filters_fingerprint(filters), template, index_bounded, list(dict.fromkeys(warnings)))
+
+
+# ---------------------------------------------------------------------------
+# Plan cache and verification
+# ---------------------------------------------------------------------------
+
+_plan_cache: "OrderedDict[str, SegmentPlan]" = OrderedDict()
+
+
+def get_segment_plan(filters: dict, segment_id: Optional[str] = None) -> SegmentPlan:
+    """Compiled plan for a segment, cached by segment id (or filter fingerprint)."""
+    fingerprint = filters_fingerprint(filters)
+    key = segment_id or fingerprint
+    plan = _plan_cache.get(key)
+    if plan is not None and plan.fingerprint == fingerprint:
+        _plan_cache.move_to_end(key)
+        return plan
+    plan = compile_segment(filters)
+    _plan_cache[key] = plan
+    if len(_plan_cache) > PLAN_CACHE_SIZE:
+        _plan_cache.popitem(last=False)
+    return plan
+
+
+def evict_segment_plan(segment_id: str):
+    _plan_cache.pop(segment_id, None)
+
+
+def _has_collscan(plan: dict) -> bool:
+    if not isinstance(plan, dict):
+        return False
+    if plan.get("stage") == "COLLSCAN":
+        return True
+    children = [plan.get("inputStage"), plan.get("queryPlan")] + list(plan.get("inputStages") or [])
+    return any(_has_collscan(child) for child in children if child)
+
+
+async def verify_segment_plan(plan: SegmentPlan, user_id: str) -> List[str]:
+    """Explain the plan once; raise SegmentPlanError if Mongo would COLLSCAN."""
+    if not plan.verified:
+        explain = await db.command(
+            "explain", {"find": "customers", "filter": plan.query(user_id)}, verbosity="queryPlanner"
+        )
+        plan.collscan = _has_collscan(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        plan.verified = True
+        if plan.collscan:
+            logger.warning(f"Segment plan {plan.fingerprint[:8]} resolves to a COLLSCAN: {plan.template}")
+    if plan.collscan:
+        raise SegmentPlanError("Segment filter would scan the entire customers collection; add an indexed condition")
+    return plan.warnings
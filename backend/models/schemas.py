@@ -239,6 +239,8 @@ class CustomerUpdate(BaseModel):
     notes: Optional[str] = None
 
 class Customer(BaseModel):
+    # Customer documents are stored sparsely (see core.helpers.compact_customer_doc);
+    # fields missing from the document fall back to the defaults declared here.
     model_config = ConfigDict(extra="ignore")
     
     # System Fields
@@ -257,7 +259,7 @@ class Customer(BaseModel):
     anniversary: Optional[str] = None
     preferred_language: Optional[str] = None
     customer_type: str = "normal"
-    segment_tags: Optional[List[str]] = None
+    segment_tags: Optional[List[str]] = []
     
     # Contact & Marketing Permissions
     whatsapp_opt_in: bool = False
@@ -270,6 +272,7 @@ class Customer(BaseModel):
     
     # Loyalty Information
     total_points: int = 0
+    held_points: int = 0  # reserved by open POS redemption holds, not in total_points
     wallet_balance: float = 0.0
     tier: str = "Bronze"
     referral_code: Optional[str] = None
@@ -317,8 +320,8 @@ class Customer(BaseModel):
     map_location: Optional[dict] = None
     
     # Preferences
-    allergies: Optional[List[str]] = None
-    favorites: Optional[List[str]] = None
+    allergies: Optional[List[str]] = []
+    favorites: Optional[List[str]] = []
     
     # Dining Preferences
     preferred_dining_type: Optional[str] = None
@@ -330,10 +333,10 @@ class Customer(BaseModel):
     cuisine_preference: Optional[str] = None
     
     # Special Occasions
-    kids_birthday: Optional[List[str]] = None
+    kids_birthday: Optional[List[str]] = []
     spouse_name: Optional[str] = None
-    festival_preference: Optional[List[str]] = None
-    special_dates: Optional[List[dict]] = None
+    festival_preference: Optional[List[str]] = []
+    special_dates: Optional[List[dict]] = []
     
     # Feedback & Flags
     last_rating: Optional[int] = None
@@ -456,6 +459,8 @@ class Segment(BaseModel):
     name: str
     filters: dict
     customer_count: int = 0
+    plan_warnings: List[str] = []
+    filter_error: Optional[str] = None
     created_at: str
     updated_at: str
 
@@ -587,6 +592,21 @@ class Feedback(BaseModel):
     status: str = "pending"
     created_at: str
 
+# Customer 360 Models
+class ExpiringPointsSummary(BaseModel):
+    expiring_soon: int = 0
+    expiring_date: Optional[str] = None
+    already_expired: int = 0
+    expiry_months: int = 0
+
+class Customer360(BaseModel):
+    customer: Customer
+    points_transactions: List[PointsTransaction]
+    wallet_transactions: List[WalletTransaction]
+    orders: List[dict]
+    feedback: List[Feedback]
+    expiring_points: ExpiringPointsSummary
+
 # Analytics Models
 class DashboardStats(BaseModel):
     total_customers: int
@@ -610,6 +630,7 @@ class POSPaymentWebhook(BaseModel):
     channel: str = "dine_in"
     coupon_code: Optional[str] = None
     redeem_points: Optional[int] = None
+    hold_id: Optional[str] = None  # spend a hold from /pos/points/hold instead of redeem_points
     bill_id: Optional[str] = None
     metadata: Optional[dict] = None
 
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends, Query
+from typing import Optional
+
+from core.auth import get_current_user
+from core.changes import read_changes
+
+router = APIRouter(prefix="/changes", tags=["Changes"])
+
+@router.get("")
+async def get_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=5000),
+    entity: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    """
+    Incremental change feed for customers, points/wallet transactions and orders.
+    Pass the returned `next_since` as `since` on the next call. `reset: true`
+    means events after `since` have expired and the consumer must resync fully.
+    """
+    return await read_changes(user["id"], since, limit, entity)
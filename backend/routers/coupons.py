@@ -1,10 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import List, Optional
 from datetime import datetime, timezone
 import uuid
 
 from core.database import db
 from core.auth import get_current_user
+from core.coupon_redemption import CouponRejected, redeem_coupon
+from core.coupon_analytics import CURVE_BUCKETS, get_coupon_summary, get_coupon_usage_page
+from core.helpers import coupon_discount, coupon_rejection
+from core.responses import model_list_response, trusted
 from models.schemas import Coupon, CouponCreate, CouponUpdate
 
 router = APIRouter(prefix="/coupons", tags=["Coupons"])
@@ -39,7 +43,7 @@ async def create_coupon(coupon_data: CouponCreate, user: dict = Depends(get_curr
     }
     
     await db.coupons.insert_one(coupon_doc)
-    return Coupon(**coupon_doc)
+    return trusted(Coupon, coupon_doc)
 
 @router.get("", response_model=List[Coupon])
 async def list_coupons(active_only: bool = False, user: dict = Depends(get_current_user)):
@@ -48,14 +52,14 @@ async def list_coupons(active_only: bool = False, user: dict = Depends(get_curre
         query["is_active"] = True
     
     coupons = await db.coupons.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
-    return [Coupon(**c) for c in coupons]
+    return model_list_response(Coupon, coupons)
 
 @router.get("/{coupon_id}", response_model=Coupon)
 async def get_coupon(coupon_id: str, user: dict = Depends(get_current_user)):
     coupon = await db.coupons.find_one({"id": coupon_id, "user_id": user["id"]}, {"_id": 0})
     if not coupon:
         raise HTTPException(status_code=404, detail="Coupon not found")
-    return Coupon(**coupon)
+    return trusted(Coupon, coupon)
 
 @router.put("/{coupon_id}", response_model=Coupon)
 async def update_coupon(coupon_id: str, coupon_data: CouponUpdate, user: dict = Depends(get_current_user)):
@@ -78,7 +82,7 @@ async def update_coupon(coupon_id: str, coupon_data: CouponUpdate, user: dict =
         await db.coupons.update_one({"id": coupon_id}, {"$set": update_data})
     
     updated = await db.coupons.find_one({"id": coupon_id}, {"_id": 0})
-    return Coupon(**updated)
+    return trusted(Coupon, updated)
 
 @router.delete("/{coupon_id}")
 async def delete_coupon(coupon_id: str, user: dict = Depends(get_current_user)):
@@ -86,6 +90,7 @@ async def delete_coupon(coupon_id: str, user: dict = Depends(get_current_user)):
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Coupon not found")
     await db.coupon_usage.delete_many({"coupon_id": coupon_id})
+    await db.coupon_customer_usage.delete_many({"coupon_id": coupon_id})
     return {"message": "Coupon deleted"}
 
 @router.post("/{coupon_id}/toggle")
@@ -115,41 +120,15 @@ async def validate_coupon(
     if not coupon:
         raise HTTPException(status_code=404, detail="Invalid coupon code")
     
-    now = datetime.now(timezone.utc).isoformat()
-    
-    if coupon["start_date"] > now:
-        raise HTTPException(status_code=400, detail="Coupon not yet active")
-    if coupon["end_date"] < now:
-        raise HTTPException(status_code=400, detail="Coupon has expired")
-    
-    if coupon.get("usage_limit") and coupon.get("total_used", 0) >= coupon["usage_limit"]:
-        raise HTTPException(status_code=400, detail="Coupon usage limit reached")
-    
     user_usage = await db.coupon_usage.count_documents({
         "coupon_id": coupon["id"],
         "customer_id": customer_id
     })
-    if user_usage >= coupon.get("per_user_limit", 1):
-        raise HTTPException(status_code=400, detail="You have already used this coupon")
+    rejection = coupon_rejection(coupon, customer_id, order_value, channel, user_usage)
+    if rejection:
+        raise HTTPException(status_code=400, detail=rejection)
     
-    if order_value < coupon.get("min_order_value", 0):
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Minimum order value is Rs.{coupon['min_order_value']}"
-        )
-    
-    if channel not in coupon.get("applicable_channels", []):
-        raise HTTPException(status_code=400, detail="Coupon not valid for this order type")
-    
-    if coupon.get("specific_users") and customer_id not in coupon["specific_users"]:
-        raise HTTPException(status_code=400, detail="Coupon not valid for this customer")
-    
-    if coupon["discount_type"] == "percentage":
-        discount = (order_value * coupon["discount_value"]) / 100
-        if coupon.get("max_discount"):
-            discount = min(discount, coupon["max_discount"])
-    else:
-        discount = min(coupon["discount_value"], order_value)
+    discount = coupon_discount(coupon, order_value)
     
     return {
         "valid": True,
@@ -166,53 +145,63 @@ async def apply_coupon(
     channel: str,
     user: dict = Depends(get_current_user)
 ):
-    validation = await validate_coupon(code, customer_id, order_value, channel, user)
-    
-    coupon = await db.coupons.find_one({"user_id": user["id"], "code": code.upper()})
-    
-    usage_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
-    
-    usage_doc = {
-        "id": usage_id,
-        "coupon_id": coupon["id"],
-        "customer_id": customer_id,
-        "order_value": order_value,
-        "discount_applied": validation["discount"],
-        "channel": channel,
-        "used_at": now
-    }
+    coupon = await db.coupons.find_one({
+        "user_id": user["id"],
+        "code": code.upper(),
+        "is_active": True
+    }, {"_id": 0})
     
-    await db.coupon_usage.insert_one(usage_doc)
+    if not coupon:
+        raise HTTPException(status_code=404, detail="Invalid coupon code")
     
-    await db.coupons.update_one(
-        {"id": coupon["id"]},
-        {"$inc": {"total_used": 1}}
-    )
+    try:
+        redemption = await redeem_coupon(user["id"], code, customer_id, order_value, channel, coupon=coupon)
+    except CouponRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     return {
         "success": True,
-        "discount": validation["discount"],
-        "final_amount": validation["final_amount"],
-        "usage_id": usage_id
+        "discount": redemption["discount"],
+        "final_amount": redemption["final_amount"],
+        "usage_id": redemption["id"]
     }
 
 @router.get("/{coupon_id}/usage")
-async def get_coupon_usage(coupon_id: str, user: dict = Depends(get_current_user)):
-    coupon = await db.coupons.find_one({"id": coupon_id, "user_id": user["id"]})
+async def get_coupon_usage(
+    coupon_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    coupon = await db.coupons.find_one({"id": coupon_id, "user_id": user["id"]}, {"_id": 0})
     if not coupon:
         raise HTTPException(status_code=404, detail="Coupon not found")
     
-    usage = await db.coupon_usage.find({"coupon_id": coupon_id}, {"_id": 0}).sort("used_at", -1).to_list(100)
+    try:
+        page = await get_coupon_usage_page(coupon_id, user["id"], limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    summary = await get_coupon_summary(coupon_id)
     
-    for u in usage:
-        customer = await db.customers.find_one({"id": u["customer_id"]}, {"_id": 0, "name": 1, "phone": 1})
-        if customer:
-            u["customer_name"] = customer.get("name")
-            u["customer_phone"] = customer.get("phone")
+    return {
+        "coupon": Coupon(**coupon),
+        **page,
+        "total_discount_given": summary["discount_given"]
+    }
+
+@router.get("/{coupon_id}/analytics")
+async def get_coupon_analytics(coupon_id: str, bucket: str = "day", user: dict = Depends(get_current_user)):
+    """Redemptions, unique customers, discount given, attributed revenue and redemption curve."""
+    coupon = await db.coupons.find_one({"id": coupon_id, "user_id": user["id"]}, {"_id": 0})
+    if not coupon:
+        raise HTTPException(status_code=404, detail="Coupon not found")
+    if bucket not in CURVE_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(CURVE_BUCKETS)}")
     
+    summary = await get_coupon_summary(coupon_id, bucket)
+    usage_limit = coupon.get("usage_limit")
     return {
         "coupon": Coupon(**coupon),
-        "usage": usage,
-        "total_discount_given": sum(u["discount_applied"] for u in usage)
+        **summary,
+        "usage_limit_used_percent": round(summary["redemptions"] / usage_limit * 100, 1) if usage_limit else None
     }
@@ -7,6 +7,15 @@ from datetime import datetime, timezone
 from core.auth import get_current_user
 from core.database import db
 from core.scheduler import daily_loyalty_jobs, last_run_results, scheduler
+from core.customer_merge import run_duplicate_merge
+from core.customer_scoring import run_customer_scoring
+from core.rollups import rebuild_rollups
+from core.result_cache import cache_stats
+from core.customer_cards import card_cache_stats
+from core.pos_api_keys import api_key_cache_stats
+from core.order_queue import queue_stats
+from core.rate_limit import rate_limit_stats
+from core.db_profiler import reset_route_stats, route_report
 from core.loyalty_jobs import (
     run_birthday_bonus,
     run_anniversary_bonus,
@@ -38,9 +47,23 @@ async def get_scheduler_status(user: dict = Depends(get_current_user)):
         "scheduled_jobs": jobs,
         "last_run_summary": last_run_results.get("daily_loyalty_jobs"),
         "recent_logs": recent_logs,
+        "result_caches": cache_stats(),
+        "customer_card_cache": card_cache_stats(),
+        "pos_api_key_cache": api_key_cache_stats(),
+        "pos_order_queue": await queue_stats(),
+        "rate_limiting": rate_limit_stats(),
     }
 
 
+@router.get("/db-profile")
+async def get_db_profile(limit: int = 20, reset: bool = False, user: dict = Depends(get_current_user)):
+    """Routes with the most Mongo round trips per request since startup (or the last reset)."""
+    routes = route_report(limit)
+    if reset:
+        reset_route_stats()
+    return {"routes": routes}
+
+
 @router.post("/trigger")
 async def trigger_all_jobs(user: dict = Depends(get_current_user)):
     """Manually trigger all daily loyalty jobs for the current user."""
@@ -68,3 +91,31 @@ async def trigger_all_users_jobs(user: dict = Depends(get_current_user)):
     """Manually trigger the full daily cron job for ALL users (admin-level)."""
     result = await daily_loyalty_jobs()
     return {"message": "Daily loyalty jobs executed for all users", "result": result}
+
+
+@router.post("/score-customers")
+async def score_customers(user: dict = Depends(get_current_user)):
+    """Recompute churn risk, next-visit prediction and offer recommendations now."""
+    result = await run_customer_scoring(user["id"])
+    return {"message": f"Scored {result['customers_scored']} customers", **result}
+
+
+@router.post("/rebuild-rollups")
+async def rebuild_daily_rollups(user: dict = Depends(get_current_user)):
+    """Recompute the dashboard's daily rollups from orders, ledgers, customers and feedback."""
+    result = await rebuild_rollups(user["id"])
+    if result.get("in_progress"):
+        return {"message": "A rollup rebuild was already running; it has finished", **result}
+    return {"message": f"Rebuilt {result['days']} daily rollups", **result}
+
+
+@router.post("/merge-duplicates")
+async def merge_duplicate_customers(dry_run: bool = True, user: dict = Depends(get_current_user)):
+    """Detect customers sharing a canonical phone number and merge them (dry run by default)."""
+    settings = await db.loyalty_settings.find_one({"user_id": user["id"]}, {"_id": 0}) or {}
+    result = await run_duplicate_merge(user["id"], settings, dry_run=dry_run)
+    return {
+        "message": f"Found {result['duplicate_groups']} duplicate phone groups"
+                   + ("" if dry_run else f", merged {result['customers_merged']} customers"),
+        **result
+    }
@@ -1,15 +1,30 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from typing import List, Optional
 from datetime import datetime, timezone, timedelta
+import asyncio
 import uuid
 import os
 import httpx
+from pymongo.errors import DuplicateKeyError
 
-from core.database import db
+from core.database import db, analytics_db
 from core.auth import get_current_user
-from core.helpers import generate_qr_code, build_customer_query
+from core.responses import model_list_response, trusted
+from core.helpers import (
+    generate_qr_code, compact_customer_doc, summarize_expiring_points,
+    normalize_phone, phone_query
+)
+from core.changes import (
+    CUSTOMER, POINTS_TRANSACTION, change, changed_fields, record_change, record_changes
+)
+from core.rollups import bump_daily, retract_customer
+from core.result_cache import TenantCache, invalidate_tenant, wants_refresh
+from core.segment_sampling import estimate_segment_size
+from core.segments import (
+    SegmentFilterError, SegmentPlanError, get_segment_plan, evict_segment_plan, verify_segment_plan
+)
 from models.schemas import (
-    Customer, CustomerCreate, CustomerUpdate,
+    Customer, CustomerCreate, CustomerUpdate, Customer360,
     Segment, SegmentCreate, SegmentUpdate
 )
 
@@ -57,6 +72,7 @@ async def sync_customers_from_mygenie(user: dict = Depends(get_current_user)):
             
             synced_count = 0
             updated_count = 0
+            changes = []
             
             for mygenie_customer in customer_list:
                 # Map MyGenie customer to our schema
@@ -64,6 +80,7 @@ async def sync_customers_from_mygenie(user: dict = Depends(get_current_user)):
                     "user_id": user["id"],
                     "name": mygenie_customer.get("customer_name") or "Unknown",
                     "phone": mygenie_customer.get("phone") or "",
+                    "phone_e164": normalize_phone(mygenie_customer.get("phone") or ""),
                     "country_code": "+91",
                     "email": f"customer{mygenie_customer['id']}@mygenie.local",
                     "dob": mygenie_customer.get("date_of_birth"),
@@ -94,11 +111,17 @@ async def sync_customers_from_mygenie(user: dict = Depends(get_current_user)):
                     tier = "Bronze"
                 customer_data["tier"] = tier
                 
-                # Check if customer already exists
+                # Check if customer already exists (linked by MyGenie id, else by phone)
                 existing = await db.customers.find_one({
                     "user_id": user["id"],
                     "mygenie_customer_id": mygenie_customer["id"]
                 })
+                if not existing and customer_data["phone_e164"]:
+                    existing = await db.customers.find_one(
+                        {"user_id": user["id"], "phone_e164": customer_data["phone_e164"]}
+                    )
+                if not customer_data["phone_e164"]:
+                    customer_data.pop("phone_e164")
                 
                 if existing:
                     # Update existing customer
@@ -106,6 +129,7 @@ async def sync_customers_from_mygenie(user: dict = Depends(get_current_user)):
                         {"id": existing["id"]},
                         {"$set": customer_data}
                     )
+                    changes.append(change(CUSTOMER, existing["id"], "update", customer_data.keys()))
                     updated_count += 1
                 else:
                     # Create new customer
@@ -125,9 +149,13 @@ async def sync_customers_from_mygenie(user: dict = Depends(get_current_user)):
                     customer_data["total_spent"] = 0.0
                     customer_data["last_visit"] = None
                     
-                    await db.customers.insert_one(customer_data)
+                    await db.customers.insert_one(compact_customer_doc(customer_data))
+                    changes.append(change(CUSTOMER, customer_data["id"], "insert"))
                     synced_count += 1
             
+            await record_changes(user["id"], changes)
+            await bump_daily(user["id"], new_customers=synced_count)
+            invalidate_tenant(user["id"])
             return {
                 "success": True,
                 "synced": synced_count,
@@ -147,7 +175,9 @@ async def sync_customers_from_mygenie(user: dict = Depends(get_current_user)):
 @router.post("", response_model=Customer)
 async def create_customer(customer_data: CustomerCreate, user: dict = Depends(get_current_user)):
     # Check if phone exists for this user
-    existing = await db.customers.find_one({"user_id": user["id"], "phone": customer_data.phone})
+    existing = await db.customers.find_one(
+        phone_query(user["id"], customer_data.phone, customer_data.country_code)
+    )
     if existing:
         raise HTTPException(status_code=400, detail="Customer with this phone already exists")
     
@@ -208,7 +238,7 @@ async def create_customer(customer_data: CustomerCreate, user: dict = Depends(ge
     if settings and settings.get("first_visit_bonus_enabled", False):
         first_visit_bonus = settings.get("first_visit_bonus_points", 50)
     
-    customer_doc = {
+    customer_doc = compact_customer_doc({
         "id": customer_id,
         "user_id": user["id"],
         "created_at": now,
@@ -217,6 +247,7 @@ async def create_customer(customer_data: CustomerCreate, user: dict = Depends(ge
         # Basic Information
         "name": customer_data.name,
         "phone": customer_data.phone,
+        "phone_e164": normalize_phone(customer_data.phone, customer_data.country_code),
         "country_code": customer_data.country_code,
         "email": customer_data.email,
         "gender": customer_data.gender,
@@ -327,9 +358,13 @@ async def create_customer(customer_data: CustomerCreate, user: dict = Depends(ge
         "mygenie_customer_id": mygenie_customer_id,
         "mygenie_synced": mygenie_customer_id is not None,
         "first_visit_bonus_awarded": first_visit_bonus > 0
-    }
+    })
     
-    await db.customers.insert_one(customer_doc)
+    try:
+        await db.customers.insert_one(customer_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Customer with this phone already exists")
+    changes = [change(CUSTOMER, customer_id, "insert")]
     
     # Record first visit bonus transaction if awarded
     if first_visit_bonus > 0:
@@ -345,8 +380,11 @@ async def create_customer(customer_data: CustomerCreate, user: dict = Depends(ge
             "created_at": now
         }
         await db.points_transactions.insert_one(tx_doc)
+        changes.append(change(POINTS_TRANSACTION, tx_doc["id"], "insert", customer_id=customer_id))
     
-    return Customer(**customer_doc)
+    await record_changes(user["id"], changes)
+    await bump_daily(user["id"], new_customers=1, points_issued=first_visit_bonus)
+    return trusted(Customer, customer_doc)
 
 @router.get("/sample-data")
 async def get_sample_customer_data(user: dict = Depends(get_current_user)):
@@ -435,24 +473,29 @@ async def list_customers(
     sort_field = sort_by if sort_by in ["created_at", "last_visit", "total_spent", "total_points", "name"] else "created_at"
     
     customers = await db.customers.find(query, {"_id": 0}).sort(sort_field, sort_direction).skip(skip).limit(limit).to_list(limit)
-    return [Customer(**c) for c in customers]
+    return model_list_response(Customer, customers)
+
+segment_stats_cache = TenantCache("segment_stats")
 
 @router.get("/segments/stats")
-async def get_customer_segments(user: dict = Depends(get_current_user)):
+async def get_customer_segments(request: Request, user: dict = Depends(get_current_user)):
     """Get customer segment statistics for campaign targeting"""
-    user_id = user["id"]
-    
-    total = await db.customers.count_documents({"user_id": user_id})
+    return await segment_stats_cache.get(
+        user["id"], lambda: _compute_segment_stats(user["id"]), refresh=wants_refresh(request)
+    )
+
+async def _compute_segment_stats(user_id: str) -> dict:
+    total = await analytics_db.customers.count_documents({"user_id": user_id})
     
     tier_stats = {}
     for tier in ["Bronze", "Silver", "Gold", "Platinum"]:
-        tier_stats[tier.lower()] = await db.customers.count_documents({"user_id": user_id, "tier": tier})
+        tier_stats[tier.lower()] = await analytics_db.customers.count_documents({"user_id": user_id, "tier": tier})
     
-    normal_count = await db.customers.count_documents({"user_id": user_id, "customer_type": "normal"})
-    corporate_count = await db.customers.count_documents({"user_id": user_id, "customer_type": "corporate"})
+    normal_count = await analytics_db.customers.count_documents({"user_id": user_id, "customer_type": "normal"})
+    corporate_count = await analytics_db.customers.count_documents({"user_id": user_id, "customer_type": "corporate"})
     
     thirty_days_ago = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
-    inactive_30d = await db.customers.count_documents({
+    inactive_30d = await analytics_db.customers.count_documents({
         "user_id": user_id,
         "$or": [
             {"last_visit": {"$lt": thirty_days_ago}},
@@ -461,7 +504,7 @@ async def get_customer_segments(user: dict = Depends(get_current_user)):
     })
     
     sixty_days_ago = (datetime.now(timezone.utc) - timedelta(days=60)).isoformat()
-    inactive_60d = await db.customers.count_documents({
+    inactive_60d = await analytics_db.customers.count_documents({
         "user_id": user_id,
         "$or": [
             {"last_visit": {"$lt": sixty_days_ago}},
@@ -469,7 +512,7 @@ async def get_customer_segments(user: dict = Depends(get_current_user)):
         ]
     })
     
-    with_allergies = await db.customers.count_documents({
+    with_allergies = await analytics_db.customers.count_documents({
         "user_id": user_id,
         "allergies": {"$exists": True, "$ne": []}
     })
@@ -480,7 +523,7 @@ async def get_customer_segments(user: dict = Depends(get_current_user)):
         {"$sort": {"count": -1}},
         {"$limit": 10}
     ]
-    cities = await db.customers.aggregate(cities_pipeline).to_list(10)
+    cities = await analytics_db.customers.aggregate(cities_pipeline).to_list(10)
     
     favorites_pipeline = [
         {"$match": {"user_id": user_id, "favorites": {"$exists": True, "$ne": []}}},
@@ -489,7 +532,7 @@ async def get_customer_segments(user: dict = Depends(get_current_user)):
         {"$sort": {"count": -1}},
         {"$limit": 10}
     ]
-    top_favorites = await db.customers.aggregate(favorites_pipeline).to_list(10)
+    top_favorites = await analytics_db.customers.aggregate(favorites_pipeline).to_list(10)
     
     return {
         "total": total,
@@ -507,7 +550,43 @@ async def get_customer(customer_id: str, user: dict = Depends(get_current_user))
     customer = await db.customers.find_one({"id": customer_id, "user_id": user["id"]}, {"_id": 0})
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return Customer(**customer)
+    return trusted(Customer, customer)
+
+@router.get("/{customer_id}/360", response_model=Customer360)
+async def get_customer_360(customer_id: str, limit: int = 20, user: dict = Depends(get_current_user)):
+    """Customer profile page in one round trip: profile, recent ledgers, orders,
+    feedback and expiring-points summary, read concurrently."""
+    scope = {"customer_id": customer_id, "user_id": user["id"]}
+    
+    customer, settings, points_txs, wallet_txs, orders, feedback, expiry_txs = await asyncio.gather(
+        db.customers.find_one({"id": customer_id, "user_id": user["id"]}, {"_id": 0}),
+        db.loyalty_settings.find_one(
+            {"user_id": user["id"]},
+            {"_id": 0, "points_expiry_months": 1, "expiry_reminder_days": 1}
+        ),
+        db.points_transactions.find(scope, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit),
+        db.wallet_transactions.find(scope, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit),
+        db.orders.find(scope, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit),
+        db.feedback.find(scope, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit),
+        db.points_transactions.find(
+            {**scope, "transaction_type": {"$in": ["earn", "bonus"]}},
+            {"_id": 0, "points": 1, "created_at": 1}
+        ).to_list(1000),
+    )
+    if not customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    
+    expiry_months = settings.get("points_expiry_months", 6) if settings else 6
+    reminder_days = settings.get("expiry_reminder_days", 30) if settings else 30
+    
+    return {
+        "customer": customer,
+        "points_transactions": points_txs,
+        "wallet_transactions": wallet_txs,
+        "orders": orders,
+        "feedback": feedback,
+        "expiring_points": summarize_expiring_points(expiry_txs, expiry_months, reminder_days)
+    }
 
 @router.put("/{customer_id}", response_model=Customer)
 async def update_customer(customer_id: str, update_data: CustomerUpdate, user: dict = Depends(get_current_user)):
@@ -517,18 +596,31 @@ async def update_customer(customer_id: str, update_data: CustomerUpdate, user: d
     
     update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
     
+    unset_dict = {}
     if "phone" in update_dict and update_dict["phone"] != customer.get("phone"):
+        country_code = update_dict.get("country_code") or customer.get("country_code", "+91")
         existing = await db.customers.find_one({
-            "user_id": user["id"], 
-            "phone": update_dict["phone"],
+            **phone_query(user["id"], update_dict["phone"], country_code),
             "id": {"$ne": customer_id}
         })
         if existing:
             raise HTTPException(status_code=400, detail="Another customer with this phone already exists")
+        phone_key = normalize_phone(update_dict["phone"], country_code)
+        if phone_key:
+            update_dict["phone_e164"] = phone_key
+        else:
+            unset_dict["phone_e164"] = ""
     
     if update_dict:
         update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
-        await db.customers.update_one({"id": customer_id}, {"$set": update_dict})
+        update_ops = {"$set": update_dict}
+        if unset_dict:
+            update_ops["$unset"] = unset_dict
+        try:
+            await db.customers.update_one({"id": customer_id}, update_ops)
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Another customer with this phone already exists")
+        await record_change(user["id"], CUSTOMER, customer_id, "update", changed_fields(update_ops))
     
     # Sync to MyGenie if user has token
     user_record = await db.users.find_one({"id": user["id"]})
@@ -579,6 +671,8 @@ async def update_customer(customer_id: str, update_data: CustomerUpdate, user: d
                             {"id": customer_id},
                             {"$set": {"mygenie_customer_id": mygenie_customer_id, "mygenie_synced": True}}
                         )
+                        await record_change(user["id"], CUSTOMER, customer_id, "update",
+                                            ["mygenie_customer_id", "mygenie_synced"])
                     print(f"✅ Customer updated in MyGenie: {mygenie_customer_id}")
                 else:
                     print(f"⚠️ MyGenie update failed: {resp.status_code} - {resp.text}")
@@ -586,15 +680,22 @@ async def update_customer(customer_id: str, update_data: CustomerUpdate, user: d
             print(f"⚠️ MyGenie update error (non-critical): {str(e)}")
     
     updated = await db.customers.find_one({"id": customer_id}, {"_id": 0})
-    return Customer(**updated)
+    return trusted(Customer, updated)
 
 @router.delete("/{customer_id}")
 async def delete_customer(customer_id: str, user: dict = Depends(get_current_user)):
-    result = await db.customers.delete_one({"id": customer_id, "user_id": user["id"]})
-    if result.deleted_count == 0:
+    customer = await db.customers.find_one_and_delete(
+        {"id": customer_id, "user_id": user["id"]}, {"_id": 0, "id": 1, "created_at": 1}
+    )
+    if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
+    await retract_customer(user["id"], customer)
     await db.points_transactions.delete_many({"customer_id": customer_id})
+    await record_changes(user["id"], [
+        change(CUSTOMER, customer_id, "delete"),
+        change(POINTS_TRANSACTION, None, "delete", customer_id=customer_id)
+    ])
     return {"message": "Customer deleted"}
 
 
@@ -622,7 +723,9 @@ async def register_via_qr(restaurant_id: str, customer_data: CustomerCreate):
     if not user:
         raise HTTPException(status_code=404, detail="Restaurant not found")
     
-    existing = await db.customers.find_one({"user_id": restaurant_id, "phone": customer_data.phone})
+    existing = await db.customers.find_one(
+        phone_query(restaurant_id, customer_data.phone, customer_data.country_code)
+    )
     if existing:
         raise HTTPException(status_code=400, detail="Customer already registered")
     
@@ -635,7 +738,7 @@ async def register_via_qr(restaurant_id: str, customer_data: CustomerCreate):
     if settings and settings.get("first_visit_bonus_enabled", False):
         first_visit_bonus = settings.get("first_visit_bonus_points", 50)
     
-    customer_doc = {
+    customer_doc = compact_customer_doc({
         "id": customer_id,
         "user_id": restaurant_id,
         "created_at": now,
@@ -644,6 +747,7 @@ async def register_via_qr(restaurant_id: str, customer_data: CustomerCreate):
         # Basic Information
         "name": customer_data.name,
         "phone": customer_data.phone,
+        "phone_e164": normalize_phone(customer_data.phone, customer_data.country_code),
         "country_code": customer_data.country_code,
         "email": customer_data.email,
         "gender": customer_data.gender,
@@ -752,9 +856,13 @@ async def register_via_qr(restaurant_id: str, customer_data: CustomerCreate):
         
         # Bonus
         "first_visit_bonus_awarded": first_visit_bonus > 0
-    }
+    })
     
-    await db.customers.insert_one(customer_doc)
+    try:
+        await db.customers.insert_one(customer_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Customer already registered")
+    changes = [change(CUSTOMER, customer_id, "insert")]
     
     # Record first visit bonus transaction if awarded
     if first_visit_bonus > 0:
@@ -770,7 +878,10 @@ async def register_via_qr(restaurant_id: str, customer_data: CustomerCreate):
             "created_at": now
         }
         await db.points_transactions.insert_one(tx_doc)
+        changes.append(change(POINTS_TRANSACTION, tx_doc["id"], "insert", customer_id=customer_id))
     
+    await record_changes(restaurant_id, changes)
+    await bump_daily(restaurant_id, new_customers=1, points_issued=first_visit_bonus)
     return {
         "message": "Registration successful",
         "customer_id": customer_id,
@@ -781,16 +892,72 @@ async def register_via_qr(restaurant_id: str, customer_data: CustomerCreate):
 # Segments router
 segments_router = APIRouter(prefix="/segments", tags=["Segments"])
 
-async def count_customers_by_filters(user_id: str, filters: dict) -> int:
-    query = build_customer_query(user_id, filters)
-    return await db.customers.count_documents(query)
+# Saved segment counts are exact; list/get reuse them until they are this old
+SEGMENT_COUNT_TTL = timedelta(minutes=15)
+
+async def count_customers_by_filters(user_id: str, filters: dict, segment_id: Optional[str] = None) -> int:
+    """Exact match count; raises SegmentFilterError for an invalid rule tree"""
+    query = get_segment_plan(filters, segment_id).query(user_id)
+    return await analytics_db.customers.count_documents(query)
+
+async def compile_segment_filters(user_id: str, filters: dict, segment_id: Optional[str] = None) -> List[str]:
+    """Compile and explain a segment's filters; returns plan warnings or raises 400"""
+    try:
+        plan = get_segment_plan(filters, segment_id)
+        return await verify_segment_plan(plan, user_id)
+    except (SegmentFilterError, SegmentPlanError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@segments_router.post("/compile")
+async def compile_segment_preview(filters: dict, user: dict = Depends(get_current_user)):
+    """Compile a rule tree without saving it: Mongo query, index warnings and match count"""
+    warnings = await compile_segment_filters(user["id"], filters)
+    plan = get_segment_plan(filters)
+    query = plan.query(user["id"])
+    return {
+        "query": query,
+        "index_bounded": plan.index_bounded,
+        "plan_warnings": warnings,
+        "customer_count": await analytics_db.customers.count_documents(query)
+    }
+
+async def refresh_segment_count(segment: dict, user_id: str) -> dict:
+    """Recount a saved segment if its stored count is older than SEGMENT_COUNT_TTL.
+
+    A segment whose stored filters no longer compile keeps its last count and
+    reports the problem in `filter_error`; the count is not overwritten.
+    """
+    counted_at = segment.get("counted_at") or segment.get("updated_at")
+    now = datetime.now(timezone.utc)
+    if counted_at and now - datetime.fromisoformat(counted_at) < SEGMENT_COUNT_TTL:
+        return segment
+    try:
+        segment["customer_count"] = await count_customers_by_filters(user_id, segment["filters"], segment["id"])
+    except SegmentFilterError as e:
+        segment["filter_error"] = str(e)
+        return segment
+    segment["counted_at"] = now.isoformat()
+    await db.segments.update_one(
+        {"id": segment["id"]},
+        {"$set": {"customer_count": segment["customer_count"], "counted_at": segment["counted_at"]}}
+    )
+    return segment
+
+@segments_router.post("/estimate")
+async def estimate_segment(filters: dict, user: dict = Depends(get_current_user)):
+    """Fast approximate size of a segment for the builder preview (sample-based, 95% bounds)"""
+    try:
+        return await estimate_segment_size(user["id"], filters)
+    except SegmentFilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @segments_router.post("", response_model=Segment)
 async def create_segment(segment_data: SegmentCreate, user: dict = Depends(get_current_user)):
     segment_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
     
-    customer_count = await count_customers_by_filters(user["id"], segment_data.filters)
+    plan_warnings = await compile_segment_filters(user["id"], segment_data.filters, segment_id)
+    customer_count = await count_customers_by_filters(user["id"], segment_data.filters, segment_id)
     
     segment_doc = {
         "id": segment_id,
@@ -798,6 +965,8 @@ async def create_segment(segment_data: SegmentCreate, user: dict = Depends(get_c
         "name": segment_data.name,
         "filters": segment_data.filters,
         "customer_count": customer_count,
+        "plan_warnings": plan_warnings,
+        "counted_at": now,
         "created_at": now,
         "updated_at": now
     }
@@ -808,14 +977,7 @@ async def create_segment(segment_data: SegmentCreate, user: dict = Depends(get_c
 @segments_router.get("", response_model=List[Segment])
 async def list_segments(user: dict = Depends(get_current_user)):
     segments = await db.segments.find({"user_id": user["id"]}, {"_id": 0}).to_list(100)
-    
-    for segment in segments:
-        count = await count_customers_by_filters(user["id"], segment["filters"])
-        segment["customer_count"] = count
-        await db.segments.update_one(
-            {"id": segment["id"]},
-            {"$set": {"customer_count": count}}
-        )
+    segments = await asyncio.gather(*(refresh_segment_count(s, user["id"]) for s in segments))
     
     return [Segment(**s) for s in segments]
 
@@ -825,8 +987,7 @@ async def get_segment(segment_id: str, user: dict = Depends(get_current_user)):
     if not segment:
         raise HTTPException(status_code=404, detail="Segment not found")
     
-    count = await count_customers_by_filters(user["id"], segment["filters"])
-    segment["customer_count"] = count
+    segment = await refresh_segment_count(segment, user["id"])
     
     return Segment(**segment)
 
@@ -836,10 +997,13 @@ async def get_segment_customers(segment_id: str, user: dict = Depends(get_curren
     if not segment:
         raise HTTPException(status_code=404, detail="Segment not found")
     
-    query = build_customer_query(user["id"], segment["filters"])
-    customers = await db.customers.find(query, {"_id": 0}).to_list(1000)
+    try:
+        query = get_segment_plan(segment["filters"], segment_id).query(user["id"])
+    except SegmentFilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    customers = await analytics_db.customers.find(query, {"_id": 0}).to_list(1000)
     
-    return [Customer(**c) for c in customers]
+    return model_list_response(Customer, customers)
 
 @segments_router.put("/{segment_id}", response_model=Segment)
 async def update_segment(segment_id: str, update_data: SegmentUpdate, user: dict = Depends(get_current_user)):
@@ -852,8 +1016,10 @@ async def update_segment(segment_id: str, update_data: SegmentUpdate, user: dict
         update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
         
         if "filters" in update_dict:
-            count = await count_customers_by_filters(user["id"], update_dict["filters"])
+            update_dict["plan_warnings"] = await compile_segment_filters(user["id"], update_dict["filters"], segment_id)
+            count = await count_customers_by_filters(user["id"], update_dict["filters"], segment_id)
             update_dict["customer_count"] = count
+            update_dict["counted_at"] = update_dict["updated_at"]
         
         await db.segments.update_one({"id": segment_id}, {"$set": update_dict})
     
@@ -865,6 +1031,7 @@ async def delete_segment(segment_id: str, user: dict = Depends(get_current_user)
     result = await db.segments.delete_one({"id": segment_id, "user_id": user["id"]})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Segment not found")
+    evict_segment_plan(segment_id)
     # Also delete any WhatsApp config for this segment
     await db.segment_whatsapp_config.delete_one({"segment_id": segment_id, "user_id": user["id"]})
     return {"message": "Segment deleted"}
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
-from datetime import datetime, timezone, timedelta
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from typing import List, Optional
+from datetime import date, datetime, timezone, timedelta
+from pymongo import ReturnDocument
 import uuid
 
-from core.database import db
+from core.database import db, analytics_db
+from core.changes import CUSTOMER, POINTS_TRANSACTION, change, record_changes
+from core.rollups import BUCKETS, SERIES_METRICS, bump_daily, day_of, get_rollup_series, get_rollup_totals
+from core.result_cache import TenantCache, wants_refresh
+from core.cohorts import format_cohorts, refresh_cohorts
 from core.auth import get_current_user
+from core.responses import model_list_response, trusted
 from models.schemas import Feedback, FeedbackCreate, DashboardStats
 
 router = APIRouter(prefix="/feedback", tags=["Feedback"])
@@ -27,19 +33,21 @@ async def create_feedback(feedback_data: FeedbackCreate, user: dict = Depends(ge
     }
     
     await db.feedback.insert_one(feedback_doc)
+    bonus_awarded = 0
     
     # Award feedback bonus points if enabled
     if feedback_data.customer_id:
         settings = await db.loyalty_settings.find_one({"user_id": user["id"]}, {"_id": 0})
         if settings and settings.get("feedback_bonus_enabled", False):
             bonus_points = settings.get("feedback_bonus_points", 25)
-            customer = await db.customers.find_one({"id": feedback_data.customer_id})
+            customer = await db.customers.find_one_and_update(
+                {"id": feedback_data.customer_id, "user_id": user["id"]},
+                {"$inc": {"total_points": bonus_points}},
+                projection={"_id": 0, "total_points": 1},
+                return_document=ReturnDocument.AFTER
+            )
             if customer:
-                new_balance = customer.get("total_points", 0) + bonus_points
-                await db.customers.update_one(
-                    {"id": feedback_data.customer_id},
-                    {"$set": {"total_points": new_balance}}
-                )
+                new_balance = customer["total_points"]
                 
                 tx_doc = {
                     "id": str(uuid.uuid4()),
@@ -53,8 +61,15 @@ async def create_feedback(feedback_data: FeedbackCreate, user: dict = Depends(ge
                     "created_at": datetime.now(timezone.utc).isoformat()
                 }
                 await db.points_transactions.insert_one(tx_doc)
+                await record_changes(user["id"], [
+                    change(CUSTOMER, feedback_data.customer_id, "update", ["total_points"]),
+                    change(POINTS_TRANSACTION, tx_doc["id"], "insert", customer_id=feedback_data.customer_id)
+                ])
+                bonus_awarded = bonus_points
     
-    return Feedback(**feedback_doc)
+    await bump_daily(user["id"], feedback_count=1, rating_sum=feedback_data.rating,
+                     points_issued=bonus_awarded)
+    return trusted(Feedback, feedback_doc)
 
 @router.get("", response_model=List[Feedback])
 async def list_feedback(
@@ -70,7 +85,7 @@ async def list_feedback(
         query["rating"] = rating
     
     feedbacks = await db.feedback.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
-    return [Feedback(**f) for f in feedbacks]
+    return model_list_response(Feedback, feedbacks)
 
 @router.put("/{feedback_id}/resolve")
 async def resolve_feedback(feedback_id: str, user: dict = Depends(get_current_user)):
@@ -84,63 +99,94 @@ async def resolve_feedback(feedback_id: str, user: dict = Depends(get_current_us
 
 
 # Analytics endpoints
+dashboard_cache = TenantCache("dashboard")
+
 @analytics_router.get("/dashboard", response_model=DashboardStats)
-async def get_dashboard_stats(user: dict = Depends(get_current_user)):
-    user_id = user["id"]
-    
-    total_customers = await db.customers.count_documents({"user_id": user_id})
-    
-    points_pipeline = [
-        {"$match": {"user_id": user_id}},
-        {"$group": {
-            "_id": "$transaction_type",
-            "total": {"$sum": "$points"}
-        }}
-    ]
-    points_stats = await db.points_transactions.aggregate(points_pipeline).to_list(10)
+async def get_dashboard_stats(request: Request, user: dict = Depends(get_current_user)):
+    return await dashboard_cache.get(
+        user["id"], lambda: _compute_dashboard_stats(user["id"]), refresh=wants_refresh(request)
+    )
+
+async def _compute_dashboard_stats(user_id: str) -> DashboardStats:
+    total_customers = await analytics_db.customers.count_documents({"user_id": user_id})
     
-    points_issued = 0
-    points_redeemed = 0
-    for stat in points_stats:
-        if stat["_id"] in ["earn", "bonus"]:
-            points_issued += stat["total"]
-        elif stat["_id"] == "redeem":
-            points_redeemed += stat["total"]
+    # Ledger and feedback totals come from the daily rollups, not the raw collections
+    totals = await get_rollup_totals(user_id)
     
     thirty_days_ago = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
-    active_30d = await db.customers.count_documents({
+    active_30d = await analytics_db.customers.count_documents({
         "user_id": user_id,
         "last_visit": {"$gte": thirty_days_ago}
     })
     
-    seven_days_ago = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
-    new_7d = await db.customers.count_documents({
-        "user_id": user_id,
-        "created_at": {"$gte": seven_days_ago}
-    })
-    
-    rating_pipeline = [
-        {"$match": {"user_id": user_id}},
-        {"$group": {
-            "_id": None,
-            "avg_rating": {"$avg": "$rating"},
-            "count": {"$sum": 1}
-        }}
-    ]
-    rating_result = await db.feedback.aggregate(rating_pipeline).to_list(1)
+    # Last 7 calendar days including today
+    week_start = day_of((datetime.now(timezone.utc) - timedelta(days=6)).isoformat())
+    new_7d = (await get_rollup_totals(user_id, start=week_start))["new_customers"]
     
-    avg_rating = 0.0
-    total_feedback = 0
-    if rating_result:
-        avg_rating = round(rating_result[0].get("avg_rating", 0) or 0, 1)
-        total_feedback = rating_result[0].get("count", 0)
+    total_feedback = totals["feedback_count"]
+    avg_rating = round(totals["rating_sum"] / total_feedback, 1) if total_feedback else 0.0
     
     return DashboardStats(
         total_customers=total_customers,
-        total_points_issued=points_issued,
-        total_points_redeemed=points_redeemed,
+        total_points_issued=totals["points_issued"],
+        total_points_redeemed=totals["points_redeemed"],
         active_customers_30d=active_30d,
         new_customers_7d=new_7d,
         avg_rating=avg_rating,
         total_feedback=total_feedback
     )
+
+# Default window per bucket size when no start date is given
+DEFAULT_SERIES_SPAN = {"day": timedelta(days=29), "week": timedelta(weeks=11), "month": timedelta(days=365)}
+MAX_SERIES_DAYS = 3 * 366
+
+@analytics_router.get("/timeseries")
+async def get_timeseries(
+    bucket: str = Query("day"),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    metrics: str = Query("revenue,orders"),
+    user: dict = Depends(get_current_user)
+):
+    """Revenue, order, points, customer and rating trends per day, week or month,
+    read from the daily rollups."""
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(BUCKETS)}")
+    selected = [m.strip() for m in metrics.split(",") if m.strip()]
+    unknown = [m for m in selected if m not in SERIES_METRICS]
+    if unknown or not selected:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown metrics: {', '.join(unknown) or '(none)'}. Available: {', '.join(SERIES_METRICS)}"
+        )
+
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - DEFAULT_SERIES_SPAN[bucket]
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days > MAX_SERIES_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range is limited to {MAX_SERIES_DAYS} days")
+
+    series = await get_rollup_series(user["id"], start, end, bucket, selected)
+    return {
+        "bucket": bucket,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "metrics": selected,
+        "series": series
+    }
+
+
+cohort_cache = TenantCache("cohorts", ttl=300, stale_ttl=3600)
+
+@analytics_router.get("/cohorts")
+async def get_cohorts(
+    request: Request,
+    months: int = Query(12, ge=1, le=36),
+    user: dict = Depends(get_current_user)
+):
+    """Monthly acquisition cohorts and the share of each that billed again in later months."""
+    meta = await cohort_cache.get(
+        user["id"], lambda: refresh_cohorts(user["id"]), refresh=wants_refresh(request)
+    )
+    return format_cohorts(meta, months)
@@ -1,11 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends
 from typing import List
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
 import uuid
 
 from core.database import db
+from core.changes import CUSTOMER, POINTS_TRANSACTION, change, record_changes
+from core.rollups import POINTS_FIELD, bump_daily, day_of, is_first_visit_of_day
 from core.auth import get_current_user
-from core.helpers import calculate_tier, get_earn_percent_for_tier
+from core.responses import model_list_response, trusted
+from core.result_cache import invalidate_tenant
+from core.helpers import get_earn_percent_for_tier, summarize_expiring_points, tier_expression
 from models.schemas import (
     PointsTransaction, PointsTransactionCreate,
     LoyaltySettings, LoyaltySettingsUpdate
@@ -24,28 +29,30 @@ async def create_points_transaction(tx_data: PointsTransactionCreate, user: dict
     if not settings:
         settings = {"tier_bronze_min": 0, "tier_silver_min": 500, "tier_gold_min": 1500, "tier_platinum_min": 5000}
     
-    current_points = customer.get("total_points", 0)
-    
-    if tx_data.transaction_type == "redeem":
-        if current_points < tx_data.points:
-            raise HTTPException(status_code=400, detail="Insufficient points")
-        new_balance = current_points - tx_data.points
-    else:
-        new_balance = current_points + tx_data.points
-    
-    new_tier = calculate_tier(new_balance, settings)
-    
+    # Relative update: points moved into a hold since the read stay held, and a
+    # redemption only goes through while the balance still covers it
+    delta = -tx_data.points if tx_data.transaction_type == "redeem" else tx_data.points
     update_data = {
-        "total_points": new_balance,
-        "tier": new_tier,
-        "last_visit": datetime.now(timezone.utc).isoformat()
+        "total_points": {"$add": [{"$ifNull": ["$total_points", 0]}, delta]},
+        "last_visit": {"$literal": datetime.now(timezone.utc).isoformat()}
     }
     
     if tx_data.transaction_type == "earn" and tx_data.bill_amount:
-        update_data["total_spent"] = customer.get("total_spent", 0) + tx_data.bill_amount
-        update_data["total_visits"] = customer.get("total_visits", 0) + 1
+        update_data["total_spent"] = {"$add": [{"$ifNull": ["$total_spent", 0]}, tx_data.bill_amount]}
+        update_data["total_visits"] = {"$add": [{"$ifNull": ["$total_visits", 0]}, 1]}
     
-    await db.customers.update_one({"id": tx_data.customer_id}, {"$set": update_data})
+    query = {"id": tx_data.customer_id}
+    if tx_data.transaction_type == "redeem":
+        query["total_points"] = {"$gte": tx_data.points}
+    updated = await db.customers.find_one_and_update(
+        query,
+        [{"$set": update_data}, {"$set": {"tier": tier_expression("$total_points", settings)}}],
+        projection={"_id": 0, "total_points": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(status_code=400, detail="Insufficient points")
+    new_balance = updated["total_points"]
     
     tx_id = str(uuid.uuid4())
     tx_doc = {
@@ -61,7 +68,19 @@ async def create_points_transaction(tx_data: PointsTransactionCreate, user: dict
     }
     
     await db.points_transactions.insert_one(tx_doc)
-    return PointsTransaction(**tx_doc)
+    await record_changes(user["id"], [
+        change(CUSTOMER, tx_data.customer_id, "update", [*update_data, "tier"]),
+        change(POINTS_TRANSACTION, tx_id, "insert", customer_id=tx_data.customer_id)
+    ])
+    rollup = {}
+    if tx_data.transaction_type in POINTS_FIELD:
+        rollup[POINTS_FIELD[tx_data.transaction_type]] = tx_data.points
+    if "total_visits" in update_data:
+        day = day_of()
+        rollup.update(orders=1, revenue=tx_data.bill_amount,
+                      active_customers=int(is_first_visit_of_day(customer, day)))
+    await bump_daily(user["id"], **rollup)
+    return trusted(PointsTransaction, tx_doc)
 
 @router.get("/transactions/{customer_id}", response_model=List[PointsTransaction])
 async def get_customer_transactions(customer_id: str, limit: int = 50, user: dict = Depends(get_current_user)):
@@ -69,7 +88,7 @@ async def get_customer_transactions(customer_id: str, limit: int = 50, user: dic
         {"customer_id": customer_id, "user_id": user["id"]},
         {"_id": 0}
     ).sort("created_at", -1).limit(limit).to_list(limit)
-    return [PointsTransaction(**t) for t in transactions]
+    return model_list_response(PointsTransaction, transactions)
 
 @router.post("/earn")
 async def earn_points(customer_id: str, bill_amount: float, user: dict = Depends(get_current_user)):
@@ -118,40 +137,13 @@ async def get_expiring_points(customer_id: str, user: dict = Depends(get_current
     expiry_months = settings.get("points_expiry_months", 6) if settings else 6
     reminder_days = settings.get("expiry_reminder_days", 30) if settings else 30
     
-    if expiry_months == 0:
-        return {"expiring_soon": 0, "expiring_date": None, "already_expired": 0}
-    
-    now = datetime.now(timezone.utc)
-    expiry_cutoff = now - timedelta(days=expiry_months * 30)
-    reminder_cutoff = now - timedelta(days=(expiry_months * 30) - reminder_days)
-    
     transactions = await db.points_transactions.find({
         "customer_id": customer_id,
         "user_id": user["id"],
         "transaction_type": {"$in": ["earn", "bonus"]}
-    }, {"_id": 0}).to_list(1000)
-    
-    expiring_soon = 0
-    already_expired = 0
-    earliest_expiry = None
+    }, {"_id": 0, "points": 1, "created_at": 1}).to_list(1000)
     
-    for tx in transactions:
-        tx_date = datetime.fromisoformat(tx["created_at"].replace("Z", "+00:00")) if isinstance(tx["created_at"], str) else tx["created_at"]
-        
-        if tx_date < expiry_cutoff:
-            already_expired += tx["points"]
-        elif tx_date < reminder_cutoff:
-            expiring_soon += tx["points"]
-            expiry_date = tx_date + timedelta(days=expiry_months * 30)
-            if earliest_expiry is None or expiry_date < earliest_expiry:
-                earliest_expiry = expiry_date
-    
-    return {
-        "expiring_soon": max(0, expiring_soon),
-        "expiring_date": earliest_expiry.isoformat() if earliest_expiry else None,
-        "already_expired": max(0, already_expired),
-        "expiry_months": expiry_months
-    }
+    return summarize_expiring_points(transactions, expiry_months, reminder_days)
 
 
 @router.post("/process-expiry-reminders")
@@ -226,6 +218,7 @@ async def update_loyalty_settings(update_data: LoyaltySettingsUpdate, user: dict
     
     if update_dict:
         await db.loyalty_settings.update_one({"user_id": user["id"]}, {"$set": update_dict})
+        invalidate_tenant(user["id"])
     
     settings = await db.loyalty_settings.find_one({"user_id": user["id"]}, {"_id": 0})
     return LoyaltySettings(**settings)
@@ -1,12 +1,33 @@
-from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import asyncio
 import uuid
 
 from core.database import db
+from core.cohorts import reset_cohorts
+from core.rollups import bump_daily, day_of, is_first_visit_of_day
+from core.changes import (
+    CUSTOMER, POINTS_TRANSACTION, WALLET_TRANSACTION, ORDER,
+    change, changed_fields, record_change, record_changes
+)
 from core.auth import get_current_user, generate_api_key
-from core.helpers import calculate_tier, get_earn_percent_for_tier, check_off_peak_bonus
+from core.coupon_redemption import CouponRejected, redeem_coupon, rollback_redemption
+from core.customer_cards import get_card
+from core.order_queue import enqueue_order, get_job, pending_dedupe_keys
+from core.pos_api_keys import KEY_TTL_SECONDS, forget_api_keys, lookup_api_key
+from core.points_holds import (
+    confirm_hold, create_hold, find_hold, get_hold, open_hold_filter, release_hold
+)
+from core.reconcile import day_range, find_outside_day, load_day_orders, merge_diff, parse_day_file
+from core.result_cache import TenantCache
+from core.helpers import (
+    calculate_tier, get_earn_percent_for_tier, check_off_peak_bonus, compact_customer_doc,
+    normalize_phone, phone_query, tier_expression, coupon_discount, coupon_rejection
+)
 from models.schemas import (
     POSPaymentWebhook, POSCustomerLookup, POSResponse,
     MessageRequest
@@ -15,13 +36,37 @@ from models.schemas import (
 router = APIRouter(prefix="/pos", tags=["POS Gateway"])
 messaging_router = APIRouter(prefix="/messaging", tags=["Messaging"])
 
+# Terminals call several POS endpoints per checkout; loyalty settings are served
+# from a short-lived per-process cache (API keys: core.pos_api_keys)
+loyalty_settings_cache = TenantCache("loyalty_settings", ttl=60, stale_ttl=0)
+
+DEFAULT_POS_SETTINGS = {
+    "min_order_value": 100.0,
+    "bronze_earn_percent": 5.0, "silver_earn_percent": 7.0,
+    "gold_earn_percent": 10.0, "platinum_earn_percent": 15.0,
+    "redemption_value": 0.25,
+    "min_redemption_points": 100,
+    "max_redemption_percent": 50.0,
+    "max_redemption_amount": 500.0,
+    "tier_silver_min": 500, "tier_gold_min": 1500, "tier_platinum_min": 5000,
+}
+
+
+async def get_pos_settings(user_id: str) -> dict:
+    """Restaurant loyalty settings (defaults if none saved), cached per process"""
+    settings = await loyalty_settings_cache.get(
+        user_id, lambda: db.loyalty_settings.find_one({"user_id": user_id}, {"_id": 0})
+    )
+    return settings or DEFAULT_POS_SETTINGS
+
+
 # API Key Authentication Dependency
 async def verify_pos_api_key(x_api_key: str = Header(None, alias="X-API-Key")):
     print(f"DEBUG: Received API key: {x_api_key}")
     if not x_api_key:
         raise HTTPException(status_code=401, detail="API key required in X-API-Key header")
     
-    user = await db.users.find_one({"api_key": x_api_key}, {"_id": 0})
+    user = await lookup_api_key(x_api_key)
     print(f"DEBUG: User found: {user is not None}")
     if not user:
         raise HTTPException(status_code=401, detail="Invalid API key")
@@ -199,7 +244,9 @@ async def pos_create_customer(
     Requires X-API-Key header for authentication.
     """
     # Check if phone exists for this user
-    existing = await db.customers.find_one({"user_id": user["id"], "phone": customer_data.phone})
+    existing = await db.customers.find_one(
+        phone_query(user["id"], customer_data.phone, customer_data.country_code)
+    )
     if existing:
         return POSResponse(
             success=False,
@@ -210,7 +257,7 @@ async def pos_create_customer(
     customer_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
     
-    customer_doc = {
+    customer_doc = compact_customer_doc({
         "id": customer_id,
         "user_id": user["id"],
         "created_at": now,
@@ -223,6 +270,7 @@ async def pos_create_customer(
         # Basic Info
         "name": customer_data.name,
         "phone": customer_data.phone,
+        "phone_e164": normalize_phone(customer_data.phone, customer_data.country_code),
         "country_code": customer_data.country_code,
         "email": customer_data.email,
         "gender": customer_data.gender,
@@ -307,9 +355,21 @@ async def pos_create_customer(
         # Sync Status
         "pos_synced": True,
         "pos_synced_at": now
-    }
+    })
     
-    await db.customers.insert_one(customer_doc)
+    try:
+        await db.customers.insert_one(customer_doc)
+    except DuplicateKeyError:
+        existing = await db.customers.find_one(
+            phone_query(user["id"], customer_data.phone, customer_data.country_code)
+        )
+        return POSResponse(
+            success=False,
+            message="Customer with this phone already exists",
+            data={"customer_id": existing["id"] if existing else None, "existing": True}
+        )
+    await record_change(user["id"], CUSTOMER, customer_id, "insert")
+    await bump_daily(user["id"], new_customers=1)
     
     return POSResponse(
         success=True,
@@ -348,10 +408,11 @@ async def pos_update_customer(
         update_dict["pos_restaurant_id"] = update_dict.pop("restaurant_id")
     
     # Check phone uniqueness if phone is being updated
+    unset_dict = {}
     if "phone" in update_dict and update_dict["phone"] != customer.get("phone"):
+        country_code = update_dict.get("country_code") or customer.get("country_code", "+91")
         existing = await db.customers.find_one({
-            "user_id": user["id"],
-            "phone": update_dict["phone"],
+            **phone_query(user["id"], update_dict["phone"], country_code),
             "id": {"$ne": customer_id}
         })
         if existing:
@@ -360,11 +421,27 @@ async def pos_update_customer(
                 message="Another customer with this phone already exists",
                 data=None
             )
+        phone_key = normalize_phone(update_dict["phone"], country_code)
+        if phone_key:
+            update_dict["phone_e164"] = phone_key
+        else:
+            unset_dict["phone_e164"] = ""
     
     if update_dict:
         update_dict["pos_synced"] = True
         update_dict["pos_synced_at"] = datetime.now(timezone.utc).isoformat()
-        await db.customers.update_one({"id": customer_id}, {"$set": update_dict})
+        update_ops = {"$set": update_dict}
+        if unset_dict:
+            update_ops["$unset"] = unset_dict
+        try:
+            await db.customers.update_one({"id": customer_id}, update_ops)
+        except DuplicateKeyError:
+            return POSResponse(
+                success=False,
+                message="Another customer with this phone already exists",
+                data=None
+            )
+        await record_change(user["id"], CUSTOMER, customer_id, "update", changed_fields(update_ops))
     
     updated = await db.customers.find_one({"id": customer_id}, {"_id": 0})
     
@@ -401,10 +478,7 @@ async def pos_max_redeemable(
     Returns max points and their monetary value.
     """
     # Find customer by phone
-    customer = await db.customers.find_one({
-        "user_id": user["id"],
-        "phone": request.cust_mobile
-    })
+    customer = await get_card(user["id"], request.cust_mobile)
     
     if not customer:
         return POSResponse(
@@ -413,21 +487,10 @@ async def pos_max_redeemable(
             data={"registered": False}
         )
     
-    # Get loyalty settings
-    settings = await db.loyalty_settings.find_one({"user_id": user["id"]}, {"_id": 0})
-    if not settings:
-        settings = {
-            "redemption_value": 0.25,
-            "min_redemption_points": 100,
-            "max_redemption_percent": 50.0,
-            "max_redemption_amount": 500.0
-        }
+    settings = await get_pos_settings(user["id"])
     
     available_points = customer.get("total_points", 0)
-    redemption_value = settings.get("redemption_value", 0.25)
     min_redemption = settings.get("min_redemption_points", 100)
-    max_percent = settings.get("max_redemption_percent", 50.0)
-    max_amount = settings.get("max_redemption_amount", 500.0)
     
     # Check if customer has minimum points
     if available_points < min_redemption:
@@ -442,34 +505,140 @@ async def pos_max_redeemable(
             }
         )
     
-    # Calculate max discount by bill percentage
-    max_by_percent = (request.bill_amount * max_percent) / 100
+    max_points, max_discount_value = max_redeemable(available_points, request.bill_amount, settings)
+    
+    return POSResponse(
+        success=True,
+        message="Max redeemable calculated",
+        data={
+            "max_points_redeemable": max_points,
+            "max_discount_value": max_discount_value
+        }
+    )
+
+
+def max_redeemable(available_points: int, bill_amount: float, settings: dict) -> tuple:
+    """Most points redeemable on a bill and their value, limited by the bill
+    percentage, the absolute cap and the balance. Returns (points, value)."""
+    if available_points < settings.get("min_redemption_points", 100):
+        return 0, 0.0
+    redemption_value = settings.get("redemption_value", 0.25)
     
-    # Calculate max discount by absolute cap
-    max_by_cap = max_amount
+    # Take the minimum of the bill percentage, absolute cap and balance limits
+    max_discount = min(
+        (bill_amount * settings.get("max_redemption_percent", 50.0)) / 100,
+        settings.get("max_redemption_amount", 500.0),
+        available_points * redemption_value
+    )
     
-    # Calculate max discount by available points
-    max_by_points = available_points * redemption_value
+    # Convert back to points without exceeding the balance
+    max_points = min(int(max_discount / redemption_value), available_points)
+    return max_points, round(max_points * redemption_value, 2)
+
+
+def customer_card(customer: dict, settings: dict) -> dict:
+    """What a POS terminal shows for a registered customer"""
+    redemption_value = settings.get("redemption_value", 0.25)
+    return {
+        "registered": True,
+        "customer_id": customer["id"],
+        "name": customer["name"],
+        "phone": customer["phone"],
+        "tier": customer.get("tier", "Bronze"),
+        "total_points": customer.get("total_points", 0),
+        "points_value": round(customer.get("total_points", 0) * redemption_value, 2),
+        "wallet_balance": customer.get("wallet_balance", 0.0),
+        "total_visits": customer.get("total_visits", 0),
+        "total_spent": customer.get("total_spent", 0.0),
+        "allergies": customer.get("allergies", []),
+        "favorites": customer.get("favorites", []),
+        "last_visit": customer.get("last_visit")
+    }
+
+
+class POSQuoteRequest(BaseModel):
+    """Everything a terminal needs at checkout, in one request"""
+    phone: str
+    bill_amount: float
+    coupon_code: Optional[str] = None
+    channel: str = "dine_in"
+
+
+@router.post("/quote", response_model=POSResponse)
+async def pos_quote(
+    request: POSQuoteRequest,
+    user: dict = Depends(verify_pos_api_key)
+):
+    """
+    Checkout quote: customer card, max redeemable points, coupon validity and
+    discount, and the points the bill would earn. Reads the customer and, when a
+    coupon code is given, the coupon with this customer's usage count; the API
+    key, loyalty settings and customer card come from cache when warm.
+    """
+    settings = await get_pos_settings(user["id"])
+    customer = await get_card(user["id"], request.phone)
     
-    # Take the minimum of all limits
-    max_discount = min(max_by_percent, max_by_cap, max_by_points)
+    data = {"bill_amount": request.bill_amount}
+    payable = request.bill_amount
     
-    # Convert back to points
-    max_points = int(max_discount / redemption_value)
+    if request.coupon_code:
+        pipeline = [
+            {"$match": {"user_id": user["id"], "code": request.coupon_code.upper(), "is_active": True}},
+            {"$limit": 1},
+            {"$project": {"_id": 0}}
+        ]
+        if customer:
+            pipeline.append({"$lookup": {
+                "from": "coupon_usage",
+                "localField": "id",
+                "foreignField": "coupon_id",
+                "pipeline": [{"$match": {"customer_id": customer["id"]}}, {"$count": "uses"}],
+                "as": "customer_usage"
+            }})
+        coupons = await db.coupons.aggregate(pipeline).to_list(1)
+        coupon_data = {"code": request.coupon_code.upper(), "valid": False, "discount": 0.0}
+        if not coupons:
+            coupon_data["reason"] = "Invalid coupon code"
+        else:
+            coupon = coupons[0]
+            uses = (coupon.get("customer_usage") or [{}])[0].get("uses", 0)
+            reason = coupon_rejection(
+                coupon, customer["id"] if customer else None, request.bill_amount, request.channel, uses
+            )
+            if reason:
+                coupon_data["reason"] = reason
+            else:
+                discount = round(coupon_discount(coupon, request.bill_amount), 2)
+                coupon_data.update(valid=True, discount=discount, coupon_id=coupon["id"])
+                payable -= discount
+        data["coupon"] = coupon_data
     
-    # Ensure we don't exceed available points
-    max_points = min(max_points, available_points)
+    # Points are earned on the gross bill; redemption is capped on what is left after the coupon
+    pts = _calculate_points(request.bill_amount, customer or {}, settings)
+    data["points_earned"] = {
+        "points": pts["total_points"],
+        "base_points": pts["base_points"],
+        "off_peak_bonus": pts["off_peak_bonus"],
+        "off_peak_message": pts.get("off_peak_message")
+    }
     
-    # Recalculate exact discount value
-    max_discount_value = round(max_points * redemption_value, 2)
+    if customer:
+        data["customer"] = customer_card(customer, settings)
+        max_points, max_value = max_redeemable(customer.get("total_points", 0), payable, settings)
+    else:
+        data["customer"] = {"registered": False}
+        max_points, max_value = 0, 0.0
+    data["redemption"] = {
+        "max_points_redeemable": max_points,
+        "max_discount_value": max_value,
+        "min_points_required": settings.get("min_redemption_points", 100)
+    }
+    data["payable_after_coupon"] = round(payable, 2)
     
     return POSResponse(
         success=True,
-        message="Max redeemable calculated",
-        data={
-            "max_points_redeemable": max_points,
-            "max_discount_value": max_discount_value
-        }
+        message="Quote calculated" if customer else "Customer not found",
+        data=data
     )
 
 
@@ -480,6 +649,35 @@ async def pos_max_redeemable(
 async def _validate_order(order_data: "POSOrderWebhook", user: dict) -> Optional[POSResponse]:
     """Validate pos_id, restaurant_id, payment status, and duplicate order.
     Returns a POSResponse on failure, or None if valid."""
+    error = _check_order_source(order_data, user)
+    if error:
+        return error
+    return await _duplicate_order(order_data, user)
+
+
+def _pos_order_key(order_data: "POSOrderWebhook", user: dict) -> dict:
+    """The unique `orders` key (index user_pos_order) of a POS order."""
+    return {
+        "user_id": user["id"],
+        "pos_id": order_data.pos_id,
+        "pos_restaurant_id": order_data.restaurant_id,
+        "pos_order_id": order_data.order_id,
+    }
+
+
+async def _duplicate_order(order_data: "POSOrderWebhook", user: dict) -> Optional[POSResponse]:
+    existing = await db.orders.find_one(_pos_order_key(order_data, user), {"_id": 0, "id": 1})
+    if existing:
+        return POSResponse(
+            success=False,
+            message="Duplicate order - already processed",
+            data={"order_id": existing["id"], "duplicate": True},
+        )
+    return None
+
+
+def _check_order_source(order_data: "POSOrderWebhook", user: dict) -> Optional[POSResponse]:
+    """The checks that need no database: pos_id, restaurant_id and payment status."""
     if user.get("pos_id") and order_data.pos_id != user["pos_id"]:
         return POSResponse(
             success=False,
@@ -498,17 +696,6 @@ async def _validate_order(order_data: "POSOrderWebhook", user: dict) -> Optional
             message=f"Order not processed - payment status: {order_data.payment_status}",
             data=None,
         )
-    existing = await db.orders.find_one({
-        "pos_id": order_data.pos_id,
-        "pos_restaurant_id": order_data.restaurant_id,
-        "pos_order_id": order_data.order_id,
-    })
-    if existing:
-        return POSResponse(
-            success=False,
-            message="Duplicate order - already processed",
-            data={"order_id": existing["id"], "duplicate": True},
-        )
     return None
 
 
@@ -517,9 +704,7 @@ async def _find_or_create_customer(
 ) -> tuple:
     """Lookup customer by phone; auto-create if missing.
     Returns (customer_doc, is_new, first_visit_bonus_points)."""
-    customer = await db.customers.find_one({
-        "user_id": user["id"], "phone": order_data.cust_mobile
-    })
+    customer = await db.customers.find_one(phone_query(user["id"], order_data.cust_mobile))
 
     if customer:
         return customer, False, 0
@@ -529,6 +714,7 @@ async def _find_or_create_customer(
         first_visit_bonus = settings.get("first_visit_bonus_points", 50)
 
     customer_id = str(uuid.uuid4())
+    # Stored sparsely - unset profile fields fall back to Customer model defaults
     customer = {
         "id": customer_id,
         "user_id": user["id"],
@@ -538,108 +724,22 @@ async def _find_or_create_customer(
         # Basic Info
         "name": order_data.cust_name or f"Customer {order_data.cust_mobile[-4:]}",
         "phone": order_data.cust_mobile,
-        "country_code": "+91",
-        "email": None,
-        "gender": None,
-        "dob": None,
-        "anniversary": None,
-        "preferred_language": None,
+        "phone_e164": normalize_phone(order_data.cust_mobile),
         "customer_type": "normal",
-        "segment_tags": [],
-        
-        # Contact & Marketing Permissions (defaults)
-        "whatsapp_opt_in": False,
-        "whatsapp_opt_in_date": None,
-        "promo_whatsapp_allowed": True,
-        "promo_sms_allowed": True,
-        "email_marketing_allowed": True,
-        "call_allowed": True,
-        "is_blocked": False,
         
         # Loyalty Information
         "total_points": first_visit_bonus,
         "wallet_balance": 0.0,
         "tier": "Bronze",
-        "referral_code": None,
-        "referred_by": None,
-        "membership_id": None,
-        "membership_expiry": None,
         
         # Spending & Visit Behavior
         "total_visits": 0,
         "total_spent": 0.0,
-        "avg_order_value": 0.0,
-        "last_visit": None,
         "first_visit_date": now,
-        "favorite_category": None,
-        "preferred_payment_mode": None,
         
         # Customer Source & Journey
         "lead_source": "POS",
-        "campaign_source": None,
         "last_interaction_date": now,
-        "assigned_salesperson": None,
-        
-        # WhatsApp CRM Tracking
-        "last_whatsapp_sent": None,
-        "last_whatsapp_response": None,
-        "last_campaign_clicked": None,
-        "last_coupon_used": None,
-        "automation_status_tag": None,
-        
-        # Corporate Information
-        "gst_name": None,
-        "gst_number": None,
-        "billing_address": None,
-        "credit_limit": None,
-        "payment_terms": None,
-        
-        # Address
-        "address": None,
-        "address_line_2": None,
-        "city": None,
-        "state": None,
-        "pincode": None,
-        "country": None,
-        "delivery_instructions": None,
-        "map_location": None,
-        
-        # Preferences
-        "allergies": [],
-        "favorites": [],
-        
-        # Dining Preferences
-        "preferred_dining_type": None,
-        "preferred_time_slot": None,
-        "favorite_table": None,
-        "avg_party_size": None,
-        "diet_preference": None,
-        "spice_level": None,
-        "cuisine_preference": None,
-        
-        # Special Occasions
-        "kids_birthday": [],
-        "spouse_name": None,
-        "festival_preference": [],
-        "special_dates": [],
-        
-        # Feedback & Flags
-        "last_rating": None,
-        "nps_score": None,
-        "complaint_flag": False,
-        "vip_flag": False,
-        "blacklist_flag": False,
-        
-        # AI/Advanced
-        "predicted_next_visit": None,
-        "churn_risk_score": None,
-        "recommended_offer_type": None,
-        "price_sensitivity_score": None,
-        
-        # Custom Fields
-        "custom_field_1": None,
-        "custom_field_2": None,
-        "custom_field_3": None,
         
         # Notes
         "notes": "Auto-created via POS order",
@@ -649,11 +749,19 @@ async def _find_or_create_customer(
         "pos_restaurant_id": order_data.restaurant_id,
         "first_visit_bonus_awarded": first_visit_bonus > 0,
     }
-    await db.customers.insert_one(customer)
+    customer = compact_customer_doc(customer)
+    try:
+        await db.customers.insert_one(customer)
+    except DuplicateKeyError:
+        # A concurrent order created the same customer first
+        customer = await db.customers.find_one(phone_query(user["id"], order_data.cust_mobile))
+        return customer, False, 0
 
+    changes = [change(CUSTOMER, customer_id, "insert")]
     if first_visit_bonus > 0:
+        bonus_tx_id = str(uuid.uuid4())
         await db.points_transactions.insert_one({
-            "id": str(uuid.uuid4()),
+            "id": bonus_tx_id,
             "user_id": user["id"],
             "customer_id": customer_id,
             "points": first_visit_bonus,
@@ -663,13 +771,17 @@ async def _find_or_create_customer(
             "balance_after": first_visit_bonus,
             "created_at": now,
         })
+        changes.append(change(POINTS_TRANSACTION, bonus_tx_id, "insert", customer_id=customer_id))
 
+    await record_changes(user["id"], changes)
+    await bump_daily(user["id"], new_customers=1, points_issued=first_visit_bonus)
     return customer, True, first_visit_bonus
 
 
-def _calculate_points(order_amount: float, customer: dict, settings: dict) -> dict:
-    """Calculate points earned including off-peak bonus.
-    Returns dict with base_points, off_peak_bonus, total_points, description."""
+def _calculate_points(order_amount: float, customer: dict, settings: dict, off_peak: bool = True) -> dict:
+    """Calculate points earned including off-peak bonus (skipped with off_peak=False,
+    for orders not placed now). Returns dict with base_points, off_peak_bonus,
+    total_points, description."""
     min_order = settings.get("min_order_value", 100.0)
     if order_amount < min_order:
         return {"base_points": 0, "off_peak_bonus": 0, "total_points": 0, "description": ""}
@@ -682,7 +794,7 @@ def _calculate_points(order_amount: float, customer: dict, settings: dict) -> di
     is_off_peak, bonus_value, bonus_type, off_peak_msg = check_off_peak_bonus(settings)
     off_peak_bonus = 0
 
-    if is_off_peak and base_points > 0:
+    if off_peak and is_off_peak and base_points > 0:
         if bonus_type == "multiplier":
             off_peak_bonus = int(base_points * (bonus_value - 1))
         else:
@@ -702,26 +814,23 @@ def _calculate_points(order_amount: float, customer: dict, settings: dict) -> di
     }
 
 
-async def _save_order_and_transactions(
+async def _claim_order(
     order_data: "POSOrderWebhook",
     user: dict,
     customer: dict,
     points_earned: int,
-    new_points: int,
     wallet_used: float,
-    new_wallet_balance: float,
     off_peak_bonus: int,
     now: str,
-) -> str:
-    """Persist order, points transaction, and wallet transaction. Returns order id."""
+    backfilled: bool = False,
+) -> Optional[str]:
+    """Insert the order. The unique user_pos_order index makes this the claim on
+    the POS order: returns the new order id, or None if it was already processed."""
     order_id = str(uuid.uuid4())
-    await db.orders.insert_one({
+    order = {
         "id": order_id,
-        "user_id": user["id"],
         "customer_id": customer["id"],
-        "pos_id": order_data.pos_id,
-        "pos_restaurant_id": order_data.restaurant_id,
-        "pos_order_id": order_data.order_id,
+        **_pos_order_key(order_data, user),
         "order_amount": order_data.order_amount,
         "wallet_used": wallet_used,
         "coupon_code": order_data.coupon_code,
@@ -732,14 +841,44 @@ async def _save_order_and_transactions(
         "payment_status": order_data.payment_status,
         "order_type": order_data.order_type,
         "created_at": now,
-    })
+    }
+    if backfilled:
+        # Processed by end-of-day reconciliation, dated inside the reconciled day
+        order["backfilled_at"] = datetime.now(timezone.utc).isoformat()
+    try:
+        await db.orders.insert_one(order)
+    except DuplicateKeyError:
+        return None
+    return order_id
+
+
+async def _save_transactions(
+    order_id: str,
+    order_data: "POSOrderWebhook",
+    user: dict,
+    customer: dict,
+    points_earned: int,
+    new_points: int,
+    wallet_used: float,
+    new_wallet_balance: float,
+    off_peak_bonus: int,
+    now: str,
+    customer_fields: Optional[List[str]] = None,
+):
+    """Persist the points and wallet transactions of a claimed order, and record
+    them (plus the order and the customer fields it updated) in the change outbox."""
+    changes = [change(ORDER, order_id, "insert", customer_id=customer["id"])]
+    if customer_fields:
+        changes.append(change(CUSTOMER, customer["id"], "update", customer_fields))
 
     if points_earned > 0:
         desc = f"Earned on order {order_data.order_id} (Rs.{order_data.order_amount})"
         if off_peak_bonus > 0:
             desc += f" [includes {off_peak_bonus} off-peak bonus]"
+        earn_tx_id = str(uuid.uuid4())
+        changes.append(change(POINTS_TRANSACTION, earn_tx_id, "insert", customer_id=customer["id"]))
         await db.points_transactions.insert_one({
-            "id": str(uuid.uuid4()),
+            "id": earn_tx_id,
             "user_id": user["id"],
             "customer_id": customer["id"],
             "points": points_earned,
@@ -751,8 +890,10 @@ async def _save_order_and_transactions(
         })
 
     if wallet_used > 0:
+        wallet_tx_id = str(uuid.uuid4())
+        changes.append(change(WALLET_TRANSACTION, wallet_tx_id, "insert", customer_id=customer["id"]))
         await db.wallet_transactions.insert_one({
-            "id": str(uuid.uuid4()),
+            "id": wallet_tx_id,
             "user_id": user["id"],
             "customer_id": customer["id"],
             "amount": wallet_used,
@@ -763,7 +904,12 @@ async def _save_order_and_transactions(
             "created_at": now,
         })
 
-    return order_id
+    await record_changes(user["id"], changes)
+    await bump_daily(
+        user["id"], day_of(now),
+        orders=1, revenue=order_data.order_amount, points_issued=points_earned, wallet_debited=wallet_used,
+        active_customers=int(is_first_visit_of_day(customer, day_of(now)))
+    )
 
 class POSOrderWebhook(BaseModel):
     """Schema for order data from MyGenie/POS systems"""
@@ -796,104 +942,400 @@ class POSOrderWebhook(BaseModel):
     order_type: Optional[str] = "pos"  # pos, dine_in, takeaway, delivery
 
 
+def _dedupe_key(pos_id: str, restaurant_id: str, order_id: str) -> str:
+    """Order queue dedupe key of a POS order."""
+    return f"{pos_id}:{restaurant_id}:{order_id}"
+
+
 @router.post("/orders", response_model=POSResponse)
 async def pos_order_webhook(
     order_data: POSOrderWebhook,
+    response: Response,
+    async_mode: bool = Query(False, description="Queue the order and return 202 with a tracking id"),
     user: dict = Depends(verify_pos_api_key)
 ):
     """
     Webhook for MyGenie/POS to send order data.
     Validates, finds/creates customer, calculates points (with off-peak bonus),
     records order and transactions.
+    
+    With async_mode=true the order is only validated and queued; poll
+    GET /pos/orders/status/{tracking_id} for the result.
     """
-    try:
-        # 1. Validate
-        error = await _validate_order(order_data, user)
+    if async_mode:
+        error = _check_order_source(order_data, user)
         if error:
             return error
+        job, created = await enqueue_order(
+            user["id"],
+            customer_key=normalize_phone(order_data.cust_mobile) or order_data.cust_mobile,
+            dedupe_key=_dedupe_key(order_data.pos_id, order_data.restaurant_id, order_data.order_id),
+            payload=order_data.model_dump()
+        )
+        response.status_code = 202
+        return POSResponse(
+            success=True,
+            message="Order queued for processing" if created else "Order already queued",
+            data={"tracking_id": job["id"], "status": job["status"], "pos_order_id": order_data.order_id},
+        )
+    
+    try:
+        return await _process_order(order_data, user)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Order processing failed: {str(e)}")
 
-        now = datetime.now(timezone.utc).isoformat()
 
-        # 2. Loyalty settings
-        settings = await db.loyalty_settings.find_one({"user_id": user["id"]}, {"_id": 0})
-        if not settings:
-            settings = {
-                "min_order_value": 100.0,
-                "bronze_earn_percent": 5.0, "silver_earn_percent": 7.0,
-                "gold_earn_percent": 10.0, "platinum_earn_percent": 15.0,
-                "redemption_value": 0.25,
-                "tier_silver_min": 500, "tier_gold_min": 1500, "tier_platinum_min": 5000,
-                "first_visit_bonus_enabled": False, "first_visit_bonus_points": 50,
-            }
+@router.get("/orders/status/{tracking_id}", response_model=POSResponse)
+async def pos_order_status(tracking_id: str, user: dict = Depends(verify_pos_api_key)):
+    """Status and, once processed, the result of an order queued with async_mode"""
+    job = await get_job(user["id"], tracking_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Tracking id not found")
+    return POSResponse(
+        success=job["status"] != "failed",
+        message=f"Order {job['status']}",
+        data={
+            "tracking_id": job["id"],
+            "status": job["status"],
+            "attempts": job.get("attempts", 0),
+            "result": job.get("result"),
+            "error": job.get("error"),
+            "created_at": job["created_at"],
+            "completed_at": job.get("completed_at"),
+        },
+    )
+
+
+async def process_queued_order(job: dict) -> dict:
+    """order_queue handler: process a queued order like the sync webhook would."""
+    user = await db.users.find_one({"id": job["user_id"]}, {"_id": 0})
+    if not user:
+        raise ValueError(f"Restaurant {job['user_id']} no longer exists")
+    result = await _process_order(POSOrderWebhook(**job["payload"]), user)
+    return result.model_dump()
+
+
+async def _process_order(order_data: POSOrderWebhook, user: dict, backfill_at: Optional[str] = None) -> POSResponse:
+    """Validate, find/create the customer, award points and save the order.
+    Shared by the sync webhook, the order queue workers and reconciliation
+    backfills, which pass `backfill_at`: the order is dated then (inside the
+    reconciled day), marked as a backfill and earns no off-peak bonus."""
+    # 1. Validate
+    error = await _validate_order(order_data, user)
+    if error:
+        return error
+
+    now = backfill_at or datetime.now(timezone.utc).isoformat()
+
+    # 2. Loyalty settings
+    settings = await db.loyalty_settings.find_one({"user_id": user["id"]}, {"_id": 0})
+    if not settings:
+        settings = {
+            "min_order_value": 100.0,
+            "bronze_earn_percent": 5.0, "silver_earn_percent": 7.0,
+            "gold_earn_percent": 10.0, "platinum_earn_percent": 15.0,
+            "redemption_value": 0.25,
+            "tier_silver_min": 500, "tier_gold_min": 1500, "tier_platinum_min": 5000,
+            "first_visit_bonus_enabled": False, "first_visit_bonus_points": 50,
+        }
+
+    # 3. Find or create customer
+    customer, is_new, first_visit_bonus = await _find_or_create_customer(
+        order_data, user, settings, now
+    )
+
+    # 4. Calculate points (includes off-peak bonus)
+    pts = _calculate_points(order_data.order_amount, customer, settings, off_peak=not backfill_at)
+    points_earned = pts["total_points"]
 
-        # 3. Find or create customer
-        customer, is_new, first_visit_bonus = await _find_or_create_customer(
-            order_data, user, settings, now
+    # 5. Wallet validation
+    wallet_used = order_data.wallet_used or 0.0
+    current_wallet = customer.get("wallet_balance", 0.0)
+    if wallet_used > current_wallet:
+        return POSResponse(
+            success=False,
+            message=f"Insufficient wallet balance. Available: {current_wallet}, Requested: {wallet_used}",
+            data={"available_balance": current_wallet},
         )
 
-        # 4. Calculate points (includes off-peak bonus)
-        pts = _calculate_points(order_data.order_amount, customer, settings)
-        points_earned = pts["total_points"]
+    # 6. Claim the order. A retried webhook or a queue job run twice stops here,
+    # before the customer is credited
+    order_id = await _claim_order(
+        order_data, user, customer, points_earned, wallet_used, pts["off_peak_bonus"], now,
+        backfilled=bool(backfill_at)
+    )
+    if not order_id:
+        return await _duplicate_order(order_data, user)
+
+    # 7. Update customer stats. Relative to the stored values, so points moved
+    # into a hold (or spent elsewhere) since the customer was read are not restored
+    pipeline = [
+        {"$set": {
+            "total_points": {"$add": [{"$ifNull": ["$total_points", 0]}, points_earned]},
+            "wallet_balance": {"$subtract": [{"$ifNull": ["$wallet_balance", 0.0]}, wallet_used]},
+            "total_visits": {"$add": [{"$ifNull": ["$total_visits", 0]}, 1]},
+            "total_spent": {"$add": [{"$ifNull": ["$total_spent", 0]}, order_data.order_amount]},
+            # A backfilled order may be older than the customer's last visit
+            "last_visit": {"$max": ["$last_visit", {"$literal": now}]},
+        }},
+        {"$set": {"tier": tier_expression("$total_points", settings)}},
+    ]
+    query = {"id": customer["id"]}
+    if wallet_used > 0:
+        query["wallet_balance"] = {"$gte": wallet_used}
+    updated = await db.customers.find_one_and_update(
+        query, pipeline,
+        projection={"_id": 0, "total_points": 1, "tier": 1, "wallet_balance": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        # Nothing was applied: give the order back so the POS can retry it
+        await db.orders.delete_one({"id": order_id})
+        return POSResponse(
+            success=False,
+            message="Insufficient wallet balance",
+            data={"requested": wallet_used},
+        )
+    new_points = updated["total_points"]
+    new_tier = updated["tier"]
+    new_wallet_balance = updated["wallet_balance"]
+    customer_fields = ["total_points", "tier", "wallet_balance", "total_visits", "total_spent", "last_visit"]
+
+    # 8. Save transactions
+    await _save_transactions(
+        order_id, order_data, user, customer, points_earned, new_points,
+        wallet_used, new_wallet_balance, pts["off_peak_bonus"], now,
+        customer_fields=customer_fields,
+    )
+
+    return POSResponse(
+        success=True,
+        message="Order processed successfully",
+        data={
+            "order_id": order_id,
+            "pos_order_id": order_data.order_id,
+            "customer_id": customer["id"],
+            "customer_name": customer.get("name"),
+            "is_new_customer": is_new,
+            "first_visit_bonus_awarded": first_visit_bonus if is_new else 0,
+            "order_amount": order_data.order_amount,
+            "points_earned": points_earned,
+            "off_peak_bonus": pts["off_peak_bonus"],
+            "off_peak_message": pts.get("off_peak_message"),
+            "total_points": new_points,
+            "tier": new_tier,
+            "wallet_used": wallet_used,
+            "wallet_balance_after": new_wallet_balance,
+            "coupon_applied": order_data.coupon_code,
+            "coupon_discount": order_data.coupon_discount or 0.0,
+        },
+    )
+
+
+class POSPointsHoldRequest(BaseModel):
+    """Reserve points for a bill; defaults to the most the bill allows"""
+    cust_mobile: str
+    bill_amount: float
+    points: Optional[int] = None
+
 
-        # 5. Wallet validation
-        wallet_used = order_data.wallet_used or 0.0
-        current_wallet = customer.get("wallet_balance", 0.0)
-        if wallet_used > current_wallet:
+@router.post("/points/hold", response_model=POSResponse)
+async def pos_hold_points(
+    request: POSPointsHoldRequest,
+    user: dict = Depends(verify_pos_api_key)
+):
+    """
+    Reserve points for redemption at checkout. The points leave the available
+    balance until the hold is confirmed, released or expires. Pass the returned
+    hold_id to /webhook/payment-received (or confirm it) to spend them.
+    """
+    settings = await get_pos_settings(user["id"])
+    for _ in range(3):
+        customer = await db.customers.find_one(
+            phone_query(user["id"], request.cust_mobile), {"_id": 0, "id": 1, "total_points": 1}
+        )
+        if not customer:
+            return POSResponse(success=False, message="Customer not found", data={"registered": False})
+        
+        max_points, _ = max_redeemable(customer.get("total_points", 0), request.bill_amount, settings)
+        points = min(request.points, max_points) if request.points else max_points
+        if points <= 0:
             return POSResponse(
                 success=False,
-                message=f"Insufficient wallet balance. Available: {current_wallet}, Requested: {wallet_used}",
-                data={"available_balance": current_wallet},
+                message="No points redeemable on this bill",
+                data={"available_points": customer.get("total_points", 0), "max_points_redeemable": max_points},
             )
-        new_wallet_balance = current_wallet - wallet_used
-
-        # 6. Update customer stats
-        current_points = customer.get("total_points", 0)
-        new_points = current_points + points_earned
-        new_tier = calculate_tier(new_points, settings)
-
-        await db.customers.update_one(
-            {"id": customer["id"]},
-            {"$set": {
-                "total_points": new_points,
-                "tier": new_tier,
-                "wallet_balance": new_wallet_balance,
-                "total_visits": customer.get("total_visits", 0) + 1,
-                "total_spent": customer.get("total_spent", 0) + order_data.order_amount,
-                "last_visit": now,
-            }},
-        )
+        value = points * settings.get("redemption_value", 0.25)
+        hold = await create_hold(user["id"], customer["id"], points, value, request.bill_amount)
+        if hold:
+            return POSResponse(success=True, message="Points held", data={"hold_id": hold.pop("id"), **hold})
+        # Balance moved between the read and the hold; quote again
+    raise HTTPException(status_code=409, detail="Customer balance changed concurrently, please retry")
 
-        # 7. Save order + transactions
-        order_id = await _save_order_and_transactions(
-            order_data, user, customer, points_earned, new_points,
-            wallet_used, new_wallet_balance, pts["off_peak_bonus"], now,
-        )
 
-        return POSResponse(
-            success=True,
-            message="Order processed successfully",
-            data={
-                "order_id": order_id,
-                "pos_order_id": order_data.order_id,
-                "customer_id": customer["id"],
-                "customer_name": customer.get("name"),
-                "is_new_customer": is_new,
-                "first_visit_bonus_awarded": first_visit_bonus if is_new else 0,
-                "order_amount": order_data.order_amount,
-                "points_earned": points_earned,
-                "off_peak_bonus": pts["off_peak_bonus"],
-                "off_peak_message": pts.get("off_peak_message"),
-                "total_points": new_points,
-                "tier": new_tier,
-                "wallet_used": wallet_used,
-                "wallet_balance_after": new_wallet_balance,
-                "coupon_applied": order_data.coupon_code,
-                "coupon_discount": order_data.coupon_discount or 0.0,
-            },
-        )
+@router.post("/points/hold/{hold_id}/confirm", response_model=POSResponse)
+async def pos_confirm_hold(hold_id: str, user: dict = Depends(verify_pos_api_key)):
+    """Spend held points without a payment webhook (e.g. a redemption-only bill)"""
+    tx = await confirm_hold(user["id"], hold_id)
+    if not tx:
+        raise HTTPException(status_code=409, detail="Points hold expired or already used")
+    return POSResponse(
+        success=True,
+        message="Points redeemed",
+        data={"customer_id": tx["customer_id"], "points": tx["points"], "value": tx["value"],
+              "balance_after": tx["balance_after"], "transaction_id": tx["id"]},
+    )
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Order processing failed: {str(e)}")
+
+@router.post("/points/hold/{hold_id}/release", response_model=POSResponse)
+async def pos_release_hold(hold_id: str, user: dict = Depends(verify_pos_api_key)):
+    """Return held points to the customer's balance (checkout abandoned)"""
+    customer, hold = await get_hold(user["id"], hold_id)
+    if not hold or not await release_hold(user["id"], customer["id"], hold):
+        raise HTTPException(status_code=404, detail="Points hold not found")
+    return POSResponse(
+        success=True,
+        message="Points released",
+        data={"customer_id": customer["id"], "points": hold["points"]},
+    )
+
+
+RECONCILE_CONCURRENCY = 8
+
+
+@router.post("/reconcile", response_model=POSResponse)
+async def pos_reconcile(
+    request: Request,
+    date: str = Query(..., description="Business day, YYYY-MM-DD"),
+    pos_id: str = Query(...),
+    restaurant_id: str = Query(...),
+    utc_offset_minutes: int = Query(0, ge=-720, le=840, description="Restaurant's offset from UTC"),
+    backfill: bool = Query(True, description="Process orders missing from the CRM"),
+    user: dict = Depends(verify_pos_api_key)
+):
+    """
+    End-of-day reconciliation. The body is the POS's day file as CSV with
+    order_id, amount and phone columns. Returns a mismatch report against the
+    day's orders; orders missing from the CRM are processed like webhooks unless
+    backfill=false.
+    """
+    if user.get("pos_id") and pos_id != user["pos_id"]:
+        raise HTTPException(status_code=400, detail=f"Invalid pos_id. Expected: {user['pos_id']}")
+    if user.get("restaurant_id") and restaurant_id != user["restaurant_id"]:
+        raise HTTPException(status_code=400, detail=f"Invalid restaurant_id. Expected: {user['restaurant_id']}")
+    try:
+        start, end = day_range(date, utc_offset_minutes)
+        rows, rejected = await parse_day_file(request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    rows.sort(key=lambda r: r["order_id"])
+    orders = await load_day_orders(user["id"], pos_id, restaurant_id, start, end)
+    report = merge_diff(rows, orders)
+    
+    # Orders processed on another day (late webhooks, earlier backfills) are not missing
+    elsewhere = await find_outside_day(
+        user["id"], pos_id, restaurant_id, [r["order_id"] for r in report["missing_in_crm"]]
+    )
+    report["outside_day"] = [r for r in report["missing_in_crm"] if r["order_id"] in elsewhere]
+    report["missing_in_crm"] = [r for r in report["missing_in_crm"] if r["order_id"] not in elsewhere]
+    # Orders accepted in async mode and still waiting in the queue are not lost;
+    # the queue will process them
+    queued = await pending_dedupe_keys(
+        user["id"], [_dedupe_key(pos_id, restaurant_id, r["order_id"]) for r in report["missing_in_crm"]]
+    )
+    report["queued"] = [
+        r for r in report["missing_in_crm"] if _dedupe_key(pos_id, restaurant_id, r["order_id"]) in queued
+    ]
+    report["missing_in_crm"] = [
+        r for r in report["missing_in_crm"] if _dedupe_key(pos_id, restaurant_id, r["order_id"]) not in queued
+    ]
+    
+    # Backfilled orders are dated inside the reconciled day (its last second, or
+    # now while the day is still running) so rollups attribute them to it
+    day_over = datetime.fromisoformat(end) <= datetime.now(timezone.utc)
+    backfill_at = (
+        datetime.fromisoformat(end) - timedelta(seconds=1) if day_over else datetime.now(timezone.utc)
+    ).isoformat()
+    backfilled = []
+    if backfill and report["missing_in_crm"]:
+        # One task per customer keeps each customer's orders in file order
+        by_phone = {}
+        for row in report["missing_in_crm"]:
+            by_phone.setdefault(normalize_phone(row["phone"]) or row["phone"], []).append(row)
+        semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+        
+        async def backfill_customer(customer_rows: list):
+            async with semaphore:
+                for row in customer_rows:
+                    order = POSOrderWebhook(
+                        pos_id=pos_id, restaurant_id=restaurant_id, order_id=row["order_id"],
+                        cust_mobile=row["phone"], order_amount=row["amount"]
+                    )
+                    try:
+                        result = await _process_order(order, user, backfill_at=backfill_at)
+                        backfilled.append({
+                            "order_id": row["order_id"], "success": result.success, "message": result.message,
+                            "crm_order_id": (result.data or {}).get("order_id"),
+                            "points_earned": (result.data or {}).get("points_earned", 0)
+                        })
+                    except Exception as e:
+                        backfilled.append({"order_id": row["order_id"], "success": False, "message": str(e)})
+        
+        await asyncio.gather(*(backfill_customer(r) for r in by_phone.values()))
+        if day_over and any(b["success"] for b in backfilled):
+            # Bills dated before the cohort watermark are only counted by a rebuild
+            await reset_cohorts(user["id"])
+    
+    summary = {
+        "pos_orders": len(rows),
+        "crm_orders": len(orders),
+        "matched": report["matched"],
+        "amount_mismatch": len(report["amount_mismatch"]),
+        "phone_mismatch": len(report["phone_mismatch"]),
+        "missing_in_crm": len(report["missing_in_crm"]),
+        "missing_in_pos": len(report["missing_in_pos"]),
+        "outside_day": len(report["outside_day"]),
+        "queued": len(report["queued"]),
+        "backfilled": sum(1 for b in backfilled if b["success"]),
+        "rejected_lines": len(rejected),
+    }
+    return POSResponse(
+        success=True,
+        message="Reconciliation complete",
+        data={
+            "date": date,
+            "window": {"start": start, "end": end},
+            "summary": summary,
+            **report,
+            "backfilled": backfilled,
+            "rejected_lines": rejected,
+        },
+    )
+
+
+def plan_redemption(current_points: int, requested: Optional[int], bill_amount: float, settings: dict) -> tuple:
+    """Points to redeem against a bill and their value, capped by balance, the
+    redemption limits in settings and the bill itself. Returns (points, amount)."""
+    if not requested or requested <= 0 or current_points < settings.get("min_redemption_points", 100):
+        return 0, 0.0
+    redemption_value = settings.get("redemption_value", 0.25)
+    max_redemption = min(
+        bill_amount * settings.get("max_redemption_percent", 50.0) / 100,
+        settings.get("max_redemption_amount", 500.0)
+    )
+    
+    points = min(requested, current_points)
+    amount = points * redemption_value
+    if amount > max_redemption:
+        amount = max_redemption
+        points = int(amount / redemption_value)
+    if amount > bill_amount:
+        amount = bill_amount
+        points = int(amount / redemption_value)
+    if points <= 0:
+        return 0, 0.0
+    return points, amount
 
 
 @router.post("/webhook/payment-received", response_model=POSResponse)
@@ -904,18 +1346,27 @@ async def pos_payment_received(
     """
     Main POS webhook endpoint - processes payments and manages loyalty points
     """
+    redemption = None
     try:
-        # Find customer by phone
-        customer = await db.customers.find_one({
-            "user_id": user["id"],
-            "phone": webhook_data.customer_phone
-        })
+        changes = []
+        rollup = {}
+        # Customer, settings and coupon are independent reads
+        customer, settings, coupon = await asyncio.gather(
+            db.customers.find_one(phone_query(user["id"], webhook_data.customer_phone)),
+            db.loyalty_settings.find_one({"user_id": user["id"]}, {"_id": 0}),
+            db.coupons.find_one({
+                "user_id": user["id"],
+                "code": webhook_data.coupon_code.upper(),
+                "is_active": True
+            }) if webhook_data.coupon_code else asyncio.sleep(0)
+        )
         
         if not customer:
             # Auto-create customer if not exists
             customer_id = str(uuid.uuid4())
             now = datetime.now(timezone.utc).isoformat()
             
+            # Stored sparsely - unset profile fields fall back to Customer model defaults
             customer = {
                 "id": customer_id,
                 "user_id": user["id"],
@@ -925,116 +1376,34 @@ async def pos_payment_received(
                 # Basic Info
                 "name": f"Customer {webhook_data.customer_phone[-4:]}",
                 "phone": webhook_data.customer_phone,
-                "country_code": "+91",
-                "email": None,
-                "gender": None,
-                "dob": None,
-                "anniversary": None,
-                "preferred_language": None,
+                "phone_e164": normalize_phone(webhook_data.customer_phone),
                 "customer_type": "normal",
-                "segment_tags": [],
-                
-                # Contact & Marketing Permissions
-                "whatsapp_opt_in": False,
-                "whatsapp_opt_in_date": None,
-                "promo_whatsapp_allowed": True,
-                "promo_sms_allowed": True,
-                "email_marketing_allowed": True,
-                "call_allowed": True,
-                "is_blocked": False,
                 
                 # Loyalty Information
                 "total_points": 0,
                 "wallet_balance": 0.0,
                 "tier": "Bronze",
-                "referral_code": None,
-                "referred_by": None,
-                "membership_id": None,
-                "membership_expiry": None,
                 
                 # Spending & Visit Behavior
                 "total_visits": 0,
                 "total_spent": 0.0,
-                "avg_order_value": 0.0,
-                "last_visit": None,
                 "first_visit_date": now,
-                "favorite_category": None,
-                "preferred_payment_mode": None,
                 
                 # Customer Source & Journey
                 "lead_source": "POS",
-                "campaign_source": None,
                 "last_interaction_date": now,
-                "assigned_salesperson": None,
-                
-                # WhatsApp CRM Tracking
-                "last_whatsapp_sent": None,
-                "last_whatsapp_response": None,
-                "last_campaign_clicked": None,
-                "last_coupon_used": None,
-                "automation_status_tag": None,
-                
-                # Corporate Information
-                "gst_name": None,
-                "gst_number": None,
-                "billing_address": None,
-                "credit_limit": None,
-                "payment_terms": None,
-                
-                # Address
-                "address": None,
-                "address_line_2": None,
-                "city": None,
-                "state": None,
-                "pincode": None,
-                "country": None,
-                "delivery_instructions": None,
-                "map_location": None,
-                
-                # Preferences
-                "allergies": [],
-                "favorites": [],
-                
-                # Dining Preferences
-                "preferred_dining_type": None,
-                "preferred_time_slot": None,
-                "favorite_table": None,
-                "avg_party_size": None,
-                "diet_preference": None,
-                "spice_level": None,
-                "cuisine_preference": None,
-                
-                # Special Occasions
-                "kids_birthday": [],
-                "spouse_name": None,
-                "festival_preference": [],
-                "special_dates": [],
-                
-                # Feedback & Flags
-                "last_rating": None,
-                "nps_score": None,
-                "complaint_flag": False,
-                "vip_flag": False,
-                "blacklist_flag": False,
-                
-                # AI/Advanced
-                "predicted_next_visit": None,
-                "churn_risk_score": None,
-                "recommended_offer_type": None,
-                "price_sensitivity_score": None,
-                
-                # Custom Fields
-                "custom_field_1": None,
-                "custom_field_2": None,
-                "custom_field_3": None,
                 
                 # Notes
                 "notes": "Auto-created via POS"
             }
-            await db.customers.insert_one(customer)
+            customer = compact_customer_doc(customer)
+            try:
+                await db.customers.insert_one(customer)
+                changes.append(change(CUSTOMER, customer["id"], "insert"))
+                rollup["new_customers"] = 1
+            except DuplicateKeyError:
+                customer = await db.customers.find_one(phone_query(user["id"], webhook_data.customer_phone))
         
-        # Get loyalty settings
-        settings = await db.loyalty_settings.find_one({"user_id": user["id"]}, {"_id": 0})
         if not settings:
             settings = {
                 "min_order_value": 100.0,
@@ -1061,154 +1430,170 @@ async def pos_payment_received(
         }
         
         final_bill_amount = webhook_data.bill_amount
+        now = datetime.now(timezone.utc).isoformat()
         
-        # Process coupon if provided
-        if webhook_data.coupon_code:
-            coupon = await db.coupons.find_one({
-                "user_id": user["id"],
-                "code": webhook_data.coupon_code.upper(),
-                "is_active": True
-            })
-            
-            if coupon:
-                now = datetime.now(timezone.utc).isoformat()
-                if coupon["start_date"] <= now <= coupon["end_date"]:
-                    if coupon["discount_type"] == "percentage":
-                        discount = (final_bill_amount * coupon["discount_value"]) / 100
-                        if coupon.get("max_discount"):
-                            discount = min(discount, coupon["max_discount"])
-                    else:
-                        discount = min(coupon["discount_value"], final_bill_amount)
-                    
-                    final_bill_amount -= discount
-                    response_data["coupon_applied"] = {
-                        "code": webhook_data.coupon_code,
-                        "discount": round(discount, 2)
-                    }
-                    response_data["transactions"].append({
-                        "type": "coupon",
-                        "amount": round(discount, 2),
-                        "description": f"Coupon {webhook_data.coupon_code} applied"
-                    })
-        
-        # Process points redemption if requested
-        points_redeemed = 0
-        if webhook_data.redeem_points and webhook_data.redeem_points > 0:
-            current_points = customer.get("total_points", 0)
-            min_redemption = settings.get("min_redemption_points", 100)
-            max_redemption_percent = settings.get("max_redemption_percent", 50.0)
-            max_redemption_amount = settings.get("max_redemption_amount", 500.0)
-            redemption_value = settings.get("redemption_value", 0.25)
-            
-            max_redemption_by_percent = (final_bill_amount * max_redemption_percent) / 100
-            max_redemption = min(max_redemption_by_percent, max_redemption_amount)
-            
-            if current_points >= min_redemption:
-                points_to_redeem = min(webhook_data.redeem_points, current_points)
-                redemption_amount = points_to_redeem * redemption_value
-                
-                if redemption_amount > max_redemption:
-                    redemption_amount = max_redemption
-                    points_to_redeem = int(redemption_amount / redemption_value)
-                
-                if redemption_amount > final_bill_amount:
-                    redemption_amount = final_bill_amount
-                    points_to_redeem = int(redemption_amount / redemption_value)
-                
-                if points_to_redeem > 0:
-                    new_points = current_points - points_to_redeem
-                    await db.customers.update_one(
-                        {"id": customer["id"]},
-                        {"$set": {"total_points": new_points}}
-                    )
-                    
-                    tx_doc = {
-                        "id": str(uuid.uuid4()),
-                        "user_id": user["id"],
-                        "customer_id": customer["id"],
-                        "points": points_to_redeem,
-                        "transaction_type": "redeem",
-                        "description": f"Redeemed at POS (Bill: Rs.{webhook_data.bill_amount})",
-                        "bill_amount": webhook_data.bill_amount,
-                        "balance_after": new_points,
-                        "created_at": datetime.now(timezone.utc).isoformat()
-                    }
-                    await db.points_transactions.insert_one(tx_doc)
-                    
-                    final_bill_amount -= redemption_amount
-                    points_redeemed = points_to_redeem
-                    response_data["points_redeemed"] = {
-                        "points": points_to_redeem,
-                        "value": round(redemption_amount, 2)
-                    }
-                    response_data["transactions"].append({
-                        "type": "redeem",
-                        "points": points_to_redeem,
-                        "value": round(redemption_amount, 2),
-                        "description": "Points redeemed"
-                    })
+        # Redeeming the coupon takes its usage atomically; undone below if the payment fails
+        if coupon:
+            try:
+                redemption = await redeem_coupon(
+                    user["id"], webhook_data.coupon_code, customer["id"], final_bill_amount,
+                    webhook_data.channel, coupon=coupon, order_id=webhook_data.bill_id
+                )
+            except CouponRejected as e:
+                response_data["coupon_rejected"] = {"code": webhook_data.coupon_code, "reason": str(e)}
+            else:
+                discount = redemption["discount"]
+                final_bill_amount -= discount
+                response_data["coupon_applied"] = {
+                    "code": webhook_data.coupon_code,
+                    "discount": discount
+                }
+                response_data["transactions"].append({
+                    "type": "coupon",
+                    "amount": discount,
+                    "description": f"Coupon {webhook_data.coupon_code} applied"
+                })
         
-        # Calculate points earned
+        # Earn is based on the gross bill and the tier before this payment
         min_order = settings.get("min_order_value", 100.0)
+        earn_percent = get_earn_percent_for_tier(customer.get("tier", "Bronze"), settings)
         points_earned = 0
-        
         if webhook_data.bill_amount >= min_order:
-            customer_tier = customer.get("tier", "Bronze")
-            earn_percent = get_earn_percent_for_tier(customer_tier, settings)
             points_earned = int(webhook_data.bill_amount * earn_percent / 100)
-            
-            if points_earned > 0:
-                current_points = customer.get("total_points", 0)
-                if points_redeemed > 0:
-                    current_points = current_points - points_redeemed
-                new_points = current_points + points_earned
-                new_tier = calculate_tier(new_points, settings)
-                
-                await db.customers.update_one(
-                    {"id": customer["id"]},
-                    {"$set": {
-                        "total_points": new_points,
-                        "tier": new_tier,
-                        "total_visits": customer.get("total_visits", 0) + 1,
-                        "total_spent": customer.get("total_spent", 0) + webhook_data.bill_amount,
-                        "last_visit": datetime.now(timezone.utc).isoformat()
-                    }}
+        
+        # A hold placed at checkout (POST /pos/points/hold) is spent instead of
+        # computing a redemption here
+        hold = find_hold(customer, webhook_data.hold_id) if webhook_data.hold_id else None
+        if webhook_data.hold_id and not hold:
+            raise HTTPException(status_code=409, detail="Points hold not found or already used")
+        
+        # Redeem -> earn -> visit stats in one conditional write. The balance guard
+        # makes concurrent payments for the same customer safe; if another payment
+        # spent the points first, the redemption is recomputed from the fresh balance.
+        for _ in range(3):
+            if hold:
+                # Held points already left total_points; spending them only clears the hold.
+                # A bill smaller than the hold's value spends the points it covers and
+                # releases the rest back to the balance
+                points_to_redeem, redemption_amount = hold["points"], min(hold["value"], final_bill_amount)
+                if redemption_amount < hold["value"]:
+                    points_to_redeem = int(redemption_amount * hold["points"] / hold["value"])
+                delta = points_earned + hold["points"] - points_to_redeem
+            else:
+                points_to_redeem, redemption_amount = plan_redemption(
+                    customer.get("total_points", 0), webhook_data.redeem_points, final_bill_amount, settings
                 )
-                
-                tx_doc = {
-                    "id": str(uuid.uuid4()),
-                    "user_id": user["id"],
-                    "customer_id": customer["id"],
-                    "points": points_earned,
-                    "transaction_type": "earn",
-                    "description": f"Earned {earn_percent}% on bill of Rs.{webhook_data.bill_amount}",
-                    "bill_amount": webhook_data.bill_amount,
-                    "balance_after": new_points,
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                }
-                await db.points_transactions.insert_one(tx_doc)
-                
-                response_data["points_earned"] = {
-                    "points": points_earned,
-                    "percentage": earn_percent
-                }
-                response_data["new_points"] = new_points
-                response_data["new_tier"] = new_tier
-                response_data["transactions"].append({
-                    "type": "earn",
-                    "points": points_earned,
-                    "description": f"Earned {earn_percent}% on purchase"
-                })
+                delta = points_earned - points_to_redeem
+            new_points_expr = {"$add": [{"$ifNull": ["$total_points", 0]}, delta]}
+            update = {
+                "total_points": new_points_expr,
+                "total_visits": {"$add": [{"$ifNull": ["$total_visits", 0]}, 1]},
+                "total_spent": {"$add": [{"$ifNull": ["$total_spent", 0]}, webhook_data.bill_amount]},
+                "last_visit": {"$literal": now}
+            }
+            if hold:
+                update["held_points"] = {"$subtract": [{"$ifNull": ["$held_points", 0]}, hold["points"]]}
+                update["holds"] = {"$filter": {"input": "$holds", "cond": {"$ne": ["$$this.id", hold["id"]]}}}
+            pipeline = [{"$set": update}]
+            if points_earned > 0:
+                pipeline.append({"$set": {"tier": tier_expression("$total_points", settings)}})
+            
+            query = {"id": customer["id"]}
+            if hold:
+                query["holds"] = open_hold_filter(hold, now)
+            elif points_to_redeem > 0:
+                query["total_points"] = {"$gte": points_to_redeem}
+            before = await db.customers.find_one_and_update(
+                query, pipeline, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+            )
+            if before:
+                break
+            if hold:
+                raise HTTPException(status_code=409, detail="Points hold expired or already used")
+            customer = await db.customers.find_one({"id": customer["id"]}, {"_id": 0}) or customer
         else:
-            await db.customers.update_one(
-                {"id": customer["id"]},
-                {"$set": {
-                    "total_visits": customer.get("total_visits", 0) + 1,
-                    "total_spent": customer.get("total_spent", 0) + webhook_data.bill_amount,
-                    "last_visit": datetime.now(timezone.utc).isoformat()
-                }}
+            raise HTTPException(status_code=409, detail="Customer balance changed concurrently, please retry")
+        
+        # The payment is committed; the coupon use stands from here on
+        redemption = None
+        customer = before
+        response_data["current_points"] = customer.get("total_points", 0)
+        new_points = customer.get("total_points", 0) + delta
+        if hold:
+            balance_after_redeem = customer.get("total_points", 0) + hold["points"] - points_to_redeem
+        else:
+            balance_after_redeem = customer.get("total_points", 0) - points_to_redeem
+        fields = ["total_points", "total_visits", "total_spent", "last_visit"]
+        if points_earned > 0:
+            fields.append("tier")
+        if hold:
+            fields += ["held_points", "holds"]
+        changes.append(change(CUSTOMER, customer["id"], "update", fields))
+        
+        ledger = []
+        if points_to_redeem > 0:
+            ledger.append({
+                "id": str(uuid.uuid4()),
+                "user_id": user["id"],
+                "customer_id": customer["id"],
+                "points": points_to_redeem,
+                "transaction_type": "redeem",
+                "description": f"Redeemed at POS (Bill: Rs.{webhook_data.bill_amount})",
+                "bill_amount": webhook_data.bill_amount,
+                "balance_after": balance_after_redeem,
+                "created_at": now
+            })
+            rollup["points_redeemed"] = points_to_redeem
+            final_bill_amount -= redemption_amount
+            response_data["points_redeemed"] = {
+                "points": points_to_redeem,
+                "value": round(redemption_amount, 2)
+            }
+            response_data["transactions"].append({
+                "type": "redeem",
+                "points": points_to_redeem,
+                "value": round(redemption_amount, 2),
+                "description": "Points redeemed"
+            })
+        
+        if points_earned > 0:
+            new_tier = calculate_tier(new_points, settings)
+            ledger.append({
+                "id": str(uuid.uuid4()),
+                "user_id": user["id"],
+                "customer_id": customer["id"],
+                "points": points_earned,
+                "transaction_type": "earn",
+                "description": f"Earned {earn_percent}% on bill of Rs.{webhook_data.bill_amount}",
+                "bill_amount": webhook_data.bill_amount,
+                "balance_after": new_points,
+                "created_at": now
+            })
+            rollup["points_issued"] = points_earned
+            response_data["points_earned"] = {
+                "points": points_earned,
+                "percentage": earn_percent
+            }
+            response_data["new_points"] = new_points
+            response_data["new_tier"] = new_tier
+            response_data["transactions"].append({
+                "type": "earn",
+                "points": points_earned,
+                "description": f"Earned {earn_percent}% on purchase"
+            })
+        
+        if ledger:
+            await db.points_transactions.insert_many(ledger)
+            changes.extend(
+                change(POINTS_TRANSACTION, tx["id"], "insert", customer_id=customer["id"]) for tx in ledger
             )
         
+        await record_changes(user["id"], changes)
+        today = day_of()
+        await bump_daily(
+            user["id"], today, orders=1, revenue=webhook_data.bill_amount,
+            active_customers=int(is_first_visit_of_day(customer, today)), **rollup
+        )
         response_data["final_bill_amount"] = round(final_bill_amount, 2)
         response_data["original_bill_amount"] = webhook_data.bill_amount
         
@@ -1218,7 +1603,13 @@ async def pos_payment_received(
             data=response_data
         )
     
+    except HTTPException:
+        if redemption:
+            await rollback_redemption(redemption)
+        raise
     except Exception as e:
+        if redemption:
+            await rollback_redemption(redemption)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/customer-lookup", response_model=POSResponse)
@@ -1229,10 +1620,7 @@ async def pos_customer_lookup(
     """
     Look up customer by phone number for POS display
     """
-    customer = await db.customers.find_one({
-        "user_id": user["id"],
-        "phone": lookup_data.phone
-    }, {"_id": 0})
+    customer = await get_card(user["id"], lookup_data.phone)
     
     if not customer:
         return POSResponse(
@@ -1241,27 +1629,12 @@ async def pos_customer_lookup(
             data={"registered": False}
         )
     
-    settings = await db.loyalty_settings.find_one({"user_id": user["id"]}, {"_id": 0})
-    redemption_value = settings.get("redemption_value", 0.25) if settings else 0.25
+    settings = await get_pos_settings(user["id"])
     
     return POSResponse(
         success=True,
         message="Customer found",
-        data={
-            "registered": True,
-            "customer_id": customer["id"],
-            "name": customer["name"],
-            "phone": customer["phone"],
-            "tier": customer.get("tier", "Bronze"),
-            "total_points": customer.get("total_points", 0),
-            "points_value": round(customer.get("total_points", 0) * redemption_value, 2),
-            "wallet_balance": customer.get("wallet_balance", 0.0),
-            "total_visits": customer.get("total_visits", 0),
-            "total_spent": customer.get("total_spent", 0.0),
-            "allergies": customer.get("allergies", []),
-            "favorites": customer.get("favorites", []),
-            "last_visit": customer.get("last_visit")
-        }
+        data=customer_card(customer, settings)
     )
 
 @router.get("/api-key")
@@ -1277,13 +1650,20 @@ async def get_api_key(user: dict = Depends(get_current_user)):
 
 @router.post("/api-key/regenerate")
 async def regenerate_api_key(user: dict = Depends(get_current_user)):
-    """Regenerate API key for POS integration"""
+    """Regenerate API key for POS integration.
+
+    The old key stops working at once on this API process. Other processes cache
+    keys for up to KEY_TTL_SECONDS (core.pos_api_keys) and keep accepting the old
+    key until their entry expires."""
     new_key = generate_api_key()
     await db.users.update_one({"id": user["id"]}, {"$set": {"api_key": new_key}})
+    # Keys are cached by digest, not by restaurant, so drop them all
+    forget_api_keys()
     return {
         "message": "API key regenerated successfully",
         "api_key": new_key,
-        "warning": "Make sure to update your POS system with the new key"
+        "warning": "Make sure to update your POS system with the new key. "
+                   f"The old key may keep working for up to {KEY_TTL_SECONDS} seconds."
     }
 
 
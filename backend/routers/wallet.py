@@ -4,7 +4,10 @@ from datetime import datetime, timezone
 import uuid
 
 from core.database import db
+from core.changes import CUSTOMER, WALLET_TRANSACTION, change, record_changes
+from core.rollups import WALLET_FIELD, bump_daily
 from core.auth import get_current_user
+from core.responses import model_list_response, trusted
 from models.schemas import WalletTransaction, WalletTransactionCreate
 
 router = APIRouter(prefix="/wallet", tags=["Wallet"])
@@ -43,7 +46,13 @@ async def create_wallet_transaction(tx_data: WalletTransactionCreate, user: dict
     }
     
     await db.wallet_transactions.insert_one(tx_doc)
-    return WalletTransaction(**tx_doc)
+    await record_changes(user["id"], [
+        change(CUSTOMER, tx_data.customer_id, "update", ["wallet_balance"]),
+        change(WALLET_TRANSACTION, tx_id, "insert", customer_id=tx_data.customer_id)
+    ])
+    if tx_data.transaction_type in WALLET_FIELD:
+        await bump_daily(user["id"], **{WALLET_FIELD[tx_data.transaction_type]: tx_data.amount})
+    return trusted(WalletTransaction, tx_doc)
 
 @router.get("/transactions/{customer_id}", response_model=List[WalletTransaction])
 async def get_wallet_transactions(customer_id: str, limit: int = 50, user: dict = Depends(get_current_user)):
@@ -51,7 +60,7 @@ async def get_wallet_transactions(customer_id: str, limit: int = 50, user: dict
         {"customer_id": customer_id, "user_id": user["id"]},
         {"_id": 0}
     ).sort("created_at", -1).limit(limit).to_list(limit)
-    return [WalletTransaction(**t) for t in transactions]
+    return model_list_response(WalletTransaction, transactions)
 
 @router.get("/balance/{customer_id}")
 async def get_wallet_balance(customer_id: str, user: dict = Depends(get_current_user)):
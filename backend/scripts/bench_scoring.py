@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Customer Scoring Benchmark
+Times core.customer_scoring.compute_scores on synthetic per-customer features shaped
+like the orders aggregation output. No database is needed; this measures the
+scoring step that runs between the aggregation and the bulk write.
+"""
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from core.customer_scoring import compute_scores  # noqa: E402
+
+
+def make_features(count: int, seed: int = 7) -> dict:
+    """Synthesize feature columns for `count` customers."""
+    rng = np.random.default_rng(seed)
+    now = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), "s")
+    orders = rng.geometric(0.25, count).astype(np.int64)
+    last = now - rng.integers(0, 400 * 86400, count).astype("timedelta64[s]")
+    first = last - (orders - 1) * rng.integers(3 * 86400, 60 * 86400, count).astype("timedelta64[s]")
+    return {
+        "customer_ids": [f"c{i}" for i in range(count)],
+        "first_order": first,
+        "last_order": last,
+        "orders": orders,
+        "spent": orders * rng.gamma(4.0, 150.0, count),
+        "discounted": rng.binomial(orders, 0.2),
+    }
+
+
+def main(customers: int = 500000, repeat: int = 5):
+    features = make_features(customers)
+    now = datetime.now(timezone.utc)
+    compute_scores(features, now)  # warm up
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scores = compute_scores(features, now)
+        samples.append(time.perf_counter() - start)
+
+    risk = scores["churn_risk_score"]
+    print(f"\n{'='*50}")
+    print(f"Customer Scoring Benchmark ({customers} customers, {repeat} runs)")
+    print(f"{'='*50}")
+    print(f"best:   {min(samples) * 1000:8.1f} ms")
+    print(f"median: {sorted(samples)[len(samples) // 2] * 1000:8.1f} ms")
+    print(f"churn >= 60: {(risk >= 60).mean() * 100:.1f}%")
+    for label in ["Low", "Medium", "High"]:
+        print(f"price sensitivity {label}: {(scores['price_sensitivity_score'] == label).mean() * 100:.1f}%")
+    print(f"{'='*50}\n")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark vectorized customer scoring')
+    parser.add_argument('--customers', type=int, default=500000, help='Synthetic customers')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs')
+    args = parser.parse_args()
+
+    main(customers=args.customers, repeat=args.repeat)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Serialization Microbenchmark
+Compares the per-row cost of returning DB customer documents from a list endpoint:
+
+  before: [Customer(**c) for c in docs] + response_model re-validation + stdlib json
+  after:  core.responses.model_list_response (one TypeAdapter pass, pydantic-core JSON)
+
+Both variants run as real FastAPI routes driven in-process, so the numbers include
+FastAPI's own response handling. No database is needed.
+"""
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import List
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from core.helpers import compact_customer_doc  # noqa: E402
+from core.responses import model_list_response  # noqa: E402
+from models.schemas import Customer  # noqa: E402
+
+
+def make_customers(count: int) -> List[dict]:
+    """Synthesize sparse customer documents shaped like the API writes them."""
+    now = datetime.now(timezone.utc)
+    tiers = ["Bronze", "Silver", "Gold", "Platinum"]
+    docs = []
+    for i in range(count):
+        created = (now - timedelta(days=i % 365)).isoformat()
+        docs.append(compact_customer_doc({
+            "id": str(uuid.uuid4()),
+            "user_id": "bench-user",
+            "created_at": created,
+            "updated_at": created,
+            "name": f"Customer {i}",
+            "phone": f"98{i:08d}",
+            "email": f"customer{i}@example.com" if i % 3 == 0 else None,
+            "customer_type": "corporate" if i % 20 == 0 else "normal",
+            "total_points": (i * 37) % 6000,
+            "wallet_balance": float(i % 500),
+            "tier": tiers[i % 4],
+            "total_visits": i % 40,
+            "total_spent": float((i * 113) % 50000),
+            "last_visit": created,
+            "city": "Mumbai" if i % 2 else None,
+            "allergies": ["Peanuts"] if i % 10 == 0 else [],
+            "favorites": ["Paneer Tikka", "Dal Makhani"] if i % 4 == 0 else [],
+            "lead_source": "POS",
+        }))
+    return docs
+
+
+def build_app(docs: List[dict]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/before", response_model=List[Customer])
+    async def before():
+        return [Customer(**c) for c in docs]
+
+    @app.get("/after", response_model=List[Customer])
+    async def after():
+        return model_list_response(Customer, docs)
+
+    return app
+
+
+def bench(client: TestClient, path: str, rows: int, repeat: int) -> dict:
+    client.get(path)  # warm up adapters / route caches
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(path)
+        samples.append(time.perf_counter() - start)
+        assert response.status_code == 200
+        assert len(response.json()) == rows
+    median = statistics.median(samples)
+    return {"median_ms": median * 1000, "per_row_us": median * 1e6 / rows}
+
+
+def main(rows: int = 1000, repeat: int = 20):
+    docs = make_customers(rows)
+    client = TestClient(build_app(docs))
+
+    before = bench(client, "/before", rows, repeat)
+    after = bench(client, "/after", rows, repeat)
+
+    print(f"\n{'='*50}")
+    print(f"Serialization Benchmark ({rows} customers, {repeat} runs)")
+    print(f"{'='*50}")
+    print(f"before: {before['median_ms']:8.2f} ms  {before['per_row_us']:7.2f} us/row")
+    print(f"after:  {after['median_ms']:8.2f} ms  {after['per_row_us']:7.2f} us/row")
+    print(f"speedup: {before['median_ms'] / after['median_ms']:.2f}x")
+    print(f"{'='*50}\n")
+    return {"before": before, "after": after}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark list-endpoint serialization')
+    parser.add_argument('--rows', type=int, default=1000, help='Customers per response')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed requests per variant')
+    args = parser.parse_args()
+
+    main(rows=args.rows, repeat=args.repeat)
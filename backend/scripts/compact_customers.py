@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Customer Compaction Script
+Strips null and default-valued fields from existing customer documents so they
+match the sparse layout written by the API. Missing fields are restored by the
+Customer model on read.
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+from bson import encode
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+# Load environment variables
+ROOT_DIR = Path(__file__).parent.parent
+load_dotenv(ROOT_DIR / '.env')
+sys.path.insert(0, str(ROOT_DIR))
+
+from core.helpers import CUSTOMER_MATERIALIZED_FIELDS, is_customer_default  # noqa: E402
+
+# MongoDB connection
+mongo_url = os.environ['MONGO_URL']
+db_name = os.environ['DB_NAME']
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def fields_to_strip(doc: dict) -> list:
+    """Return the keys of a customer document that hold null/default values."""
+    return [
+        k for k, v in doc.items()
+        if k != "_id" and k not in CUSTOMER_MATERIALIZED_FIELDS and is_customer_default(k, v)
+    ]
+
+
+async def compact_customers(batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False) -> dict:
+    """Compact all customer documents in batches and report the bytes reclaimed."""
+    print(f"\n{'='*50}")
+    print(f"Customer Compaction Tool")
+    print(f"{'='*50}")
+    print(f"Database: {db_name}")
+    print(f"Batch Size: {batch_size}")
+    print(f"Dry Run: {dry_run}")
+    print(f"{'='*50}\n")
+
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+
+    scanned = 0
+    compacted = 0
+    fields_removed = 0
+    bytes_before = 0
+    bytes_after = 0
+    batch = []
+
+    async def flush():
+        if batch and not dry_run:
+            await db.customers.bulk_write(batch, ordered=False)
+        batch.clear()
+
+    cursor = db.customers.find({}, batch_size=batch_size)
+    async for doc in cursor:
+        scanned += 1
+        size = len(encode(doc))
+        bytes_before += size
+
+        strip = fields_to_strip(doc)
+        if not strip:
+            bytes_after += size
+            continue
+
+        compact = {k: v for k, v in doc.items() if k not in strip}
+        bytes_after += len(encode(compact))
+        compacted += 1
+        fields_removed += len(strip)
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$unset": {k: "" for k in strip}}))
+
+        if len(batch) >= batch_size:
+            await flush()
+            print(f"  … {scanned} scanned, {compacted} compacted")
+
+    await flush()
+    client.close()
+
+    reclaimed = bytes_before - bytes_after
+    print(f"\n{'='*50}")
+    print(f"Compaction {'Preview' if dry_run else 'Complete'}!")
+    print(f"Documents Scanned: {scanned}")
+    print(f"Documents Compacted: {compacted}")
+    print(f"Fields Removed: {fields_removed}")
+    print(f"Bytes Before: {bytes_before:,}")
+    print(f"Bytes After: {bytes_after:,}")
+    if bytes_before:
+        print(f"Bytes Reclaimed: {reclaimed:,} ({reclaimed * 100 / bytes_before:.1f}%)")
+    print(f"{'='*50}\n")
+
+    return {
+        "scanned": scanned,
+        "compacted": compacted,
+        "fields_removed": fields_removed,
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "bytes_reclaimed": reclaimed,
+        "dry_run": dry_run
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Strip null/default fields from customer documents')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Documents per bulk write')
+    parser.add_argument('--dry-run', action='store_true', help='Report bytes reclaimable without writing')
+    args = parser.parse_args()
+
+    asyncio.run(compact_customers(batch_size=args.batch_size, dry_run=args.dry_run))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Parquet Export Script
+Streams orders, points/wallet ledgers and customers into partitioned Parquet for
+offline analysis:
+
+    <out>/orders/user_id=<id>/month=<YYYY-MM>/part-0.parquet
+    <out>/points_transactions/user_id=<id>/month=<YYYY-MM>/part-0.parquet
+    <out>/wallet_transactions/user_id=<id>/month=<YYYY-MM>/part-0.parquet
+    <out>/customers/user_id=<id>/snapshot=<YYYY-MM-DD>/part-0.parquet
+
+Columns follow a fixed schema per collection (customer, ledger columns come from
+the API models), so every partition can be read as one dataset. Rows are read in
+cursor batches and written as row groups, keeping memory bounded.
+
+A month exported after it ended is marked closed; closed months are skipped by
+later runs, which only read rows created after the last closed month. The
+current month is rewritten on every run (skip it with --closed-only). Customers
+change in place, so they are exported as a dated snapshot instead.
+"""
+import asyncio
+import json
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import get_args
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from core.database import db, analytics_db, client, ensure_indexes  # noqa: E402
+from core.helpers import CUSTOMER_FIELD_DEFAULTS  # noqa: E402
+from models.schemas import Customer, PointsTransaction, WalletTransaction  # noqa: E402
+
+EXPORT_DIR = ROOT_DIR.parent / 'db_export' / 'parquet'
+BATCH_ROWS = 50000
+PART_FILE = "part-0.parquet"
+CLOSED_MARKER = "_CLOSED"
+
+
+def _arrow_type(annotation):
+    args = [a for a in get_args(annotation) if a is not type(None)]
+    base = args[0] if args else annotation
+    if base is bool:
+        return pa.bool_()
+    if base is int:
+        return pa.int64()
+    if base is float:
+        return pa.float64()
+    if getattr(base, "__origin__", None) is list and get_args(base) == (str,):
+        return pa.list_(pa.string())
+    # Free-form values (dicts, lists of dicts) are stored as JSON text
+    return pa.string()
+
+
+def model_schema(model, extra: list = ()) -> pa.Schema:
+    return pa.schema(
+        [pa.field(name, _arrow_type(field.annotation)) for name, field in model.model_fields.items()]
+        + list(extra)
+    )
+
+
+ORDER_SCHEMA = pa.schema([
+    ("id", pa.string()), ("user_id", pa.string()), ("customer_id", pa.string()),
+    ("pos_id", pa.string()), ("pos_restaurant_id", pa.string()), ("pos_order_id", pa.string()),
+    ("order_amount", pa.float64()), ("wallet_used", pa.float64()),
+    ("coupon_code", pa.string()), ("coupon_discount", pa.float64()),
+    ("points_earned", pa.int64()), ("off_peak_bonus", pa.int64()),
+    ("payment_method", pa.string()), ("payment_status", pa.string()), ("order_type", pa.string()),
+    ("created_at", pa.string()),
+])
+
+# collection -> (schema, partitioned by month)
+EXPORTS = {
+    "orders": (ORDER_SCHEMA, True),
+    "points_transactions": (model_schema(PointsTransaction, [
+        pa.field("order_id", pa.string()), pa.field("expires_at", pa.string())
+    ]), True),
+    "wallet_transactions": (model_schema(WalletTransaction, [pa.field("order_id", pa.string())]), True),
+    "customers": (model_schema(Customer, [pa.field("phone_e164", pa.string())]), False),
+}
+
+
+def _coerce(value, arrow_type):
+    if value is None:
+        return None
+    try:
+        if pa.types.is_string(arrow_type):
+            return value if isinstance(value, str) else json.dumps(value, default=str)
+        if pa.types.is_int64(arrow_type):
+            return int(value)
+        if pa.types.is_float64(arrow_type):
+            return float(value)
+        if pa.types.is_boolean(arrow_type):
+            return bool(value)
+        if pa.types.is_list(arrow_type):
+            return [str(v) for v in value] if isinstance(value, list) else None
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+def to_table(docs: list, schema: pa.Schema, defaults: dict) -> pa.Table:
+    columns = {
+        field.name: [_coerce(doc.get(field.name, defaults.get(field.name)), field.type) for doc in docs]
+        for field in schema
+    }
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+class PartitionWriter:
+    """Writes one partition through a temp file, renamed into place on close."""
+
+    def __init__(self, path: Path, schema: pa.Schema, compression: str):
+        path.mkdir(parents=True, exist_ok=True)
+        self.final = path / PART_FILE
+        self.tmp = path / f".{PART_FILE}.tmp"
+        self.writer = pq.ParquetWriter(self.tmp, schema, compression=compression)
+        self.rows = 0
+
+    def write(self, table: pa.Table):
+        self.writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self, closed: bool = False):
+        self.writer.close()
+        self.tmp.replace(self.final)
+        if closed:
+            (self.final.parent / CLOSED_MARKER).touch()
+
+
+def closed_months(tenant_dir: Path) -> list:
+    """Months whose partition was written after the month ended."""
+    return sorted(
+        p.name.split("=", 1)[1] for p in tenant_dir.glob("month=*") if (p / CLOSED_MARKER).exists()
+    ) if tenant_dir.exists() else []
+
+
+async def export_monthly(collection: str, user_id: str, out: Path, compression: str, closed_only: bool) -> dict:
+    """Stream one tenant's rows in created_at order into per-month partitions."""
+    schema = EXPORTS[collection][0]
+    tenant_dir = out / collection / f"user_id={user_id}"
+    current_month = datetime.now(timezone.utc).strftime("%Y-%m")
+    closed = closed_months(tenant_dir)
+
+    query = {"user_id": user_id}
+    if closed:
+        # Everything up to the last exported closed month is already on disk
+        year, month = int(closed[-1][:4]), int(closed[-1][5:7])
+        next_month = f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+        query["created_at"] = {"$gte": next_month}
+    if closed_only:
+        query.setdefault("created_at", {})["$lt"] = current_month
+
+    cursor = analytics_db[collection].find(query, {"_id": 0}).sort("created_at", 1).batch_size(BATCH_ROWS)
+    writer, month, buffer = None, None, []
+    stats = {"partitions": 0, "rows": 0}
+
+    def flush():
+        if buffer:
+            writer.write(to_table(buffer, schema, {}))
+            buffer.clear()
+
+    async for doc in cursor:
+        doc_month = (doc.get("created_at") or "")[:7]
+        if len(doc_month) != 7:
+            continue
+        if doc_month != month:
+            if writer:
+                flush()
+                writer.close(closed=month < current_month)
+                stats["partitions"] += 1
+            month = doc_month
+            writer = PartitionWriter(tenant_dir / f"month={month}", schema, compression)
+        buffer.append(doc)
+        stats["rows"] += 1
+        if len(buffer) >= BATCH_ROWS:
+            flush()
+
+    if writer:
+        flush()
+        writer.close(closed=month < current_month)
+        stats["partitions"] += 1
+    return stats
+
+
+async def export_snapshot(collection: str, user_id: str, out: Path, compression: str) -> dict:
+    """Export a tenant's current customers once per day."""
+    schema = EXPORTS[collection][0]
+    snapshot = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    path = out / collection / f"user_id={user_id}" / f"snapshot={snapshot}"
+    if (path / PART_FILE).exists():
+        return {"partitions": 0, "rows": 0}
+
+    writer = PartitionWriter(path, schema, compression)
+    buffer = []
+    async for doc in analytics_db[collection].find({"user_id": user_id}, {"_id": 0}).batch_size(BATCH_ROWS):
+        buffer.append(doc)
+        if len(buffer) >= BATCH_ROWS:
+            writer.write(to_table(buffer, schema, CUSTOMER_FIELD_DEFAULTS))
+            buffer.clear()
+    if buffer or not writer.rows:
+        writer.write(to_table(buffer, schema, CUSTOMER_FIELD_DEFAULTS))
+    writer.close()
+    return {"partitions": 1, "rows": writer.rows}
+
+
+async def export_all(out: Path, user_id: str = None, compression: str = "zstd", closed_only: bool = False):
+    """Export every configured collection for one restaurant or all of them."""
+    print(f"\n{'='*50}")
+    print(f"Parquet Export Tool")
+    print(f"{'='*50}")
+    print(f"Export Directory: {out}")
+    print(f"Compression: {compression}")
+    print(f"{'='*50}\n")
+
+    await ensure_indexes()
+    user_filter = {"id": user_id} if user_id else {}
+    users = await db.users.find(user_filter, {"_id": 0, "id": 1}).to_list(None)
+
+    totals = {collection: {"partitions": 0, "rows": 0} for collection in EXPORTS}
+    for user in users:
+        for collection, (_, monthly) in EXPORTS.items():
+            if monthly:
+                result = await export_monthly(collection, user["id"], out, compression, closed_only)
+            else:
+                result = await export_snapshot(collection, user["id"], out, compression)
+            for field in ("partitions", "rows"):
+                totals[collection][field] += result[field]
+
+    for collection, result in totals.items():
+        print(f"✓ {collection}: {result['rows']} rows in {result['partitions']} new partitions")
+
+    print(f"\n{'='*50}")
+    print(f"Export Complete!")
+    print(f"Restaurants: {len(users)}")
+    print(f"Export Location: {out}")
+    print(f"{'='*50}\n")
+
+    client.close()
+    return totals
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export orders, ledgers and customers to partitioned Parquet')
+    parser.add_argument('--out', default=str(EXPORT_DIR), help='Output directory')
+    parser.add_argument('--user-id', help='Only export this restaurant')
+    parser.add_argument('--compression', default='zstd', choices=['zstd', 'snappy', 'gzip', 'none'])
+    parser.add_argument('--closed-only', action='store_true', help='Skip the current, still-changing month')
+    args = parser.parse_args()
+
+    asyncio.run(export_all(Path(args.out), user_id=args.user_id, compression=args.compression,
+                           closed_only=args.closed_only))
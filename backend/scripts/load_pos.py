@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+POS Webhook Load Harness
+Replays synthetic POS traffic against the order and payment webhooks and reports
+throughput and latency percentiles per endpoint as JSON, so runs can be compared
+across commits.
+
+Traffic shape:
+  tenants        each registers through /api/auth/register and gets its own API key
+                 and coupons
+  customers      phones drawn with a Zipf skew, so a few regulars visit often
+  repeat visits  --repeat-rate of requests go to a phone already seen for that tenant
+  coupons        --coupon-rate of requests carry one of the tenant's coupon codes
+  amounts        sampled from db_export/orders.json (order_amount, order_type,
+                 payment_method, coupon share, repeat share); when it has no orders,
+                 bill amounts come from points_transactions.json, then a default
+
+Targets:
+  in-process     default. The ASGI app runs inside this process through
+                 httpx.ASGITransport, lifespan included. Needs MONGO_URL / DB_NAME
+                 (backend/.env) - point DB_NAME at a throwaway database. Rate
+                 limiting is off unless --rate-limits is given.
+  --url          a running server, e.g. uvicorn server:app on a local mongod
+
+Tenants, customers and orders written by a run are left in the database.
+"""
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+EXPORT_DIR = ROOT_DIR.parent / 'db_export'
+ORDERS_PATH = "/api/pos/orders"
+PAYMENT_PATH = "/api/pos/webhook/payment-received"
+DEFAULT_ORDER_TYPES = {"dine_in": 0.5, "takeaway": 0.2, "delivery": 0.3}
+DEFAULT_PAYMENT_METHODS = {"upi": 0.5, "card": 0.3, "cash": 0.2}
+
+
+def _read_export(name: str) -> list:
+    path = EXPORT_DIR / f"{name}.json"
+    if not path.exists():
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_profile() -> dict:
+    """Amount samples and traffic mix taken from the exported data."""
+    orders = _read_export("orders")
+    amounts = [o["order_amount"] for o in orders if o.get("order_amount")]
+    source = "orders.json"
+    if not amounts:
+        amounts = [t["bill_amount"] for t in _read_export("points_transactions") if t.get("bill_amount")]
+        source = "points_transactions.json"
+    if not amounts:
+        amounts = [round(random.Random(7).lognormvariate(6.3, 0.6), 2) for _ in range(1000)]
+        source = "default"
+
+    profile = {
+        "amount_source": source,
+        "amounts": amounts,
+        "order_types": DEFAULT_ORDER_TYPES,
+        "payment_methods": DEFAULT_PAYMENT_METHODS,
+        "coupon_rate": None,
+        "repeat_rate": None,
+    }
+    if orders:
+        types = Counter(o.get("order_type") or "pos" for o in orders)
+        methods = Counter(o["payment_method"] for o in orders if o.get("payment_method"))
+        profile["order_types"] = {k: v / len(orders) for k, v in types.items()}
+        if methods:
+            profile["payment_methods"] = {k: v / sum(methods.values()) for k, v in methods.items()}
+        profile["coupon_rate"] = sum(1 for o in orders if o.get("coupon_code")) / len(orders)
+        seen = set()
+        repeats = 0
+        for o in sorted(orders, key=lambda o: o.get("created_at", "")):
+            repeats += o.get("customer_id") in seen
+            seen.add(o.get("customer_id"))
+        profile["repeat_rate"] = repeats / len(orders)
+    return profile
+
+
+def _pick(rng: random.Random, weights: dict) -> str:
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+class TrafficModel:
+    """Per-tenant customer pools with Zipf-skewed repeat visits."""
+
+    def __init__(self, profile: dict, tenants: List[dict], repeat_rate: float, coupon_rate: float,
+                 payment_share: float, skew: float, seed: int):
+        self.rng = random.Random(seed)
+        self.profile = profile
+        self.tenants = tenants
+        self.repeat_rate = repeat_rate
+        self.coupon_rate = coupon_rate
+        self.payment_share = payment_share
+        self.skew = skew
+        self.seen = defaultdict(list)
+        self.weights = defaultdict(list)
+
+    def _phone(self, tenant_index: int) -> str:
+        seen = self.seen[tenant_index]
+        if seen and self.rng.random() < self.repeat_rate:
+            return self.rng.choices(seen, weights=self.weights[tenant_index])[0]
+        phone = f"9{self.rng.randrange(10**9):09d}"
+        seen.append(phone)
+        # The n-th customer seen gets weight 1/n^skew: early customers become the regulars
+        self.weights[tenant_index].append(1 / len(seen) ** self.skew)
+        return phone
+
+    def next_request(self) -> tuple:
+        """(tenant, path, json body)"""
+        tenant_index = self.rng.randrange(len(self.tenants))
+        tenant = self.tenants[tenant_index]
+        phone = self._phone(tenant_index)
+        amount = round(self.rng.choice(self.profile["amounts"]), 2)
+        coupon = self.rng.choice(tenant["coupons"]) if tenant["coupons"] and self.rng.random() < self.coupon_rate else None
+
+        if self.rng.random() < self.payment_share:
+            return tenant, PAYMENT_PATH, {
+                "customer_phone": phone,
+                "bill_amount": amount,
+                "channel": _pick(self.rng, DEFAULT_ORDER_TYPES),
+                "coupon_code": coupon,
+                "redeem_points": self.rng.choice([None, None, 100, 500]),
+                "bill_id": f"LOAD-B-{uuid.uuid4().hex[:12]}",
+            }
+        return tenant, ORDERS_PATH, {
+            "pos_id": "mygenie",
+            "restaurant_id": tenant["restaurant_id"],
+            "order_id": f"LOAD-{uuid.uuid4().hex[:12]}",
+            "cust_mobile": phone,
+            "cust_name": f"Load {phone[-4:]}",
+            "order_amount": amount,
+            "coupon_code": coupon,
+            "coupon_discount": round(amount * 0.1, 2) if coupon else 0.0,
+            "payment_method": _pick(self.rng, self.profile["payment_methods"]),
+            "order_type": _pick(self.rng, self.profile["order_types"]),
+        }
+
+
+async def create_tenant(client: httpx.AsyncClient, index: int, run_id: str, coupons: int) -> dict:
+    """Register a restaurant, fetch its POS key and create its coupons."""
+    response = await client.post("/api/auth/register", json={
+        "email": f"load-{run_id}-{index}@example.com",
+        "password": "load-test",
+        "restaurant_name": f"Load Test {run_id} #{index}",
+        "phone": f"8{index:09d}",
+    })
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    api_key = (await client.get("/api/pos/api-key", headers=headers)).json()["api_key"]
+
+    codes = []
+    today = datetime.now(timezone.utc)
+    for n in range(coupons):
+        code = f"LOAD{run_id[:4].upper()}{index}X{n}"
+        created = await client.post("/api/coupons", headers=headers, json={
+            "code": code,
+            "discount_type": "percentage" if n % 2 == 0 else "fixed",
+            "discount_value": 10.0 if n % 2 == 0 else 50.0,
+            "start_date": (today - timedelta(days=1)).strftime("%Y-%m-%d"),
+            "end_date": (today + timedelta(days=30)).strftime("%Y-%m-%d"),
+            "usage_limit": None,
+            "per_user_limit": 1000,
+            "min_order_value": 0,
+            "applicable_channels": list(DEFAULT_ORDER_TYPES),
+        })
+        created.raise_for_status()
+        codes.append(code)
+    return {"api_key": api_key, "restaurant_id": f"LOAD-{run_id}-{index}", "coupons": codes}
+
+
+def summarize(samples: List[tuple], elapsed: float) -> dict:
+    """Per-endpoint count, status mix, throughput and latency percentiles (ms)."""
+    by_endpoint = defaultdict(list)
+    for endpoint, status, ok, latency in sorted(samples, key=lambda s: s[0]):
+        by_endpoint[endpoint].append((status, ok, latency))
+    by_endpoint["all"] = [row for rows in list(by_endpoint.values()) for row in rows]
+
+    report = {}
+    for endpoint, rows in by_endpoint.items():
+        latencies = sorted(r[2] * 1000 for r in rows)
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+        report[endpoint] = {
+            "requests": len(rows),
+            "throughput_rps": round(len(rows) / elapsed, 1),
+            "status": dict(Counter(str(r[0]) for r in rows)),
+            "not_success": sum(1 for r in rows if not r[1]),
+            "p50_ms": round(cuts[49], 2),
+            "p95_ms": round(cuts[94], 2),
+            "p99_ms": round(cuts[98], 2),
+            "max_ms": round(latencies[-1], 2),
+            "mean_ms": round(statistics.fmean(latencies), 2),
+        }
+    return report
+
+
+async def drive(client: httpx.AsyncClient, model: TrafficModel, requests_total: int,
+                concurrency: int, async_orders: bool, warmup: int) -> tuple:
+    """Send requests from `concurrency` workers; returns (samples, elapsed seconds)."""
+    samples = []
+    remaining = warmup + requests_total
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            measured = remaining < requests_total
+            tenant, path, body = model.next_request()
+            params = {"async_mode": "true"} if async_orders and path == ORDERS_PATH else None
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=body, params=params, headers={"X-API-Key": tenant["api_key"]})
+                status = response.status_code
+                ok = status < 300 and response.json().get("success", True)
+            except httpx.HTTPError as e:
+                status, ok = type(e).__name__, False
+            if measured:
+                samples.append((path, status, ok, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    profile = load_profile()
+    repeat_rate = args.repeat_rate if args.repeat_rate is not None else (profile["repeat_rate"] or 0.6)
+    coupon_rate = args.coupon_rate if args.coupon_rate is not None else (profile["coupon_rate"] or 0.1)
+    run_id = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async def execute(client):
+        tenants = [await create_tenant(client, i, run_id, args.coupons) for i in range(args.tenants)]
+        model = TrafficModel(profile, tenants, repeat_rate, coupon_rate, args.payment_share, args.skew, args.seed)
+        return await drive(client, model, args.requests, args.concurrency, args.async_orders, args.warmup)
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url.rstrip('/'), timeout=30, limits=limits) as client:
+            samples, elapsed = await execute(client)
+    else:
+        if not args.rate_limits:
+            os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+        from server import app
+
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=30) as client:
+                samples, elapsed = await execute(client)
+
+    return {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "target": args.url or "in-process",
+        "params": {
+            "tenants": args.tenants, "requests": args.requests, "warmup": args.warmup,
+            "concurrency": args.concurrency, "skew": args.skew, "repeat_rate": repeat_rate,
+            "coupon_rate": coupon_rate, "payment_share": args.payment_share,
+            "async_orders": args.async_orders, "seed": args.seed, "amount_source": profile["amount_source"],
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "endpoints": summarize(samples, elapsed),
+    }
+
+
+def main(args):
+    result = asyncio.run(run(args))
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"\n{'='*72}")
+    print(f"POS Load ({result['target']}, {args.requests} requests, concurrency {args.concurrency})")
+    print(f"{'='*72}")
+    print(f"{'endpoint':36} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}  status")
+    for endpoint, stats in result["endpoints"].items():
+        print(f"{endpoint:36} {stats['throughput_rps']:8.1f} {stats['p50_ms']:8.1f} "
+              f"{stats['p95_ms']:8.1f} {stats['p99_ms']:8.1f}  {stats['status']}")
+    print(f"{'='*72}")
+    print(f"Results written to {args.out}\n")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay synthetic POS webhook traffic and report latency')
+    parser.add_argument('--url', help='Base URL of a running server (default: drive the app in-process)')
+    parser.add_argument('--tenants', type=int, default=3, help='Restaurants to register')
+    parser.add_argument('--coupons', type=int, default=2, help='Coupons per restaurant')
+    parser.add_argument('--requests', type=int, default=2000, help='Measured requests')
+    parser.add_argument('--warmup', type=int, default=100, help='Unmeasured requests sent first')
+    parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of customer visit frequency')
+    parser.add_argument('--repeat-rate', type=float, help='Share of requests from a returning customer')
+    parser.add_argument('--coupon-rate', type=float, help='Share of requests carrying a coupon')
+    parser.add_argument('--payment-share', type=float, default=0.3, help='Share of payment webhooks vs orders')
+    parser.add_argument('--async-orders', action='store_true', help='Send orders with ?async_mode=true')
+    parser.add_argument('--rate-limits', action='store_true', help='Keep rate limiting on in-process')
+    parser.add_argument('--seed', type=int, default=7, help='Traffic RNG seed')
+    parser.add_argument('--out', default='load_pos_results.json', help='JSON report path')
+    args = parser.parse_args()
+
+    main(args)
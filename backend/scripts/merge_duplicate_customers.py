@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Duplicate Customer Merge Script
+Back-fills the canonical `phone_e164` key on every customer, merges customers whose
+phones normalize to the same key (ledgers, orders and coupon usage are repointed to
+the oldest customer) and then builds the unique phone index.
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from core.database import db, client, ensure_indexes, record_phone_key_backfill  # noqa: E402
+from core.customer_merge import run_duplicate_merge  # noqa: E402
+
+
+async def merge_all(user_id: str = None, dry_run: bool = False):
+    """Run the duplicate merge for one restaurant or all of them."""
+    print(f"\n{'='*50}")
+    print(f"Duplicate Customer Merge Tool")
+    print(f"{'='*50}")
+    print(f"Dry Run: {dry_run}")
+    print(f"{'='*50}\n")
+
+    user_filter = {"id": user_id} if user_id else {}
+    users = await db.users.find(user_filter, {"_id": 0, "id": 1, "restaurant_name": 1}).to_list(None)
+    settings_by_user = {
+        s["user_id"]: s
+        for s in await db.loyalty_settings.find(
+            {"user_id": {"$in": [u["id"] for u in users]}}, {"_id": 0}
+        ).to_list(None)
+    }
+
+    totals = {"duplicate_groups": 0, "customers_merged": 0, "phone_keys_backfilled": 0, "ledger_rows_rewritten": 0}
+    for user in users:
+        result = await run_duplicate_merge(user["id"], settings_by_user.get(user["id"], {}), dry_run=dry_run)
+        for field in totals:
+            totals[field] += result.get(field, 0)
+        if result["duplicate_groups"] or result["phone_keys_backfilled"]:
+            print(f"✓ {user.get('restaurant_name', user['id'])}: "
+                  f"{result['duplicate_groups']} groups, {result['duplicate_customers']} duplicates, "
+                  f"{result['phone_keys_backfilled']} keys backfilled")
+
+    if not dry_run:
+        await ensure_indexes()
+        if not user_id:
+            # Every restaurant now has phone_e164: lookups can drop the raw-phone fallback
+            await record_phone_key_backfill()
+
+    print(f"\n{'='*50}")
+    print(f"Merge {'Preview' if dry_run else 'Complete'}!")
+    print(f"Restaurants: {len(users)}")
+    print(f"Duplicate Groups: {totals['duplicate_groups']}")
+    print(f"Customers Merged: {totals['customers_merged']}")
+    print(f"Ledger Rows Rewritten: {totals['ledger_rows_rewritten']}")
+    print(f"Phone Keys Backfilled: {totals['phone_keys_backfilled']}")
+    print(f"{'='*50}\n")
+
+    client.close()
+    return totals
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Merge customers that share a canonical phone number')
+    parser.add_argument('--user-id', help='Only process this restaurant')
+    parser.add_argument('--dry-run', action='store_true', help='Report duplicates without writing')
+    args = parser.parse_args()
+
+    asyncio.run(merge_all(user_id=args.user_id, dry_run=args.dry_run))
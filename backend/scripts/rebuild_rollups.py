@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Daily Rollup Rebuild Script
+Recomputes the `daily_rollups` analytics counters from orders, points/wallet
+ledgers, customers and feedback. Run after a bulk import or restore, or to repair
+rollups that drifted from the raw collections.
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from core.database import db, client, ensure_indexes  # noqa: E402
+from core.rollups import rebuild_rollups  # noqa: E402
+
+
+async def rebuild_all(user_id: str = None):
+    """Rebuild rollups for one restaurant or all of them."""
+    print(f"\n{'='*50}")
+    print(f"Daily Rollup Rebuild Tool")
+    print(f"{'='*50}\n")
+
+    await ensure_indexes()
+
+    user_filter = {"id": user_id} if user_id else {}
+    users = await db.users.find(user_filter, {"_id": 0, "id": 1, "restaurant_name": 1}).to_list(None)
+
+    total_days = 0
+    for user in users:
+        result = await rebuild_rollups(user["id"])
+        total_days += result["days"]
+        print(f"✓ {user.get('restaurant_name', user['id'])}: {result['days']} days")
+
+    print(f"\n{'='*50}")
+    print(f"Rebuild Complete!")
+    print(f"Restaurants: {len(users)}")
+    print(f"Rollup Days: {total_days}")
+    print(f"{'='*50}\n")
+
+    client.close()
+    return total_days
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Rebuild daily analytics rollups from raw collections')
+    parser.add_argument('--user-id', help='Only process this restaurant')
+    args = parser.parse_args()
+
+    asyncio.run(rebuild_all(user_id=args.user_id))
@@ -1,26 +1,37 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, APIRouter
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 from datetime import datetime, timezone
 import os
 import logging
 
-from core.database import db, close_db_connection
+from core.database import db, close_db_connection, ensure_indexes
+from core.db_profiler import profile_requests
+from core.order_queue import start_order_workers, stop_order_workers
+from core.rate_limit import RateLimitMiddleware
 from core.scheduler import start_scheduler, stop_scheduler
-from routers import auth, customers, points, wallet, coupons, feedback, whatsapp, pos
+from routers import auth, customers, points, wallet, coupons, feedback, whatsapp, pos, changes
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    await ensure_indexes()
     start_scheduler()
+    start_order_workers(pos.process_queued_order)
     yield
     # Shutdown
+    await stop_order_workers()
     stop_scheduler()
     await close_db_connection()
 
 # Create the main app
-app = FastAPI(title="DinePoints - Loyalty & CRM", lifespan=lifespan)
+app = FastAPI(
+    title="DinePoints - Loyalty & CRM",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -39,6 +50,7 @@ api_router.include_router(feedback.analytics_router)
 api_router.include_router(whatsapp.router)
 api_router.include_router(pos.router)
 api_router.include_router(pos.messaging_router)
+api_router.include_router(changes.router)
 
 # Root routes
 @api_router.get("/")
@@ -56,6 +68,10 @@ api_router.include_router(cron.router)
 # Include the router in the main app
 app.include_router(api_router)
 
+app.middleware("http")(profile_requests)
+# Outside the profiler so refused requests cost nothing; inside CORS so 429/503 carry CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
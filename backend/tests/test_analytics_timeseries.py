@@ -0,0 +1,75 @@
+"""
+Analytics Time Series Tests
+Tests: GET /api/analytics/timeseries buckets rollup metrics by day/week/month,
+fills empty periods and validates its parameters.
+"""
+import pytest
+import requests
+import os
+from datetime import date, timedelta
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+def timeseries(auth_headers, **params):
+    return requests.get(f"{BASE_URL}/api/analytics/timeseries", headers=auth_headers, params=params)
+
+
+class TestTimeseries:
+    """Bucketed trends from daily rollups"""
+
+    def test_default_daily_window(self, auth_headers):
+        response = timeseries(auth_headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["bucket"] == "day" and data["metrics"] == ["revenue", "orders"]
+        assert len(data["series"]) == 30
+        assert all({"period", "revenue", "orders"} <= set(p) for p in data["series"])
+        print(f"✓ 30 daily points returned")
+
+    def test_monthly_buckets_cover_year(self, auth_headers):
+        response = timeseries(auth_headers, bucket="month", start="2025-01-15", end="2025-12-31",
+                              metrics="points_issued,points_redeemed,new_customers,avg_rating")
+        assert response.status_code == 200, response.text
+        periods = [p["period"] for p in response.json()["series"]]
+        assert periods == [f"2025-{m:02d}-01" for m in range(1, 13)]
+        print(f"✓ 12 monthly buckets")
+
+    def test_weekly_buckets_start_monday(self, auth_headers):
+        end = date.today()
+        response = timeseries(auth_headers, bucket="week", start=(end - timedelta(weeks=4)).isoformat(),
+                              end=end.isoformat())
+        assert response.status_code == 200, response.text
+        for point in response.json()["series"]:
+            assert date.fromisoformat(point["period"]).weekday() == 0
+        print(f"✓ Weekly buckets aligned to Monday")
+
+    def test_weekly_sum_matches_daily(self, auth_headers):
+        end = date.today()
+        start = end - timedelta(days=end.weekday())
+        daily = timeseries(auth_headers, start=start.isoformat(), end=end.isoformat(), metrics="revenue,orders").json()
+        weekly = timeseries(auth_headers, bucket="week", start=start.isoformat(), end=end.isoformat(),
+                            metrics="revenue,orders").json()
+        assert len(weekly["series"]) == 1
+        assert weekly["series"][0]["orders"] == sum(p["orders"] for p in daily["series"])
+        print(f"✓ Week total equals sum of its days")
+
+    @pytest.mark.parametrize("params", [
+        {"bucket": "hour"},
+        {"metrics": "revenue,bogus"},
+        {"start": "2025-02-01", "end": "2025-01-01"},
+        {"start": "2015-01-01", "end": "2025-01-01"},
+    ])
+    def test_invalid_parameters(self, auth_headers, params):
+        response = timeseries(auth_headers, **params)
+        assert response.status_code == 400, response.text
+        print(f"✓ Rejected {params}")
@@ -0,0 +1,79 @@
+"""
+Change Feed Tests
+Tests: customer / points / wallet writes append events to the outbox and
+GET /api/changes?since= returns them in sequence order.
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+def latest_seq(auth_headers):
+    """Walk the feed to its head and return the last sequence number"""
+    since = 0
+    while True:
+        data = requests.get(f"{BASE_URL}/api/changes", headers=auth_headers,
+                            params={"since": since, "limit": 5000}).json()
+        if data["next_since"] == since or not data["has_more"]:
+            return data["next_since"]
+        since = data["next_since"]
+
+
+class TestChangeFeed:
+    """Outbox events for customer and ledger writes"""
+
+    def test_customer_lifecycle_events(self, auth_headers):
+        since = latest_seq(auth_headers)
+
+        customer = requests.post(f"{BASE_URL}/api/customers", headers=auth_headers, json={
+            "name": "TEST_Change_Feed", "phone": f"TEST{uuid.uuid4().hex[:7]}"
+        }).json()
+        requests.put(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers,
+                     json={"city": "Pune"})
+        requests.post(f"{BASE_URL}/api/points/transaction", headers=auth_headers, json={
+            "customer_id": customer["id"], "points": 10,
+            "transaction_type": "bonus", "description": "TEST change feed"
+        })
+        requests.post(f"{BASE_URL}/api/wallet/transaction", headers=auth_headers, json={
+            "customer_id": customer["id"], "amount": 50.0,
+            "transaction_type": "credit", "description": "TEST change feed"
+        })
+        requests.delete(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers)
+
+        response = requests.get(f"{BASE_URL}/api/changes", headers=auth_headers, params={"since": since})
+        assert response.status_code == 200, response.text
+        data = response.json()
+        events = data["changes"]
+        seqs = [e["seq"] for e in events]
+        assert seqs == sorted(seqs) and all(s > since for s in seqs)
+        assert data["next_since"] >= max(seqs)
+
+        mine = [e for e in events if e["entity_id"] == customer["id"] or e.get("customer_id") == customer["id"]]
+        ops = [(e["entity"], e["op"]) for e in mine]
+        assert ("customer", "insert") in ops
+        assert ("customer", "delete") in ops
+        assert ("points_transaction", "insert") in ops
+        assert ("wallet_transaction", "insert") in ops
+        update = next(e for e in mine if e["entity"] == "customer" and e["op"] == "update" and "city" in e["fields"])
+        assert "updated_at" in update["fields"]
+        print(f"✓ {len(mine)} change events recorded for the customer")
+
+    def test_entity_filter_and_cursor(self, auth_headers):
+        data = requests.get(f"{BASE_URL}/api/changes", headers=auth_headers,
+                            params={"since": 0, "entity": "customer", "limit": 50}).json()
+        assert all(e["entity"] == "customer" for e in data["changes"])
+        head = latest_seq(auth_headers)
+        empty = requests.get(f"{BASE_URL}/api/changes", headers=auth_headers, params={"since": head}).json()
+        assert empty["next_since"] >= head
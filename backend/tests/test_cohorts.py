@@ -0,0 +1,96 @@
+"""
+Cohort Retention Tests
+Tests: GET /api/analytics/cohorts returns a month x month retention matrix and
+picks up new bills on refresh.
+"""
+import pytest
+import requests
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+def cohorts(auth_headers, fresh=False, **params):
+    headers = {**auth_headers, "Cache-Control": "no-cache"} if fresh else auth_headers
+    response = requests.get(f"{BASE_URL}/api/analytics/cohorts", headers=headers, params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+class TestCohorts:
+    """Acquisition-month x activity-month retention"""
+
+    def test_matrix_shape(self, auth_headers):
+        data = cohorts(auth_headers, months=6)
+        assert len(data["cohorts"]) == 6
+        for i, row in enumerate(data["cohorts"]):
+            # Oldest cohort has 6 months of history, the current one 1
+            assert len(row["active"]) == len(row["retention"]) == 6 - i
+            if row["customers"]:
+                assert row["active"][0] == row["customers"]
+                assert row["retention"][0] == 100.0
+        print(f"✓ 6 cohorts with triangular retention rows")
+
+    def test_new_bill_joins_current_cohort(self, auth_headers):
+        before = cohorts(auth_headers, fresh=True, months=1)["cohorts"][0]["customers"]
+
+        customer = requests.post(f"{BASE_URL}/api/customers", headers=auth_headers, json={
+            "name": "TEST_Cohort", "phone": f"TEST{uuid.uuid4().hex[:7]}"
+        }).json()
+        requests.post(f"{BASE_URL}/api/points/transaction", headers=auth_headers, json={
+            "customer_id": customer["id"], "points": 10, "bill_amount": 500.0,
+            "transaction_type": "earn", "description": "TEST cohort bill"
+        })
+        # Bills are folded in once they are older than the settle window
+        time.sleep(6)
+
+        after = cohorts(auth_headers, fresh=True, months=1)["cohorts"][0]["customers"]
+        assert after == before + 1
+        print(f"✓ Current cohort grew from {before} to {after}")
+
+        requests.delete(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers)
+
+    def test_concurrent_first_reads(self):
+        # A new restaurant has no cohort state yet: every request below races to build it
+        response = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "email": f"test-cohorts-{uuid.uuid4().hex[:8]}@example.com", "password": "test123",
+            "restaurant_name": "TEST Cohorts", "phone": "9000000000"
+        })
+        assert response.status_code == 200, response.text
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+        customer = requests.post(f"{BASE_URL}/api/customers", headers=headers, json={
+            "name": "TEST_Cohort", "phone": f"TEST{uuid.uuid4().hex[:7]}"
+        }).json()
+        requests.post(f"{BASE_URL}/api/points/transaction", headers=headers, json={
+            "customer_id": customer["id"], "points": 10, "bill_amount": 500.0,
+            "transaction_type": "earn", "description": "TEST cohort bill"
+        })
+        time.sleep(6)
+
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            responses = list(pool.map(
+                lambda _: requests.get(f"{BASE_URL}/api/analytics/cohorts", params={"months": 1},
+                                       headers={**headers, "Cache-Control": "no-cache"}),
+                range(6)
+            ))
+        assert all(r.status_code == 200 for r in responses), [r.text for r in responses]
+        assert [r.json()["cohorts"][0]["customers"] for r in responses] == [1] * 6
+        assert cohorts(headers, fresh=True, months=1)["cohorts"][0]["customers"] == 1
+        print("✓ Concurrent first reads built the cohorts once")
+
+    def test_months_validated(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/analytics/cohorts", headers=auth_headers, params={"months": 0})
+        assert response.status_code == 422
+        print(f"✓ months=0 rejected")
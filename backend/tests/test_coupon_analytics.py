@@ -0,0 +1,97 @@
+"""
+Coupon Analytics Tests
+Tests: GET /api/coupons/{id}/analytics aggregates redemptions and GET
+/api/coupons/{id}/usage pages through usage with joined customer details.
+"""
+import pytest
+import requests
+import os
+import uuid
+from datetime import datetime, timedelta
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def redeemed_coupon(auth_headers):
+    """A coupon applied three times by two customers"""
+    coupon = requests.post(f"{BASE_URL}/api/coupons", headers=auth_headers, json={
+        "code": f"TEST_ANALYTICS_{uuid.uuid4().hex[:6]}",
+        "discount_type": "fixed",
+        "discount_value": 50.0,
+        "start_date": datetime.now().strftime("%Y-%m-%d"),
+        "end_date": (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d"),
+        "per_user_limit": 2,
+        "applicable_channels": ["dine_in"]
+    }).json()
+    customers = [
+        requests.post(f"{BASE_URL}/api/customers", headers=auth_headers, json={
+            "name": f"TEST_Coupon_{i}", "phone": f"TEST{uuid.uuid4().hex[:7]}"
+        }).json()
+        for i in range(2)
+    ]
+    for customer, order_value in [(customers[0], 400.0), (customers[0], 600.0), (customers[1], 1000.0)]:
+        response = requests.post(f"{BASE_URL}/api/coupons/apply", headers=auth_headers, params={
+            "code": coupon["code"], "customer_id": customer["id"],
+            "order_value": order_value, "channel": "dine_in"
+        })
+        assert response.status_code == 200, response.text
+
+    yield coupon, customers
+
+    requests.delete(f"{BASE_URL}/api/coupons/{coupon['id']}", headers=auth_headers)
+    for customer in customers:
+        requests.delete(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers)
+
+
+class TestCouponAnalytics:
+    """Joined aggregation instead of per-row customer lookups"""
+
+    def test_summary(self, auth_headers, redeemed_coupon):
+        coupon, _ = redeemed_coupon
+        response = requests.get(f"{BASE_URL}/api/coupons/{coupon['id']}/analytics", headers=auth_headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["redemptions"] == 3
+        assert data["unique_customers"] == 2
+        assert data["discount_given"] == 150.0
+        assert data["order_revenue"] == 2000.0
+        assert data["curve"][-1]["cumulative_redemptions"] == 3
+        print(f"✓ Summary: {data['redemptions']} redemptions, {data['unique_customers']} customers")
+
+    def test_usage_keyset_pages(self, auth_headers, redeemed_coupon):
+        coupon, customers = redeemed_coupon
+        names = {c["id"]: c["name"] for c in customers}
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            response = requests.get(f"{BASE_URL}/api/coupons/{coupon['id']}/usage",
+                                    headers=auth_headers, params=params)
+            assert response.status_code == 200, response.text
+            data = response.json()
+            seen.extend(data["usage"])
+            if not data["has_more"]:
+                break
+            cursor = data["next_cursor"]
+
+        assert len(seen) == 3 and len({u["id"] for u in seen}) == 3
+        assert [u["used_at"] for u in seen] == sorted((u["used_at"] for u in seen), reverse=True)
+        assert all(u["customer_name"] == names[u["customer_id"]] for u in seen)
+        assert data["total_discount_given"] == 150.0
+        print(f"✓ Paged through {len(seen)} usage rows with customer names")
+
+    def test_invalid_cursor(self, auth_headers, redeemed_coupon):
+        coupon, _ = redeemed_coupon
+        response = requests.get(f"{BASE_URL}/api/coupons/{coupon['id']}/usage",
+                                headers=auth_headers, params={"cursor": "garbage"})
+        assert response.status_code == 400
+        print(f"✓ Invalid cursor rejected")
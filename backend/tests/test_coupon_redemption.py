@@ -0,0 +1,113 @@
+"""
+Coupon Redemption Tests
+Tests: /api/coupons/apply and the POS payment webhook share one atomic
+redemption - usage_limit and per_user_limit hold under concurrent applies, the
+POS path records usage, and a failed payment gives the use back.
+"""
+import pytest
+import requests
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def pos_headers(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/pos/api-key", headers=auth_headers)
+    assert response.status_code == 200
+    return {"X-API-Key": response.json()["api_key"], "Content-Type": "application/json"}
+
+
+@pytest.fixture
+def coupon(auth_headers):
+    response = requests.post(f"{BASE_URL}/api/coupons", headers=auth_headers, json={
+        "code": f"TEST_ATOMIC_{uuid.uuid4().hex[:6]}",
+        "discount_type": "fixed",
+        "discount_value": 50.0,
+        "start_date": (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d"),
+        "end_date": (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d"),
+        "usage_limit": 3,
+        "per_user_limit": 1,
+        "min_order_value": 0,
+        "applicable_channels": ["delivery", "takeaway", "dine_in"]
+    })
+    assert response.status_code == 200, response.text
+    coupon = response.json()
+    yield coupon
+    requests.delete(f"{BASE_URL}/api/coupons/{coupon['id']}", headers=auth_headers)
+
+
+def apply(auth_headers, coupon, customer_id):
+    return requests.post(f"{BASE_URL}/api/coupons/apply", headers=auth_headers, params={
+        "code": coupon["code"], "customer_id": customer_id, "order_value": 500, "channel": "dine_in"
+    })
+
+
+def total_used(auth_headers, coupon):
+    return requests.get(f"{BASE_URL}/api/coupons/{coupon['id']}", headers=auth_headers).json()["total_used"]
+
+
+class TestCouponRedemption:
+    """Atomic usage limits shared by the apply endpoint and POS payments"""
+
+    def test_usage_limit_under_concurrency(self, auth_headers, coupon):
+        customers = [str(uuid.uuid4()) for _ in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda c: apply(auth_headers, coupon, c), customers))
+        accepted = [r for r in responses if r.status_code == 200]
+        assert len(accepted) == 3
+        assert all(r.status_code == 400 for r in responses if r.status_code != 200)
+        assert total_used(auth_headers, coupon) == 3
+        print(f"✓ {len(accepted)} of {len(responses)} concurrent applies accepted")
+
+    def test_per_user_limit(self, auth_headers, coupon):
+        customer_id = str(uuid.uuid4())
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = list(pool.map(lambda _: apply(auth_headers, coupon, customer_id), range(4)))
+        assert sum(r.status_code == 200 for r in responses) == 1
+        assert total_used(auth_headers, coupon) == 1
+        print("✓ Same customer redeemed once")
+
+    def test_pos_payment_records_usage(self, auth_headers, pos_headers, coupon):
+        phone = f"95{uuid.uuid4().int % 10**8:08d}"
+        response = requests.post(f"{BASE_URL}/api/pos/webhook/payment-received", headers=pos_headers, json={
+            "customer_phone": phone, "bill_amount": 500, "coupon_code": coupon["code"]
+        })
+        assert response.status_code == 200, response.text
+        data = response.json()["data"]
+        assert data["coupon_applied"]["discount"] == 50.0
+        assert total_used(auth_headers, coupon) == 1
+
+        usage = requests.get(f"{BASE_URL}/api/coupons/{coupon['id']}/usage", headers=auth_headers).json()
+        assert [u["customer_id"] for u in usage["usage"]] == [data["customer_id"]]
+
+        again = requests.post(f"{BASE_URL}/api/pos/webhook/payment-received", headers=pos_headers, json={
+            "customer_phone": phone, "bill_amount": 500, "coupon_code": coupon["code"]
+        })
+        assert "coupon_applied" not in again.json()["data"]
+        assert again.json()["data"]["coupon_rejected"]["reason"] == "You have already used this coupon"
+        requests.delete(f"{BASE_URL}/api/customers/{data['customer_id']}", headers=auth_headers)
+        print("✓ POS payment used the coupon once and recorded usage")
+
+    def test_failed_payment_rolls_back(self, auth_headers, pos_headers, coupon):
+        response = requests.post(f"{BASE_URL}/api/pos/webhook/payment-received", headers=pos_headers, json={
+            "customer_phone": f"95{uuid.uuid4().int % 10**8:08d}", "bill_amount": 500,
+            "coupon_code": coupon["code"], "hold_id": str(uuid.uuid4())
+        })
+        assert response.status_code == 409
+        assert total_used(auth_headers, coupon) == 0
+        usage = requests.get(f"{BASE_URL}/api/coupons/{coupon['id']}/usage", headers=auth_headers).json()
+        assert usage["usage"] == []
+        print("✓ Failed payment gave the coupon use back")
@@ -0,0 +1,72 @@
+"""
+Customer 360 Endpoint Tests
+Tests: GET /api/customers/{id}/360 returns profile, ledgers, orders, feedback
+and expiring-points summary in one response.
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def test_customer(auth_headers):
+    """Create a customer with one points and one wallet transaction"""
+    response = requests.post(f"{BASE_URL}/api/customers", headers=auth_headers, json={
+        "name": "TEST_360_Customer",
+        "phone": f"TEST{uuid.uuid4().hex[:7]}"
+    })
+    assert response.status_code == 200, f"Create failed: {response.text}"
+    customer = response.json()
+
+    requests.post(f"{BASE_URL}/api/points/transaction", headers=auth_headers, json={
+        "customer_id": customer["id"], "points": 40,
+        "transaction_type": "bonus", "description": "TEST_360 bonus"
+    })
+    requests.post(f"{BASE_URL}/api/wallet/transaction", headers=auth_headers, json={
+        "customer_id": customer["id"], "amount": 100.0,
+        "transaction_type": "credit", "description": "TEST_360 top-up"
+    })
+    yield customer
+    requests.delete(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers)
+
+
+class TestCustomer360:
+    """Customer 360 aggregate view"""
+
+    def test_360_contains_all_sections(self, auth_headers, test_customer):
+        response = requests.get(f"{BASE_URL}/api/customers/{test_customer['id']}/360", headers=auth_headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+
+        assert data["customer"]["id"] == test_customer["id"]
+        for key in ["points_transactions", "wallet_transactions", "orders", "feedback"]:
+            assert isinstance(data[key], list)
+        assert any(t["description"] == "TEST_360 bonus" for t in data["points_transactions"])
+        assert any(t["description"] == "TEST_360 top-up" for t in data["wallet_transactions"])
+        assert "expiring_soon" in data["expiring_points"]
+        print("✓ Customer 360 returned all sections")
+
+    def test_360_matches_individual_endpoints(self, auth_headers, test_customer):
+        customer_id = test_customer["id"]
+        data = requests.get(f"{BASE_URL}/api/customers/{customer_id}/360", headers=auth_headers).json()
+        expiring = requests.get(f"{BASE_URL}/api/points/expiring/{customer_id}", headers=auth_headers).json()
+        assert data["expiring_points"]["expiring_soon"] == expiring["expiring_soon"]
+        assert data["customer"]["total_points"] == requests.get(
+            f"{BASE_URL}/api/customers/{customer_id}", headers=auth_headers
+        ).json()["total_points"]
+
+    def test_360_not_found(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/customers/{uuid.uuid4()}/360", headers=auth_headers)
+        assert response.status_code == 404
@@ -0,0 +1,92 @@
+"""
+Customer Card Cache Tests
+Tests: repeated POS lookups are served from the card cache, writes to the
+customer invalidate it, and hit-rate metrics appear in GET /api/cron/status.
+Unknown POS API keys are rejected without being cached.
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def pos_headers(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/pos/api-key", headers=auth_headers)
+    assert response.status_code == 200
+    return {"X-API-Key": response.json()["api_key"], "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def customer(auth_headers):
+    customer = requests.post(f"{BASE_URL}/api/customers", headers=auth_headers, json={
+        "name": "TEST_Card Cache", "phone": f"96{uuid.uuid4().int % 10**8:08d}"
+    }).json()
+    yield customer
+    requests.delete(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers)
+
+
+def card_stats(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/cron/status", headers=auth_headers)
+    assert response.status_code == 200
+    return response.json()["customer_card_cache"]
+
+
+def lookup(pos_headers, phone):
+    response = requests.post(f"{BASE_URL}/api/pos/customer-lookup", headers=pos_headers, json={"phone": phone})
+    assert response.status_code == 200
+    return response.json()["data"]
+
+
+class TestCustomerCardCache:
+    """Per-process POS card cache"""
+
+    def test_repeat_lookup_hits_cache(self, auth_headers, pos_headers, customer):
+        lookup(pos_headers, customer["phone"])
+        before = card_stats(auth_headers)
+        lookup(pos_headers, customer["phone"])
+        after = card_stats(auth_headers)
+        # With several workers the second lookup may land on a cold worker
+        assert after["hits"] + after["misses"] > before["hits"] + before["misses"]
+        assert 0.0 <= after["hit_rate"] <= 1.0
+        print(f"✓ Card cache: {after}")
+
+    def test_points_write_invalidates_card(self, auth_headers, pos_headers, customer):
+        before = lookup(pos_headers, customer["phone"])["total_points"]
+        requests.post(f"{BASE_URL}/api/points/transaction", headers=auth_headers, json={
+            "customer_id": customer["id"], "points": 25, "transaction_type": "bonus",
+            "description": "TEST card invalidation"
+        })
+        after = lookup(pos_headers, customer["phone"])["total_points"]
+        assert after == before + 25
+        print(f"✓ Card refreshed after write: {before} -> {after}")
+
+    def test_profile_update_invalidates_card(self, auth_headers, pos_headers, customer):
+        lookup(pos_headers, customer["phone"])
+        requests.put(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers,
+                     json={"allergies": ["peanuts"]})
+        assert lookup(pos_headers, customer["phone"])["allergies"] == ["peanuts"]
+        print("✓ Allergy update visible on next lookup")
+
+    def test_unknown_api_keys_not_cached(self, auth_headers):
+        before = requests.get(f"{BASE_URL}/api/cron/status", headers=auth_headers).json()["pos_api_key_cache"]
+        for _ in range(20):
+            response = requests.post(f"{BASE_URL}/api/pos/customer-lookup", json={"phone": "9000000000"},
+                                     headers={"X-API-Key": f"TEST-{uuid.uuid4().hex}"})
+            assert response.status_code == 401
+        after = requests.get(f"{BASE_URL}/api/cron/status", headers=auth_headers).json()["pos_api_key_cache"]
+        # Misses are not stored (counts are per worker, so only bound the growth)
+        assert after["entries"] < before["entries"] + 20
+        assert after["entries"] <= after["max_entries"]
+        print(f"✓ 20 unknown API keys rejected, key cache at {after['entries']} entries")
@@ -0,0 +1,72 @@
+"""
+Dashboard Cache Tests
+Tests: /api/analytics/dashboard and /api/customers/segments/stats are served from a
+per-restaurant cache, concurrent loads are coalesced, Cache-Control: no-cache
+recomputes and cron runs invalidate.
+"""
+import pytest
+import requests
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+def cache_stats(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/cron/status", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    return response.json()["result_caches"]
+
+
+class TestDashboardCache:
+    """Per-restaurant result cache for dashboard endpoints"""
+
+    @pytest.mark.parametrize("path", ["/api/analytics/dashboard", "/api/customers/segments/stats"])
+    def test_concurrent_loads_agree(self, auth_headers, path):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(
+                lambda _: requests.get(f"{BASE_URL}{path}", headers=auth_headers), range(8)
+            ))
+        assert all(r.status_code == 200 for r in responses)
+        assert all(r.json() == responses[0].json() for r in responses)
+        print(f"✓ {path}: 8 concurrent loads returned one result")
+
+    def test_stats_reported(self, auth_headers):
+        requests.get(f"{BASE_URL}/api/analytics/dashboard", headers=auth_headers)
+        stats = cache_stats(auth_headers)
+        assert {"dashboard", "segment_stats"} <= set(stats)
+        assert stats["dashboard"]["hits"] + stats["dashboard"]["misses"] > 0
+        print(f"✓ Cache stats: {stats['dashboard']}")
+
+    def test_no_cache_header_recomputes(self, auth_headers):
+        before = requests.get(f"{BASE_URL}/api/analytics/dashboard", headers=auth_headers).json()
+        customer = requests.post(f"{BASE_URL}/api/customers", headers=auth_headers, json={
+            "name": "TEST_Dashboard_Cache", "phone": f"TEST{uuid.uuid4().hex[:7]}"
+        }).json()
+
+        fresh = requests.get(f"{BASE_URL}/api/analytics/dashboard",
+                             headers={**auth_headers, "Cache-Control": "no-cache"}).json()
+        assert fresh["total_customers"] == before["total_customers"] + 1
+        print(f"✓ no-cache read sees the new customer")
+
+        requests.delete(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers)
+
+    def test_cron_run_invalidates(self, auth_headers):
+        requests.get(f"{BASE_URL}/api/analytics/dashboard", headers=auth_headers)
+        response = requests.post(f"{BASE_URL}/api/cron/rebuild-rollups", headers=auth_headers)
+        assert response.status_code == 200
+        misses = cache_stats(auth_headers)["dashboard"]["misses"]
+
+        requests.get(f"{BASE_URL}/api/analytics/dashboard", headers=auth_headers)
+        assert cache_stats(auth_headers)["dashboard"]["misses"] == misses + 1
+        print(f"✓ Rollup rebuild invalidated the cached dashboard")
@@ -0,0 +1,45 @@
+"""
+DB Profiler Tests
+Tests: every response carries a Server-Timing header with its Mongo round trips
+and GET /api/cron/db-profile ranks routes by commands per request.
+"""
+import pytest
+import requests
+import os
+import re
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+class TestDbProfiler:
+    """Request-scoped Mongo command monitoring"""
+
+    def test_server_timing_header(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/customers", headers=auth_headers, params={"limit": 5})
+        assert response.status_code == 200
+        timing = response.headers.get("Server-Timing", "")
+        match = re.search(r'db;dur=([\d.]+);desc="(\d+) mongo commands"', timing)
+        assert match, timing
+        assert int(match.group(2)) >= 1
+        print(f"✓ Server-Timing: {timing}")
+
+    def test_route_report(self, auth_headers):
+        requests.get(f"{BASE_URL}/api/customers", headers=auth_headers, params={"limit": 5})
+        response = requests.get(f"{BASE_URL}/api/cron/db-profile", headers=auth_headers)
+        assert response.status_code == 200, response.text
+        routes = response.json()["routes"]
+        assert any(r["route"] == "GET /api/customers" for r in routes)
+        averages = [r["avg_commands"] for r in routes]
+        assert averages == sorted(averages, reverse=True)
+        row = next(r for r in routes if r["route"] == "GET /api/customers")
+        assert row["max_commands"] >= 1 and row["worst_request_shapes"]
+        print(f"✓ {len(routes)} routes profiled; worst: {routes[0]['route']}")
@@ -0,0 +1,55 @@
+"""
+Phone Normalization Tests
+Tests: customers are keyed on a canonical E.164 phone, so the same number written
+with or without country code / trunk prefix resolves to one customer.
+"""
+import pytest
+import requests
+import os
+import random
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+@pytest.fixture
+def local_phone():
+    """Random 10-digit Indian mobile number"""
+    return f"9{random.randint(100000000, 999999999)}"
+
+
+class TestPhoneNormalization:
+    """Formatting variants of one number map to one customer"""
+
+    def test_duplicate_with_country_code_rejected(self, auth_headers, local_phone):
+        response = requests.post(f"{BASE_URL}/api/customers", headers=auth_headers, json={
+            "name": "TEST_Phone_Local", "phone": local_phone
+        })
+        assert response.status_code == 200, response.text
+        customer_id = response.json()["id"]
+
+        for variant in [f"+91{local_phone}", f"0{local_phone}", f"91 {local_phone[:5]} {local_phone[5:]}"]:
+            dup = requests.post(f"{BASE_URL}/api/customers", headers=auth_headers, json={
+                "name": "TEST_Phone_Variant", "phone": variant
+            })
+            assert dup.status_code == 400, f"{variant} created a duplicate: {dup.text}"
+        print("✓ Formatting variants rejected as duplicates")
+
+        requests.delete(f"{BASE_URL}/api/customers/{customer_id}", headers=auth_headers)
+
+    def test_merge_duplicates_dry_run(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/cron/merge-duplicates", headers=auth_headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["dry_run"] is True
+        assert data["customers_merged"] == 0
+        assert "duplicate_groups" in data
+        print(f"✓ Dry run found {data['duplicate_groups']} duplicate groups")
@@ -0,0 +1,140 @@
+"""
+Points Hold Tests
+Tests: POST /api/pos/points/hold reserves points out of the available balance,
+holds cannot double-spend, a hold is spent by the payment webhook or confirm,
+and release returns the points. A bill smaller than the hold spends only the
+points it covers.
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def pos_headers(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/pos/api-key", headers=auth_headers)
+    assert response.status_code == 200
+    return {"X-API-Key": response.json()["api_key"], "Content-Type": "application/json"}
+
+
+@pytest.fixture
+def customer(auth_headers):
+    customer = requests.post(f"{BASE_URL}/api/customers", headers=auth_headers, json={
+        "name": "TEST_Hold", "phone": f"93{uuid.uuid4().int % 10**8:08d}"
+    }).json()
+    requests.post(f"{BASE_URL}/api/points/transaction", headers=auth_headers, json={
+        "customer_id": customer["id"], "points": 400, "transaction_type": "bonus",
+        "description": "TEST hold balance"
+    })
+    yield customer
+    requests.delete(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers)
+
+
+def hold(pos_headers, customer, points, bill_amount=2000):
+    return requests.post(f"{BASE_URL}/api/pos/points/hold", headers=pos_headers, json={
+        "cust_mobile": customer["phone"], "bill_amount": bill_amount, "points": points
+    })
+
+
+def balance(auth_headers, customer):
+    return requests.get(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers).json()
+
+
+class TestPointsHolds:
+    """Two-phase redemption"""
+
+    def test_hold_reserves_points(self, auth_headers, pos_headers, customer):
+        response = hold(pos_headers, customer, 300)
+        assert response.status_code == 200, response.text
+        data = response.json()["data"]
+        assert data["points"] == 300
+        after = balance(auth_headers, customer)
+        assert after["total_points"] == 100
+        assert after["held_points"] == 300
+
+        # The held points are not available to a second terminal
+        second = hold(pos_headers, customer, 300)
+        assert second.json()["success"] is False or second.json()["data"]["points"] <= 100
+        print(f"✓ Hold {data['hold_id'][:8]} reserved 300 points")
+
+    def test_payment_spends_hold(self, auth_headers, pos_headers, customer):
+        hold_id = hold(pos_headers, customer, 200).json()["data"]["hold_id"]
+        response = requests.post(f"{BASE_URL}/api/pos/webhook/payment-received", headers=pos_headers, json={
+            "customer_phone": customer["phone"], "bill_amount": 2000, "hold_id": hold_id
+        })
+        assert response.status_code == 200, response.text
+        data = response.json()["data"]
+        assert data["points_redeemed"]["points"] == 200
+        after = balance(auth_headers, customer)
+        assert after["held_points"] == 0
+        assert after["total_points"] == 200 + data.get("points_earned", {}).get("points", 0)
+
+        reused = requests.post(f"{BASE_URL}/api/pos/webhook/payment-received", headers=pos_headers, json={
+            "customer_phone": customer["phone"], "bill_amount": 2000, "hold_id": hold_id
+        })
+        assert reused.status_code == 409
+        print("✓ Payment spent the hold once")
+
+    def test_confirm_and_release(self, auth_headers, pos_headers, customer):
+        first = hold(pos_headers, customer, 100).json()["data"]["hold_id"]
+        second = hold(pos_headers, customer, 100).json()["data"]["hold_id"]
+
+        confirmed = requests.post(f"{BASE_URL}/api/pos/points/hold/{first}/confirm", headers=pos_headers)
+        assert confirmed.status_code == 200, confirmed.text
+        assert confirmed.json()["data"]["points"] == 100
+
+        released = requests.post(f"{BASE_URL}/api/pos/points/hold/{second}/release", headers=pos_headers)
+        assert released.status_code == 200
+        after = balance(auth_headers, customer)
+        assert after["total_points"] == 300
+        assert after["held_points"] == 0
+
+        again = requests.post(f"{BASE_URL}/api/pos/points/hold/{second}/release", headers=pos_headers)
+        assert again.status_code == 404
+        print("✓ Confirm spent one hold, release returned the other")
+
+    def test_other_writers_keep_held_points(self, auth_headers, pos_headers, customer):
+        hold(pos_headers, customer, 300)
+        order = requests.post(f"{BASE_URL}/api/pos/orders", headers=pos_headers, json={
+            "pos_id": "mygenie", "restaurant_id": "TEST_HOLD", "order_id": f"TEST-H-{uuid.uuid4().hex[:8]}",
+            "cust_mobile": customer["phone"], "order_amount": 1000
+        }).json()
+        earned = order["data"]["points_earned"] if order["success"] else 0
+        requests.post(f"{BASE_URL}/api/points/transaction", headers=auth_headers, json={
+            "customer_id": customer["id"], "points": 50, "transaction_type": "bonus", "description": "TEST bonus"
+        })
+        requests.post(f"{BASE_URL}/api/points/expire", headers=auth_headers)
+
+        after = balance(auth_headers, customer)
+        assert after["held_points"] == 300
+        assert after["total_points"] + after["held_points"] == 400 + earned + 50
+        print("✓ Order, bonus and expiry left the held points alone")
+
+    def test_small_bill_releases_uncovered_points(self, auth_headers, pos_headers, customer):
+        held = hold(pos_headers, customer, 300).json()["data"]
+        bill_amount = round(held["value"] / 3, 2)
+        response = requests.post(f"{BASE_URL}/api/pos/webhook/payment-received", headers=pos_headers, json={
+            "customer_phone": customer["phone"], "bill_amount": bill_amount, "hold_id": held["hold_id"]
+        })
+        assert response.status_code == 200, response.text
+        data = response.json()["data"]
+        spent = data["points_redeemed"]["points"]
+        assert spent == int(bill_amount * 300 / held["value"])
+        assert data["final_bill_amount"] == 0
+
+        after = balance(auth_headers, customer)
+        assert after["held_points"] == 0
+        assert after["total_points"] == 400 - spent + data.get("points_earned", {}).get("points", 0)
+        print(f"✓ Bill of {bill_amount} spent {spent} of 300 held points, released the rest")
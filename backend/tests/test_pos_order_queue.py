@@ -0,0 +1,111 @@
+"""
+POS Order Queue Tests
+Tests: POST /api/pos/orders?async_mode=true answers 202 with a tracking id,
+retries of the same order share it, queued orders for one customer are applied
+in order, GET /api/pos/orders/status/{id} reports the result, and an order
+delivered several times at once credits the customer once.
+"""
+import pytest
+import requests
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def pos_headers(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/pos/api-key", headers=auth_headers)
+    assert response.status_code == 200
+    return {"X-API-Key": response.json()["api_key"], "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def pos_identity(auth_headers):
+    me = requests.get(f"{BASE_URL}/api/auth/me", headers=auth_headers).json()
+    return me.get("pos_id") or "mygenie", me.get("restaurant_id") or "TEST_REST"
+
+
+def queue_order(pos_headers, pos_identity, phone, order_id, amount):
+    return requests.post(f"{BASE_URL}/api/pos/orders", headers=pos_headers, params={"async_mode": "true"}, json={
+        "pos_id": pos_identity[0], "restaurant_id": pos_identity[1], "order_id": order_id,
+        "cust_mobile": phone, "cust_name": "TEST_Queue", "order_amount": amount
+    })
+
+
+def wait_for(pos_headers, tracking_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        data = requests.get(f"{BASE_URL}/api/pos/orders/status/{tracking_id}", headers=pos_headers).json()["data"]
+        if data["status"] in ("done", "failed"):
+            return data
+        time.sleep(0.5)
+    pytest.fail(f"Order {tracking_id} not processed within {timeout}s")
+
+
+class TestPOSOrderQueue:
+    """Accept-and-queue POS order webhook"""
+
+    def test_queued_orders_processed_in_order(self, pos_headers, pos_identity):
+        phone = f"95{uuid.uuid4().int % 10**8:08d}"
+        order_ids = [f"TEST-Q-{uuid.uuid4().hex[:8]}" for _ in range(3)]
+        responses = [queue_order(pos_headers, pos_identity, phone, oid, 500) for oid in order_ids]
+        for response in responses:
+            assert response.status_code == 202, response.text
+            assert response.json()["data"]["tracking_id"]
+
+        results = [wait_for(pos_headers, r.json()["data"]["tracking_id"]) for r in responses]
+        assert all(r["status"] == "done" for r in results), results
+        assert all(r["result"]["success"] for r in results), results
+        totals = [r["result"]["data"]["total_points"] for r in results]
+        assert totals == sorted(totals)
+        print(f"✓ 3 queued orders applied in order, balances {totals}")
+
+    def test_retry_returns_same_tracking_id(self, pos_headers, pos_identity):
+        phone = f"95{uuid.uuid4().int % 10**8:08d}"
+        order_id = f"TEST-Q-{uuid.uuid4().hex[:8]}"
+        first = queue_order(pos_headers, pos_identity, phone, order_id, 300)
+        retry = queue_order(pos_headers, pos_identity, phone, order_id, 300)
+        assert first.status_code == retry.status_code == 202
+        assert first.json()["data"]["tracking_id"] == retry.json()["data"]["tracking_id"]
+        assert retry.json()["message"] == "Order already queued"
+        print("✓ POS retry deduplicated onto the queued job")
+
+    def test_concurrent_duplicates_credit_once(self, pos_headers, pos_identity):
+        phone = f"95{uuid.uuid4().int % 10**8:08d}"
+        order_id = f"TEST-Q-{uuid.uuid4().hex[:8]}"
+        order = {
+            "pos_id": pos_identity[0], "restaurant_id": pos_identity[1], "order_id": order_id,
+            "cust_mobile": phone, "cust_name": "TEST_Queue", "order_amount": 1000
+        }
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            responses = list(pool.map(
+                lambda _: requests.post(f"{BASE_URL}/api/pos/orders", headers=pos_headers, json=order), range(6)
+            ))
+        assert all(r.status_code == 200 for r in responses), [r.text for r in responses]
+        processed = [r.json() for r in responses if r.json()["success"]]
+        assert len(processed) == 1
+        assert all(r.json()["data"]["duplicate"] for r in responses if not r.json()["success"])
+
+        earned = processed[0]["data"]["points_earned"]
+        follow_up = requests.post(f"{BASE_URL}/api/pos/orders", headers=pos_headers, json={
+            **order, "order_id": f"TEST-Q-{uuid.uuid4().hex[:8]}", "order_amount": 100
+        }).json()["data"]
+        assert follow_up["total_points"] == processed[0]["data"]["total_points"] + follow_up["points_earned"]
+        print(f"✓ 6 concurrent deliveries credited {earned} points once")
+
+    def test_unknown_tracking_id(self, pos_headers):
+        response = requests.get(f"{BASE_URL}/api/pos/orders/status/{uuid.uuid4()}", headers=pos_headers)
+        assert response.status_code == 404
+        print("✓ Unknown tracking id returns 404")
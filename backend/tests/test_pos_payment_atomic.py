@@ -0,0 +1,83 @@
+"""
+POS Payment Atomicity Tests
+Tests: /api/pos/webhook/payment-received applies redeem, earn and visit stats in
+one write, so concurrent payments for the same customer never overdraw points.
+"""
+import pytest
+import requests
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def pos_headers(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/pos/api-key", headers=auth_headers)
+    assert response.status_code == 200
+    return {"X-API-Key": response.json()["api_key"], "Content-Type": "application/json"}
+
+
+@pytest.fixture
+def customer(auth_headers):
+    phone = f"98{uuid.uuid4().int % 10**8:08d}"
+    created = requests.post(f"{BASE_URL}/api/customers", headers=auth_headers, json={
+        "name": "TEST_Atomic Payment", "phone": phone, "country_code": "+91"
+    })
+    assert created.status_code == 200, created.text
+    customer = created.json()
+    requests.post(f"{BASE_URL}/api/points/transaction", headers=auth_headers, json={
+        "customer_id": customer["id"], "points": 300, "transaction_type": "bonus",
+        "description": "TEST_seed balance"
+    })
+    yield customer
+    requests.delete(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers)
+
+
+class TestPOSPaymentAtomic:
+    """Single conditional update for POS payments"""
+
+    def test_redeem_and_earn(self, auth_headers, pos_headers, customer):
+        response = requests.post(f"{BASE_URL}/api/pos/webhook/payment-received", headers=pos_headers, json={
+            "customer_phone": customer["phone"], "bill_amount": 1000, "redeem_points": 200
+        })
+        assert response.status_code == 200, response.text
+        data = response.json()["data"]
+        redeemed = data["points_redeemed"]["points"]
+        earned = data["points_earned"]["points"]
+        assert data["new_points"] == 300 - redeemed + earned
+
+        after = requests.get(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers).json()
+        assert after["total_points"] == data["new_points"]
+        assert after["total_visits"] == customer.get("total_visits", 0) + 1
+        print(f"✓ Redeemed {redeemed}, earned {earned}, balance {after['total_points']}")
+
+    def test_concurrent_redemptions_do_not_overdraw(self, auth_headers, pos_headers, customer):
+        def pay(_):
+            return requests.post(f"{BASE_URL}/api/pos/webhook/payment-received", headers=pos_headers, json={
+                "customer_phone": customer["phone"], "bill_amount": 50, "redeem_points": 100
+            })
+
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            responses = list(pool.map(pay, range(6)))
+        assert all(r.status_code in (200, 409) for r in responses), [r.text for r in responses]
+
+        redeemed = sum(
+            r.json()["data"].get("points_redeemed", {}).get("points", 0)
+            for r in responses if r.status_code == 200
+        )
+        after = requests.get(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers).json()
+        assert redeemed <= 300
+        assert after["total_points"] == 300 - redeemed
+        assert after["total_points"] >= 0
+        print(f"✓ {len(responses)} concurrent payments redeemed {redeemed} of 300 points")
@@ -0,0 +1,98 @@
+"""
+POS Quote Tests
+Tests: POST /api/pos/quote returns the customer card, max redeemable points,
+coupon validity and projected earn in one call, consistent with the separate
+lookup and max-redeemable endpoints.
+"""
+import pytest
+import requests
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def pos_headers(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/pos/api-key", headers=auth_headers)
+    assert response.status_code == 200
+    return {"X-API-Key": response.json()["api_key"], "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def customer(auth_headers):
+    phone = f"97{uuid.uuid4().int % 10**8:08d}"
+    customer = requests.post(f"{BASE_URL}/api/customers", headers=auth_headers, json={
+        "name": "TEST_Quote", "phone": phone
+    }).json()
+    requests.post(f"{BASE_URL}/api/points/transaction", headers=auth_headers, json={
+        "customer_id": customer["id"], "points": 400, "transaction_type": "bonus",
+        "description": "TEST quote balance"
+    })
+    yield customer
+    requests.delete(f"{BASE_URL}/api/customers/{customer['id']}", headers=auth_headers)
+
+
+@pytest.fixture(scope="module")
+def coupon(auth_headers):
+    now = datetime.now(timezone.utc)
+    coupon = requests.post(f"{BASE_URL}/api/coupons", headers=auth_headers, json={
+        "code": f"TESTQ{uuid.uuid4().hex[:6]}".upper(),
+        "discount_type": "fixed", "discount_value": 50,
+        "start_date": (now - timedelta(days=1)).isoformat(),
+        "end_date": (now + timedelta(days=1)).isoformat(),
+        "applicable_channels": ["dine_in"]
+    }).json()
+    yield coupon
+    requests.delete(f"{BASE_URL}/api/coupons/{coupon['id']}", headers=auth_headers)
+
+
+class TestPOSQuote:
+    """Combined checkout quote"""
+
+    def test_quote_matches_separate_calls(self, pos_headers, customer):
+        quote = requests.post(f"{BASE_URL}/api/pos/quote", headers=pos_headers, json={
+            "phone": customer["phone"], "bill_amount": 800
+        })
+        assert quote.status_code == 200, quote.text
+        data = quote.json()["data"]
+
+        lookup = requests.post(f"{BASE_URL}/api/pos/customer-lookup", headers=pos_headers,
+                               json={"phone": customer["phone"]}).json()["data"]
+        assert data["customer"] == lookup
+
+        redeemable = requests.post(f"{BASE_URL}/api/pos/max-redeemable", headers=pos_headers, json={
+            "pos_id": "test", "restaurant_id": "test", "cust_mobile": customer["phone"], "bill_amount": 800
+        }).json()["data"]
+        assert data["redemption"]["max_points_redeemable"] == redeemable["max_points_redeemable"]
+        assert data["points_earned"]["points"] >= 0
+        print(f"✓ Quote: {data['redemption']}, earn {data['points_earned']['points']}")
+
+    def test_quote_with_coupon(self, pos_headers, customer, coupon):
+        data = requests.post(f"{BASE_URL}/api/pos/quote", headers=pos_headers, json={
+            "phone": customer["phone"], "bill_amount": 800, "coupon_code": coupon["code"]
+        }).json()["data"]
+        assert data["coupon"]["valid"] is True
+        assert data["coupon"]["discount"] == 50
+        assert data["payable_after_coupon"] == 750
+        print(f"✓ Coupon {coupon['code']} quoted at Rs.{data['coupon']['discount']}")
+
+    def test_invalid_coupon_and_unknown_customer(self, pos_headers):
+        data = requests.post(f"{BASE_URL}/api/pos/quote", headers=pos_headers, json={
+            "phone": "0000000001", "bill_amount": 500, "coupon_code": "NOSUCHCODE"
+        }).json()["data"]
+        assert data["customer"] == {"registered": False}
+        assert data["coupon"]["valid"] is False
+        assert data["coupon"]["reason"] == "Invalid coupon code"
+        assert data["redemption"]["max_points_redeemable"] == 0
+        print("✓ Unknown customer and invalid coupon reported without errors")
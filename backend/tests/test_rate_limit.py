@@ -0,0 +1,62 @@
+"""
+Rate Limiting Tests
+Tests: per-API-key token buckets refuse bursts over the limit with 429 and
+Retry-After, and limiter/shedding metrics appear in GET /api/cron/status.
+"""
+import pytest
+import requests
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def pos_headers(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/pos/api-key", headers=auth_headers)
+    assert response.status_code == 200
+    return {"X-API-Key": response.json()["api_key"], "Content-Type": "application/json"}
+
+
+def limiter_stats(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/cron/status", headers=auth_headers)
+    assert response.status_code == 200
+    return response.json()["rate_limiting"]
+
+
+class TestRateLimit:
+    """Token-bucket limits and load shedding"""
+
+    def test_metrics_exposed(self, auth_headers):
+        stats = limiter_stats(auth_headers)
+        for field in ("allowed", "limited", "shed", "loop_lag_ms", "pool_waiting", "limits"):
+            assert field in stats
+        print(f"✓ Limiter metrics: {stats}")
+
+    def test_burst_over_limit_gets_429(self, auth_headers, pos_headers):
+        burst = limiter_stats(auth_headers)["limits"]["api_key"]["burst"]
+
+        def lookup(_):
+            return requests.post(f"{BASE_URL}/api/pos/customer-lookup", headers=pos_headers,
+                                 json={"phone": "0000000002"})
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            responses = list(pool.map(lookup, range(int(burst) * 2)))
+        limited = [r for r in responses if r.status_code == 429]
+        assert all(r.status_code in (200, 429, 503) for r in responses)
+        if not limited:
+            pytest.skip("Burst spread over several workers' buckets")
+        assert all(int(r.headers["Retry-After"]) >= 1 for r in limited)
+        print(f"✓ {len(limited)} of {len(responses)} burst requests refused with Retry-After")
+        # Let the bucket refill for later tests
+        time.sleep(3)
@@ -0,0 +1,123 @@
+"""
+Segment Filter Compiler Tests
+Tests: nested AND/OR/NOT rule trees, relative-date rules, legacy flat filters,
+validation errors and index warnings via /api/segments and /api/segments/compile.
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get authorization headers via demo login"""
+    response = requests.post(f"{BASE_URL}/api/auth/demo-login")
+    if response.status_code != 200:
+        pytest.skip("Demo authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "Content-Type": "application/json"}
+
+
+def compile_filters(auth_headers, filters):
+    return requests.post(f"{BASE_URL}/api/segments/compile", headers=auth_headers, json=filters)
+
+
+class TestSegmentCompiler:
+    """Rule tree compilation"""
+
+    def test_nested_rule_tree(self, auth_headers):
+        response = compile_filters(auth_headers, {"and": [
+            {"field": "tier", "op": "in", "value": ["Gold", "Platinum"]},
+            {"or": [
+                {"field": "last_visit", "op": "older_than_days", "value": 45},
+                {"not": {"field": "total_visits", "op": "gte", "value": 3}}
+            ]}
+        ]})
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["index_bounded"] is True
+        assert data["query"]["user_id"]
+        assert isinstance(data["customer_count"], int)
+        print(f"✓ Nested rule tree matched {data['customer_count']} customers")
+
+    def test_or_of_tiers_matches_union(self, auth_headers):
+        gold = compile_filters(auth_headers, {"field": "tier", "op": "eq", "value": "Gold"}).json()
+        silver = compile_filters(auth_headers, {"field": "tier", "op": "eq", "value": "Silver"}).json()
+        either = compile_filters(auth_headers, {"or": [
+            {"field": "tier", "op": "eq", "value": "Gold"},
+            {"field": "tier", "op": "eq", "value": "Silver"}
+        ]}).json()
+        assert either["customer_count"] == gold["customer_count"] + silver["customer_count"]
+
+    def test_not_is_complement(self, auth_headers):
+        rule = {"field": "total_points", "op": "between", "value": [100, 500]}
+        inside = compile_filters(auth_headers, rule).json()["customer_count"]
+        outside = compile_filters(auth_headers, {"not": rule}).json()["customer_count"]
+        total = compile_filters(auth_headers, {}).json()["customer_count"]
+        assert inside + outside == total
+        print("✓ NOT(between) is the complement of between")
+
+    def test_substring_rule_warns(self, auth_headers):
+        data = compile_filters(auth_headers, {"field": "name", "op": "contains", "value": "a"}).json()
+        assert any("index" in w for w in data["plan_warnings"])
+
+    def test_legacy_favorite_food_is_substring(self, auth_headers):
+        data = compile_filters(auth_headers, {"favorite_food": "Biryani"}).json()
+        assert data["query"]["favorites"] == {"$regex": "Biryani", "$options": "i"}
+        assert any("index" in w for w in data["plan_warnings"])
+        print("✓ Legacy favorite_food keeps its case-insensitive substring match")
+
+    def test_invalid_rules_rejected(self, auth_headers):
+        assert compile_filters(auth_headers, {"field": "not_a_field", "op": "eq", "value": 1}).status_code == 400
+        assert compile_filters(auth_headers, {"field": "tier", "op": "gt", "value": 1}).status_code == 400
+        assert compile_filters(auth_headers, {"and": {"field": "tier"}}).status_code == 400
+
+    def test_value_type_mismatch_rejected(self, auth_headers):
+        for rule in [
+            {"field": "held_points", "op": "gte", "value": "abc"},
+            {"field": "total_points", "op": "between", "value": [100, "x"]},
+            {"field": "total_visits", "op": "in", "value": [1, "two"]},
+            {"field": "last_visit", "op": "gt", "value": 5},
+        ]:
+            response = compile_filters(auth_headers, {"and": [rule]})
+            assert response.status_code == 400, (rule, response.text)
+        assert compile_filters(auth_headers, {"field": "total_points", "op": "gte", "value": 100}).status_code == 200
+        print("✓ Mistyped comparison values rejected with 400")
+
+
+class TestSegmentWithRuleTree:
+    """Saving segments that use the rule tree"""
+
+    def test_create_segment_with_rule_tree(self, auth_headers):
+        filters = {"and": [
+            {"field": "last_visit", "op": "older_than_days", "value": 45},
+            {"field": "customer_type", "op": "eq", "value": "normal"}
+        ]}
+        response = requests.post(f"{BASE_URL}/api/segments", headers=auth_headers, json={
+            "name": f"TEST_Lapsed_{uuid.uuid4().hex[:6]}", "filters": filters
+        })
+        assert response.status_code == 200, response.text
+        segment = response.json()
+        assert "plan_warnings" in segment
+
+        expected = compile_filters(auth_headers, filters).json()["customer_count"]
+        assert segment["customer_count"] == expected
+
+        customers = requests.get(f"{BASE_URL}/api/segments/{segment['id']}/customers", headers=auth_headers)
+        assert customers.status_code == 200
+        print(f"✓ Rule-tree segment saved with {segment['customer_count']} customers")
+
+        requests.delete(f"{BASE_URL}/api/segments/{segment['id']}", headers=auth_headers)
+
+    def test_legacy_flat_filters_still_work(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/segments", headers=auth_headers, json={
+            "name": f"TEST_Legacy_{uuid.uuid4().hex[:6]}", "filters": {"tier": "Gold"}
+        })
+        assert response.status_code == 200, response.text
+        segment = response.json()
+        stats = requests.get(f"{BASE_URL}/api/customers/segments/stats", headers=auth_headers).json()
+        assert segment["customer_count"] == stats["by_tier"]["gold"]
+        print(f"✓ Legacy segment count {segment['customer_count']} matches tier stats")
+        requests.delete(f"{BASE_URL}/api/segments/{segment['id']}", headers=auth_headers)
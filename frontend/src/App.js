@@ -2233,16 +2233,11 @@ const CustomerDetailPage = () => {
 
     const fetchData = async () => {
         try {
-            const [customerRes, txRes, walletTxRes, expiringRes] = await Promise.all([
-                api.get(`/customers/${id}`),
-                api.get(`/points/transactions/${id}`),
-                api.get(`/wallet/transactions/${id}`),
-                api.get(`/points/expiring/${id}`)
-            ]);
-            setCustomer(customerRes.data);
-            setTransactions(txRes.data);
-            setWalletTransactions(walletTxRes.data);
-            setExpiringPoints(expiringRes.data);
+            const res = await api.get(`/customers/${id}/360`, { params: { limit: 50 } });
+            setCustomer(res.data.customer);
+            setTransactions(res.data.points_transactions);
+            setWalletTransactions(res.data.wallet_transactions);
+            setExpiringPoints(res.data.expiring_points);
         } catch (err) {
             toast.error("Customer not found");
             navigate("/customers");